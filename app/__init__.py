@@ -1,5 +1,6 @@
 from fastapi import FastAPI
-from app.models.models import engine, Base
+from app.core.config import STATUS_RETENTION_DAYS
+from app.models.models import engine, Base, SessionLocal, add_missing_columns, add_missing_indexes
 
 def create_app():
     # Create FastAPI app
@@ -14,9 +15,37 @@ def create_app():
     async def startup_event():
         # Create database tables
         Base.metadata.create_all(bind=engine)
+        add_missing_columns()
+        add_missing_indexes()
+        
+        # Reports can't survive a restart; drop those past retention
+        from app.services.report_cache import fail_interrupted_reports, evict_reports
+        from app.services.query_plans import check_query_plans
+        db = SessionLocal()
+        try:
+            fail_interrupted_reports(db)
+            evict_reports(db)
+            
+            # Warn if the report queries would scan store_status
+            check_query_plans(db)
+        finally:
+            db.close()
         
         # Load data from CSV files
         from app.utils.helpers import load_csv_data
         load_csv_data()
+        
+        # Compact or drop observations past the retention period in the background
+        if STATUS_RETENTION_DAYS:
+            from app.services.status_retention import retention_job
+            retention_job.start()
+    
+    # Stop retention and write observations still buffered by /ingest_status before exiting
+    @app.on_event("shutdown")
+    def shutdown_event():
+        from app.services.status_buffer import status_buffer
+        from app.services.status_retention import retention_job
+        retention_job.stop()
+        status_buffer.close()
     
     return app 
\ No newline at end of file
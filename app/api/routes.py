@@ -1,67 +1,370 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-import uuid
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+import json
+from datetime import datetime
 import os
-from app.models.models import Report, get_db
-from app.services.report_service import generate_report
+from app.models.models import Report, run_db
+from app.services.report_cache import create_or_reuse_report, create_report_batch
+from app.services.report_formats import FORMATS, get_format, convert_report
+from app.services.report_service import report_output_path
+from app.services.historical_report import backfill_anchors
+from app.services.report_scheduler import report_scheduler, QueueFull
+from app.services.report_windows import parse_windows, format_windows, select_windows
+from app.services.ingest_service import ingest_incremental
+from app.services.instrumentation import report_metrics, ingest_metrics
+from app.services.status_buffer import status_buffer, parse_observations, IngestBufferFull, IngestFailed
+from app.services.status_retention import check_retained_windows
+from app.services.store_uptime_index import store_uptime_index
+from app.services.report_stream import (
+    parse_range, iter_file_range, iter_report_file, gzip_chunks, gzip_chunks_async, accepts_gzip
+)
 
 # Create API router
 router = APIRouter()
 
+# Endpoints touching the database are coroutines that hand their queries to
+# run_db, so a slow query or a commit waiting on a writer never stalls the
+# event loop or other requests
+
+def find_report(db, report_id: str):
+    """The report with an ID, or None. Its columns stay readable after the session closes."""
+    return db.query(Report).filter(Report.id == report_id).first()
+
 @router.get("/trigger_report")
-async def trigger_report(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def trigger_report(
+    priority: int = 0,
+    profile: bool = False,
+    windows: str = None,
+    as_of: datetime = None,
+    as_of_end: datetime = None,
+    every: str = "1d",
+    format: str = "csv"
+):
     """
     Trigger the generation of a new report.
     
+    If the data hasn't changed since a report that is queued, running or
+    complete, that report's ID is returned instead of starting a new one.
+    New reports wait in the job queue; when it is full the request is
+    rejected with 503 and a Retry-After header.
+    
+    With as_of the windows end at that time instead of the newest
+    observation. Adding as_of_end backfills a report every `every` from
+    as_of to as_of_end; the reports are computed together by one job and
+    each has its own ID.
+    
+    Args:
+        priority (int): Priority of the report job, higher runs first
+        profile (bool): Always start a new report and record a stack
+            sampling profile of it (see /report_timings)
+        windows (str): Extra trailing windows to report besides the hour,
+            day and week, e.g. "15m,30d" (m, h, d or w units)
+        as_of (datetime): Time the windows end at, UTC unless it has an offset
+        as_of_end (datetime): Last as_of time of a backfill, inclusive
+        every (str): Interval between the as_of times of a backfill
+        format (str): File format: csv, csv.gz, csv.zst, ndjson, parquet or
+            arrow (the last three need optional packages)
+    
     Returns:
-        dict: A dictionary containing the report ID
+        dict: A dictionary containing the report ID and whether it was
+            reused; backfills also list every report's ID and as_of time
     """
-    # Generate a unique report ID
-    report_id = str(uuid.uuid4())
+    try:
+        windows = format_windows(parse_windows(windows))
+        report_format = get_format(format).name
+        # Live reports only see the observations retention keeps
+        if as_of is None:
+            check_retained_windows(parse_windows(windows))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if as_of_end is not None and as_of is None:
+        raise HTTPException(status_code=400, detail="as_of_end requires as_of")
+    try:
+        anchors = backfill_anchors(as_of, as_of_end, every)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # CSV reports are recorded without a format, like those from before formats existed
+    report_format = None if report_format == "csv" else report_format
     
-    # Create a new report record
-    new_report = Report(id=report_id)
-    db.add(new_report)
-    db.commit()
+    def submit(report_id, priority):
+        report_scheduler.submit(report_id, priority, profile=profile)
+    
+    if as_of_end is not None:
+        try:
+            report_ids = await run_db(
+                create_report_batch, submit, anchors, priority, windows=windows, report_format=report_format
+            )
+        except QueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+        return {
+            "report_id": report_ids[0],
+            "report_ids": report_ids,
+            "as_of": [anchor.isoformat() for anchor in anchors],
+            "cached": False,
+        }
     
-    # Start report generation in a background task
-    background_tasks.add_task(generate_report, report_id, db)
+    # Reuse a report for unchanged data, otherwise queue a new one
+    try:
+        report_id, is_new = await run_db(
+            create_or_reuse_report, submit, priority, reuse=not profile, windows=windows, as_of=anchors[0],
+            report_format=report_format
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
     
-    return {"report_id": report_id}
+    return {"report_id": report_id, "cached": not is_new}
 
 @router.get("/get_report")
-async def get_report(report_id: str, db: Session = Depends(get_db)):
+async def get_report(
+    report_id: str,
+    request: Request,
+    stream: bool = False,
+    follow: bool = False,
+    format: str = None
+):
     """
     Get the status of a report or download the report if it's ready.
     
+    Queued reports report their position in the job queue and running ones
+    how many stores are done.
+    
+    Completed reports are sent in the format they were triggered with, or
+    converted to the requested one (converted files are kept). Downloads
+    honour a single-range Range header, and CSV and ndjson files are sent
+    gzip-compressed when the client accepts it. With stream=true the rows of
+    a CSV report written so far are returned even while it is still
+    running, and follow=true keeps the response open until generation
+    finishes.
+    
     Args:
         report_id (str): The ID of the report to get
+        stream (bool): Stream a partial report instead of returning the status
+        follow (bool): Keep streaming new rows until the report completes
+        format (str): File format to download, e.g. "parquet" (see
+            /trigger_report); defaults to the report's own
         
     Returns:
-        dict or FileResponse: The report status or the report file
+        dict or Response: The report status or the report file
     """
     if not report_id:
         raise HTTPException(status_code=400, detail="report_id is required")
     
-    report = db.query(Report).filter(Report.id == report_id).first()
+    report = await run_db(find_report, report_id)
     if not report:
         raise HTTPException(status_code=404, detail="Report not found")
     
     print(f"Report status: {report.status}, File path: {report.file_path}")
     
+    stored_format = FORMATS[report.format or "csv"]
+    try:
+        report_format = get_format(format) if format else stored_format
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    headers = {
+        "Content-Disposition": f'attachment; filename="report{report_format.extension}"',
+        "Vary": "Accept-Encoding",
+    }
+    # Only text formats are worth compressing again
+    gzip = report_format.name in ("csv", "ndjson") and accepts_gzip(request.headers.get("accept-encoding"))
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    
+    if report.status == "Queued":
+        # A backfill's reports wait as its first one
+        return {"status": "Queued", "queue_position": report_scheduler.queue_position(report.batch_id or report_id)}
+    
+    if report.status == "Cancelled":
+        return {"status": "Cancelled"}
+    
     if report.status == "Running":
-        return {"status": "Running"}
+        if (stream or follow) and (stored_format.name != "csv" or report_format != stored_format):
+            raise HTTPException(status_code=409, detail="Only CSV reports can be streamed while running")
+        if not (stream or follow) or not report.file_path or not os.path.exists(report.file_path):
+            return {
+                "status": "Running",
+                "stores_done": report.stores_done,
+                "stores_total": report.stores_total,
+                "percent_complete": round(100 * (report.stores_done or 0) / report.stores_total, 1)
+                if report.stores_total else 0.0,
+            }
+        chunks = iter_report_file(report_id, report.file_path, follow=follow)
+        headers["X-Report-Status"] = "Running"
+        return StreamingResponse(gzip_chunks_async(chunks) if gzip else chunks, media_type="text/csv", headers=headers)
     
     if report.status == "Complete":
         # Check if file exists
-        if report.file_path and os.path.exists(report.file_path):
-            return FileResponse(
-                path=report.file_path, 
-                filename="report.csv", 
-                media_type="text/csv"
-            )
-        else:
+        if not report.file_path or not os.path.exists(report.file_path):
             raise HTTPException(status_code=500, detail=f"Report file not found at {report.file_path}")
+        
+        path = report.file_path
+        if report_format != stored_format:
+            path = report_output_path(report_id, report_format)
+            if not os.path.exists(path):
+                await run_in_threadpool(convert_report, report.file_path, stored_format, path, report_format)
+        
+        size = os.path.getsize(path)
+        range_header = request.headers.get("range")
+        if range_header:
+            try:
+                start, end = parse_range(range_header, size)
+            except ValueError:
+                raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                                    headers={"Content-Range": f"bytes */{size}"})
+            # Ranges address the uncompressed file
+            headers.pop("Content-Encoding", None)
+            headers.update({
+                "Accept-Ranges": "bytes",
+                "Content-Range": f"bytes {start}-{end}/{size}",
+                "Content-Length": str(end - start + 1),
+            })
+            return StreamingResponse(iter_file_range(path, start, end),
+                                     status_code=206, media_type=report_format.media_type, headers=headers)
+        
+        if gzip:
+            chunks = iter_file_range(path, 0, size - 1)
+            return StreamingResponse(gzip_chunks(chunks), media_type=report_format.media_type, headers=headers)
+        
+        return FileResponse(
+            path=path, 
+            filename=f"report{report_format.extension}", 
+            media_type=report_format.media_type,
+            headers={"Accept-Ranges": "bytes"}
+        )
+    
+    raise HTTPException(status_code=500, detail="Report generation failed") 
+
+@router.post("/cancel_report")
+async def cancel_report(report_id: str):
+    """
+    Cancel a queued or running report.
+    
+    Args:
+        report_id (str): The ID of the report to cancel
+        
+    Returns:
+        dict: "Cancelled" if the report was dropped from the queue, or
+            "Cancelling" if it is running and will stop at its next progress update
+    """
+    report = await run_db(find_report, report_id)
+    if not report:
+        raise HTTPException(status_code=404, detail="Report not found")
+    
+    # Cancelling a queued report writes its status; a backfill is cancelled as a whole
+    job_id = report.batch_id or report_id
+    status = await run_db(lambda db: report_scheduler.cancel(job_id))
+    if status is None:
+        raise HTTPException(status_code=409, detail=f"Report is {report.status}, not queued or running")
+    
+    return {"report_id": report_id, "status": status}
+
+@router.get("/report_timings")
+async def report_timings(report_id: str):
+    """
+    Get the per-phase timings of a finished report run.
+    
+    Args:
+        report_id (str): The ID of the report
+        
+    Returns:
+        dict: Total seconds, stores per second, query count, exclusive seconds
+            and calls per phase, and the profile file if one was recorded
+    """
+    report = await run_db(find_report, report_id)
+    if not report:
+        raise HTTPException(status_code=404, detail="Report not found")
+    if not report.timings:
+        raise HTTPException(status_code=409, detail=f"Report is {report.status}, timings are recorded when it finishes")
+    
+    return {"report_id": report_id, **json.loads(report.timings)}
+
+@router.get("/stores/{store_id}/uptime")
+async def store_uptime(store_id: str, windows: str = "hour,day,week"):
+    """
+    Get one store's uptime and downtime without generating a report.
+    
+    Served from an in-memory index of recent observations that is refreshed
+    as data is ingested. Values are those of the store's row in a report of
+    the same data.
+    
+    Args:
+        store_id (str): The store
+        windows (str): Trailing windows to compute: hour, day, week or
+            lengths like "15m" or "30d" (m, h, d or w units)
+    
+    Returns:
+        dict: The current timestamp, and uptime, downtime and unit per window
+    """
+    try:
+        windows = select_windows(windows)
+        check_retained_windows(windows)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    result = await run_db(lambda db: store_uptime_index.uptime(store_id, windows, db))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Store not found")
+    return result
+
+@router.get("/metrics")
+def metrics():
+    """
+    Report job and live ingestion metrics in the Prometheus text format.
+    
+    Returns:
+        Response: Job counts and durations, per-phase time, throughput, job
+            queue gauges and ingest counters, buffer gauges and latencies
+    """
+    return PlainTextResponse(
+        report_metrics.render(report_scheduler.stats()) + ingest_metrics.render(status_buffer.stats()),
+        media_type="text/plain; version=0.0.4"
+    )
+
+@router.post("/ingest_csv")
+def ingest_csv():
+    """
+    Ingest rows added to the CSV files since the last load.
+    
+    Returns:
+        dict: Rows appended, stores updated and elapsed seconds
+    """
+    return ingest_incremental()
+
+@router.post("/ingest_status")
+async def ingest_status(request: Request, wait: bool = False):
+    """
+    Ingest store status observations as they are polled.
+    
+    The body is one observation, a list of them or {"observations": [...]},
+    each with store_id, timestamp_utc and status ("active" or "inactive").
+    Observations are buffered and written to store_status in group commits
+    (see INGEST_BATCH_ROWS and INGEST_FLUSH_MS); polls already stored are
+    skipped. When the buffer is full the request waits for room and is
+    rejected with 503 and a Retry-After header if none is made in time.
+    With wait, observations that couldn't be written after
+    INGEST_FLUSH_ATTEMPTS tries are also answered with 503, to be posted
+    again.
+    
+    Args:
+        wait (bool): Respond only once the observations are committed
+    
+    Returns:
+        dict: Number of observations accepted and whether they are committed
+    """
+    body = await request.body()
+    
+    def submit():
+        records = parse_observations(json.loads(body))
+        return status_buffer.submit(records, wait=wait)
+    
+    # Parsing and waiting for room happen off the event loop
+    try:
+        accepted = await run_in_threadpool(submit)
+    except (IngestBufferFull, IngestFailed) as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    raise HTTPException(status_code=500, detail="Report generation failed") 
\ No newline at end of file
+    return {"accepted": accepted, "committed": wait}
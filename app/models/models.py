@@ -1,13 +1,58 @@
-from sqlalchemy import Column, String, Integer, DateTime, Time, create_engine
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import (
+    Column, String, Integer, BigInteger, Float, Boolean, DateTime, Time, Text, Index, PrimaryKeyConstraint,
+    create_engine, event, inspect, text
+)
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from sqlalchemy.pool import QueuePool
+from datetime import datetime, timedelta
+from app.core.config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_API_THREADS, SQLITE_WAL, SQLITE_BUSY_TIMEOUT,
+    STATUS_PARTITION_BY_DAY
+)
 
-# Define database URL
-DATABASE_URL = "sqlite:///./app/store_monitor.db"
+def create_database_engine(url=DATABASE_URL):
+    """
+    Create the engine for a database URL.
+    
+    Connections are pooled (DB_POOL_SIZE, DB_MAX_OVERFLOW); server
+    connections are pinged before reuse. SQLite connections may be shared
+    across threads, wait up to SQLITE_BUSY_TIMEOUT for locks and, with
+    SQLITE_WAL, use the write-ahead log so readers don't block the writer
+    and vice versa.
+    """
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite':
+        return create_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=True)
+    
+    if url.database in (None, '', ':memory:'):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    
+    sqlite_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT},
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+    )
+    
+    @event.listens_for(sqlite_engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if SQLITE_WAL:
+            # Persistent in the file; NORMAL sync is durable enough with WAL
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+    
+    return sqlite_engine
 
 # Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_database_engine()
 
 # Create session maker
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -17,15 +62,43 @@ Base = declarative_base()
 
 class StoreStatus(Base):
     __tablename__ = "store_status"
+    __table_args__ = (
+        # Per-store window queries seek to the store and range over time
+        # without touching the table: status and id (the rowid) are in the index
+        Index('ix_store_status_store_time_status', 'store_id', 'timestamp_utc', 'status'),
+        # One poll per store and instant; duplicate polls are dropped on load
+        Index('ux_store_status_store_time', 'store_id', 'timestamp_utc', unique=True),
+        # Daily range partitions on PostgreSQL (see ensure_status_partitions)
+        {'postgresql_partition_by': 'RANGE (timestamp_utc)', 'info': {'partition_key': 'timestamp_utc'}}
+        if STATUS_PARTITION_BY_DAY else {},
+    )
 
     id = Column(Integer, primary_key=True)
-    store_id = Column(String(50), nullable=False, index=True)
+    store_id = Column(String(50), nullable=False)
     timestamp_utc = Column(DateTime, nullable=False, index=True)
     status = Column(String(10), nullable=False)
     
     def __repr__(self):
         return f"<StoreStatus store_id={self.store_id} timestamp={self.timestamp_utc} status={self.status}>"
 
+class StoreStatusInterval(Base):
+    __tablename__ = "store_status_interval"
+    __table_args__ = (
+        # As-of reports read the intervals of a store range overlapping their span
+        Index('ix_store_status_interval_store_start', 'store_id', 'start_utc'),
+    )
+
+    # A run of polls with the same status compacted out of store_status by retention
+    id = Column(Integer, primary_key=True)
+    store_id = Column(String(50), nullable=False)
+    start_utc = Column(DateTime, nullable=False)  # first poll of the run
+    end_utc = Column(DateTime, nullable=False)  # last poll of the run
+    status = Column(String(10), nullable=False)
+    observations = Column(Integer, nullable=False)  # polls the interval replaces
+    
+    def __repr__(self):
+        return f"<StoreStatusInterval store_id={self.store_id} {self.start_utc}-{self.end_utc} status={self.status}>"
+
 class BusinessHours(Base):
     __tablename__ = "business_hours"
 
@@ -48,22 +121,243 @@ class StoreTimezone(Base):
     def __repr__(self):
         return f"<StoreTimezone store_id={self.store_id} timezone={self.timezone_str}>"
 
+class StoreUptimeHourly(Base):
+    __tablename__ = "store_uptime_hourly"
+
+    # What the report calculator needs of a store's observations in one complete UTC hour
+    store_id = Column(String(50), primary_key=True)
+    hour_start = Column(DateTime, primary_key=True)  # UTC
+    observations = Column(Integer, nullable=False)
+    first_utc = Column(DateTime)  # first observation of the hour
+    first_open = Column(Boolean)  # whether it was within business hours
+    first_active = Column(Boolean)
+    last_utc = Column(DateTime)  # last observation of the hour
+    last_open = Column(Boolean)
+    last_active = Column(Boolean)
+    first_open_utc = Column(DateTime)  # first observation of the hour within business hours
+    # Microseconds between consecutive observations within business hours that
+    # end in the hour and start at an active one, and how many such gaps there are
+    up_us = Column(BigInteger, nullable=False)
+    up_pairs = Column(Integer, nullable=False)
+    # Latest observation within business hours up to the end of the hour, carried into the next
+    open_utc = Column(DateTime)
+    open_active = Column(Boolean)
+    
+    def __repr__(self):
+        return f"<StoreUptimeHourly store_id={self.store_id} hour={self.hour_start} observations={self.observations}>"
+
 class Report(Base):
     __tablename__ = "report"
 
     id = Column(String(50), primary_key=True)
-    status = Column(String(10), default="Running")
+    status = Column(String(10), default="Running")  # Queued, Running, Complete, Failed or Cancelled
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     file_path = Column(String(200), nullable=True)
+    data_version = Column(String(64), nullable=True, index=True)  # fingerprint of the input data
+    priority = Column(Integer, nullable=True)  # higher runs first
+    queued_at = Column(DateTime, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    stores_done = Column(Integer, nullable=True)
+    stores_total = Column(Integer, nullable=True)
+    windows = Column(String(200), nullable=True)  # extra report windows, e.g. "15m,30d"
+    timings = Column(Text, nullable=True)  # JSON per-phase timings of the run
+    as_of = Column(DateTime, nullable=True)  # UTC end of the windows; the newest observation if NULL
+    batch_id = Column(String(50), nullable=True, index=True)  # first report of a backfill computed together
+    format = Column(String(20), nullable=True)  # file format, see report_formats.FORMATS; csv if NULL
     
     def __repr__(self):
         return f"<Report id={self.id} status={self.status}>"
 
+class ReportShard(Base):
+    __tablename__ = "report_shard"
+
+    id = Column(Integer, primary_key=True)
+    report_id = Column(String(50), nullable=False, index=True)
+    shard_index = Column(Integer, nullable=False)
+    first_store_id = Column(String(50), nullable=False)
+    last_store_id = Column(String(50), nullable=False)
+    store_count = Column(Integer, nullable=False)
+    status = Column(String(10), default="Queued")
+    stores_done = Column(Integer, default=0)
+    error = Column(String(500), nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+    # Shards published to the queue of the distributed engine
+    max_timestamp = Column(DateTime, nullable=True)  # end of the reporting window; NULL for the parallel engine
+    calculator = Column(String(20), nullable=True)
+    worker_id = Column(String(100), nullable=True)  # holder of the lease
+    lease_expires_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, nullable=True)  # claims so far
+    result = Column(Text, nullable=True)  # CSV rows uploaded by the worker, until merged
+    
+    def __repr__(self):
+        return f"<ReportShard report_id={self.report_id} shard={self.shard_index} status={self.status}>"
+
+class IngestWatermark(Base):
+    __tablename__ = "ingest_watermark"
+
+    source = Column(String(200), primary_key=True)
+    byte_offset = Column(Integer, nullable=False, default=0)
+    max_timestamp = Column(DateTime, nullable=True)
+    file_size = Column(Integer, nullable=True)
+    file_mtime = Column(Float, nullable=True)
+    head_digest = Column(String(64), nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<IngestWatermark source={self.source} offset={self.byte_offset}>"
+
+# Tables computed from others, e.g. the hourly rollup brought up to date by its next refresh
+DERIVED_TABLES = {'store_uptime_hourly'}
+
+def add_missing_columns(bind=engine):
+    """
+    Add columns defined on the models but missing from existing tables.
+    
+    create_all only creates tables that don't exist yet, so columns added to a
+    model later are appended with ALTER TABLE, together with their indexes.
+    Such columns must be nullable; existing rows get NULL. Tables in
+    DERIVED_TABLES are dropped and created afresh instead, to be refilled
+    from the tables they are derived from.
+    """
+    inspector = inspect(bind)
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            missing = [column for column in table.columns if column.name not in existing]
+            if missing and table.name in DERIVED_TABLES:
+                print(f"Recreating {table.name} with its new columns")
+                table.drop(bind=connection)
+                table.create(bind=connection)
+                continue
+            for column in missing:
+                column_type = column.type.compile(dialect=bind.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            if missing:
+                for index in table.indexes:
+                    index.create(bind=connection, checkfirst=True)
+
+@compiles(PrimaryKeyConstraint, "postgresql")
+def _compile_primary_key(constraint, compiler, **kw):
+    # The primary key of a partitioned table must include the partition key
+    partition_key = constraint.table.info.get('partition_key')
+    if partition_key is None or partition_key in constraint.columns:
+        return compiler.visit_primary_key_constraint(constraint, **kw)
+    columns = [column.name for column in constraint.columns] + [partition_key]
+    return f"PRIMARY KEY ({', '.join(columns)})"
+
+def ensure_status_partitions(connection, timestamps):
+    """
+    Create the daily store_status partitions that rows about to be inserted need.
+    
+    Only does anything on PostgreSQL with a partitioned store_status. Call it
+    before inserting rows: a row without a partition for its day is rejected.
+    
+    Args:
+        connection: Connection or session that will insert the rows
+        timestamps: The timestamp_utc values of the rows
+    """
+    if engine.dialect.name != 'postgresql' or 'partition_key' not in StoreStatus.__table__.info:
+        return
+    for day in sorted({timestamp.date() for timestamp in timestamps}):
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS store_status_p{day:%Y%m%d} PARTITION OF store_status "
+            f"FOR VALUES FROM ('{day}') TO ('{day + timedelta(days=1)}')"
+        ))
+
+# Indexes made redundant by ones defined on the models, dropped when migrating
+SUPERSEDED_INDEXES = {
+    'store_status': ['ix_store_status_store_id'],
+}
+
+def add_missing_indexes(bind=engine):
+    """
+    Create indexes defined on the models but missing from existing tables.
+    
+    Lets an existing database pick up new indexes in place, without a reload.
+    Rows that would violate a new unique index are deleted first, keeping the
+    earliest inserted one. Superseded indexes are dropped and the planner
+    statistics are refreshed with ANALYZE.
+    
+    Returns:
+        dict: Rows deleted before creating each new index, by index name
+    """
+    created = {}
+    with bind.begin() as connection:
+        inspector = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                print(f"Creating index {index.name}...")
+                created[index.name] = drop_duplicate_rows(connection, index) if index.unique else 0
+                index.create(bind=connection)
+            for name in SUPERSEDED_INDEXES.get(table.name, []):
+                if name in existing:
+                    connection.execute(text(f"DROP INDEX {name}"))
+        
+        # Rollup buckets were computed with the duplicates; rebuild them on the next refresh
+        if any(created.get(index.name) for index in StoreStatus.__table__.indexes):
+            connection.execute(StoreUptimeHourly.__table__.delete())
+        
+        if created:
+            connection.execute(text("ANALYZE"))
+    return created
+
+def drop_duplicate_rows(connection, index):
+    """
+    Delete the rows that would violate a unique index.
+    
+    The row with the lowest primary key of every duplicate group is kept.
+    
+    Returns:
+        int: Number of rows deleted
+    """
+    table = index.table
+    key = table.primary_key.columns.values()[0].name
+    columns = ", ".join(column.name for column in index.columns)
+    deleted = connection.execute(text(
+        f"DELETE FROM {table.name} WHERE {key} NOT IN "
+        f"(SELECT MIN({key}) FROM {table.name} GROUP BY {columns})"
+    )).rowcount
+    if deleted:
+        print(f"Dropped {deleted} duplicate rows from {table.name} ({columns})")
+    return deleted
+
 # Dependency to get DB session
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+# Database work of async endpoints; bounded so requests queue here rather
+# than blocking threads on an exhausted connection pool
+db_executor = ThreadPoolExecutor(max_workers=DB_API_THREADS, thread_name_prefix="api-db")
+
+async def run_db(function, *args, **kwargs):
+    """
+    Run blocking database work from a coroutine without blocking the event loop.
+    
+    function is called in db_executor with a new session as its first
+    argument, followed by args and kwargs. The session is closed when it
+    returns, so anything returned should be plain values or entities whose
+    loaded attributes are all that is read afterwards.
+    
+    Returns:
+        The function's result; its exceptions are raised in the caller
+    """
+    def call():
+        db = SessionLocal()
+        try:
+            return function(db, *args, **kwargs)
+        finally:
+            db.close()
+    return await asyncio.get_running_loop().run_in_executor(db_executor, call)
@@ -0,0 +1,247 @@
+import threading
+import numpy as np
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict
+from datetime import date, timedelta
+from app.core.config import BUSINESS_HOURS_CACHE_SIZE
+
+MINUTE_US = 60 * 1000 * 1000
+DAY_US = 24 * 60 * MINUTE_US
+WEEK_US = 7 * DAY_US
+MICROSECOND = timedelta(microseconds=1)
+
+# Timeline position of 1970-01-01, to place microseconds since the epoch on it
+EPOCH_TIMELINE_US = (date(1970, 1, 1).toordinal() - 1) * DAY_US
+
+def time_to_us(value):
+    """Convert a datetime.time to microseconds since midnight."""
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * 1000000 + value.microsecond
+
+def timeline_us(local_time):
+    """
+    Position of a local wall-clock time on a timeline that starts on a Monday.
+
+    Day 0 is 0001-01-01 (a Monday), so position % WEEK_US is the microsecond of
+    the week and position // DAY_US % 7 is the weekday.
+    """
+    return (local_time.toordinal() - 1) * DAY_US + time_to_us(local_time.time())
+
+class BusinessHoursIndex:
+    """
+    A store's business hours compiled to microsecond-of-week intervals.
+
+    Answers the two questions the report asks for every store: whether a local
+    time is within business hours (binary search over the merged open intervals)
+    and how much business time falls in a window (prefix sums over the weekly
+    coverage, with overnight spans split at the end of the week). Results are the
+    same as is_within_business_hours and calculate_business_minutes: an
+    observation after midnight is only in business hours if that day's own hours
+    cover it, while business minutes count overnight hours in full from the day
+    they start on, beginning with the window's first local date.
+    """
+
+    __slots__ = (
+        'is_24x7', '_open_starts', '_open_ends', '_positions', '_cumulative',
+        '_coverage', '_weekly_total', '_day_spans', '_open_starts_array', '_open_ends_array'
+    )
+
+    def __init__(self, business_hours):
+        self.is_24x7 = len(business_hours) == 0
+
+        open_intervals = []
+        deltas = defaultdict(int)
+        self._day_spans = [[] for _ in range(7)]
+
+        for hours in business_hours:
+            day_start = hours.day_of_week * DAY_US
+            start = time_to_us(hours.start_time_local)
+            end = time_to_us(hours.end_time_local)
+            if hours.end_time_local < hours.start_time_local:
+                # Spans midnight: open until the end of its own day for the
+                # instant check, open until the next day's end time for minutes
+                open_intervals.append((day_start + start, day_start + DAY_US - 1))
+                end += DAY_US
+            else:
+                open_intervals.append((day_start + start, day_start + end))
+            self._day_spans[hours.day_of_week].append((start, end))
+
+            # Coverage changes, with spans running past Sunday wrapped to Monday
+            span_start, span_end = day_start + start, day_start + end
+            deltas[span_start] += 1
+            deltas[min(span_end, WEEK_US)] -= 1
+            if span_end > WEEK_US:
+                deltas[0] += 1
+                deltas[span_end - WEEK_US] -= 1
+
+        self._open_starts = []
+        self._open_ends = []
+        for start, end in sorted(open_intervals):
+            if self._open_ends and start <= self._open_ends[-1]:
+                self._open_ends[-1] = max(self._open_ends[-1], end)
+            else:
+                self._open_starts.append(start)
+                self._open_ends.append(end)
+        self._open_starts_array = np.array(self._open_starts, dtype=np.int64)
+        self._open_ends_array = np.array(self._open_ends, dtype=np.int64)
+
+        # Piecewise-linear cumulative open time over one week: at positions[i]
+        # the cumulative total is cumulative[i] and it grows at coverage[i]
+        self._positions = sorted(set(deltas) | {0})
+        self._cumulative = []
+        self._coverage = []
+        total = 0
+        active = 0
+        previous = 0
+        for position in self._positions:
+            total += active * (position - previous)
+            active += deltas.get(position, 0)
+            self._cumulative.append(total)
+            self._coverage.append(active)
+            previous = position
+        self._weekly_total = total + active * (WEEK_US - previous)
+
+    def is_open(self, local_time):
+        """Check if a local time is within business hours."""
+        if self.is_24x7:
+            return True
+        position = timeline_us(local_time) % WEEK_US
+        i = bisect_right(self._open_starts, position) - 1
+        return i >= 0 and position <= self._open_ends[i]
+
+    def open_mask(self, week_positions):
+        """
+        Vectorized is_open over local microseconds of the week.
+
+        Args:
+            week_positions: Array of local microsecond-of-week positions, with
+                Monday 00:00 at 0
+
+        Returns:
+            numpy.ndarray: Whether each position is within business hours
+        """
+        if self.is_24x7:
+            return np.ones(len(week_positions), dtype=bool)
+        i = np.searchsorted(self._open_starts_array, week_positions, side='right') - 1
+        return (i >= 0) & (week_positions <= self._open_ends_array[np.maximum(i, 0)])
+
+    def business_minutes(self, local_start, local_end):
+        """
+        Calculate the business minutes between two local times.
+
+        Args:
+            local_start: Start of the window, in the store's timezone
+            local_end: End of the window, in the store's timezone
+
+        Returns:
+            float: Business minutes in the window
+        """
+        if self.is_24x7:
+            return (local_end - local_start).total_seconds() / 60
+
+        start = timeline_us(local_start)
+        end = start + (local_end - local_start) // MICROSECOND
+        return self._open_us(start, end, local_end.toordinal() - 1) / MINUTE_US
+
+    def business_minutes_us(self, local_start_us, local_end_us, duration_us):
+        """
+        business_minutes for a window given as local wall-clock microseconds.
+
+        Args:
+            local_start_us: Start of the window, local microseconds since the epoch
+            local_end_us: End of the window, local microseconds since the epoch
+            duration_us: Elapsed microseconds in the window, which differs from
+                local_end_us - local_start_us when the UTC offset changes inside it
+
+        Returns:
+            float: Business minutes in the window
+        """
+        if self.is_24x7:
+            return duration_us / 1000000 / 60
+
+        start = local_start_us + EPOCH_TIMELINE_US
+        return self._open_us(start, start + duration_us, (local_end_us + EPOCH_TIMELINE_US) // DAY_US) / MINUTE_US
+
+    def _open_us(self, start, end, last_day):
+        """Business time between two timeline positions, counting hours that begin up to last_day."""
+        # Business hours are laid out with the UTC offset in effect at the start
+        open_us = self._measure_to(end) - self._measure_to(start)
+
+        # Only hours starting on the window's local dates count: drop overnight
+        # hours carried in from the previous day and days after the last date
+        first_day = start // DAY_US
+        open_us -= self._day_overlap(first_day - 1, start, end)
+        for day in range(last_day + 1, end // DAY_US + 1):
+            open_us -= self._day_overlap(day, start, end)
+
+        return open_us
+
+    def _measure_to(self, position):
+        """Business time from the timeline origin up to a position."""
+        weeks, offset = divmod(position, WEEK_US)
+        i = bisect_right(self._positions, offset) - 1
+        return (
+            weeks * self._weekly_total
+            + self._cumulative[i]
+            + self._coverage[i] * (offset - self._positions[i])
+        )
+
+    def _day_overlap(self, day, start, end):
+        """Business time in [start, end] from the hours that begin on one day."""
+        overlap = 0
+        day_start = day * DAY_US
+        for span_start, span_end in self._day_spans[day % 7]:
+            covered = min(end, day_start + span_end) - max(start, day_start + span_start)
+            if covered > 0:
+                overlap += covered
+        return overlap
+
+class BusinessHoursCache:
+    """
+    Thread-safe LRU cache of compiled business hours by store.
+
+    Bounded to max_entries stores so long-running workers don't grow without
+    limit; cleared whenever business hours are (re)loaded.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, store_id):
+        with self._lock:
+            index = self._entries.get(store_id)
+            if index is not None:
+                self._entries.move_to_end(store_id)
+            return index
+
+    def put(self, store_id, index):
+        with self._lock:
+            self._entries[store_id] = index
+            self._entries.move_to_end(store_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_build(self, store_id, load_business_hours):
+        """
+        Return the cached index for a store, compiling it on a miss.
+
+        Args:
+            store_id: The store to look up
+            load_business_hours: Callable returning the store's BusinessHours
+                rows, only called on a cache miss
+        """
+        index = self.get(store_id)
+        if index is None:
+            index = BusinessHoursIndex(load_business_hours())
+            self.put(store_id, index)
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+business_hours_cache = BusinessHoursCache(BUSINESS_HOURS_CACHE_SIZE)
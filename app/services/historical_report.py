@@ -0,0 +1,214 @@
+from bisect import bisect_left, bisect_right
+from contextlib import ExitStack
+from datetime import timedelta, timezone
+from itertools import accumulate
+from operator import itemgetter
+import numpy as np
+from sqlalchemy import func
+from app.core.config import (
+    BULK_FETCH_SIZE, REPORT_BATCH_MAX_ANCHORS, REPORT_FLUSH_ROWS, REPORT_MEMORY_LIMIT_MB, REPORT_PAGE_STORES
+)
+from app.models.models import StoreStatus
+from app.services.business_hours import business_hours_cache
+from app.services.instrumentation import rss_bytes, timed
+from app.services.report_formats import FORMATS, open_writer
+from app.services.report_windows import parse_window
+from app.services.status_retention import compacted_first_seen, load_compacted_polls
+from app.services.timezone_service import timezone_service, to_us
+
+# Span of observations a page of REPORT_PAGE_STORES stores is sized for: the
+# longest standard window. Longer backfill spans get proportionally fewer stores
+PAGE_SPAN = timedelta(days=7)
+
+def utc_naive(value):
+    """A datetime as naive UTC, the way timestamps are stored; naive values are taken as UTC."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def backfill_anchors(as_of, as_of_end=None, every="1d"):
+    """
+    The as_of times of a report or a backfill.
+
+    Args:
+        as_of: The first (or only) time
+        as_of_end: The last time of a backfill, inclusive, or None for one report
+        every: Interval between times, e.g. "1d" or "6h" (m, h, d or w units)
+
+    Returns:
+        list: Naive UTC datetimes, ascending
+
+    Raises:
+        ValueError: If the range or interval is invalid or gives more than
+            REPORT_BATCH_MAX_ANCHORS times
+    """
+    as_of, as_of_end = utc_naive(as_of), utc_naive(as_of_end)
+    if as_of_end is None:
+        return [as_of]
+    if as_of_end < as_of:
+        raise ValueError("as_of_end must not be before as_of")
+    step = parse_window((every or "").strip().lower()).length
+    count = (as_of_end - as_of) // step + 1
+    if count > REPORT_BATCH_MAX_ANCHORS:
+        raise ValueError(f"The backfill has {count} as_of times, at most {REPORT_BATCH_MAX_ANCHORS} are allowed")
+    return [as_of + i * step for i in range(count)]
+
+def count_stores_by_anchor(db, anchors):
+    """
+    Number of stores a report at each anchor covers: those observed at or before it.
+
+    Polls compacted by retention count as observations.
+
+    Returns:
+        list: Store count per anchor, in anchor order
+    """
+    counts = [0] * len(anchors)
+    compacted = compacted_first_seen(db)
+    first_seen = db.query(StoreStatus.store_id, func.min(StoreStatus.timestamp_utc)).group_by(StoreStatus.store_id)
+    for store_id, timestamp in first_seen.yield_per(BULK_FETCH_SIZE):
+        timestamp = min(timestamp, compacted.pop(store_id, timestamp))
+        k = bisect_left(anchors, timestamp)
+        if k < len(anchors):
+            counts[k] += 1
+    for timestamp in compacted.values():
+        k = bisect_left(anchors, timestamp)
+        if k < len(anchors):
+            counts[k] += 1
+    return list(accumulate(counts))
+
+def iter_anchor_results(anchors, db, windows, default_timezone):
+    """
+    Compute the report rows of several as_of times in one pass over the stores.
+
+    Stores are paged through in store_id order. Each page's observations
+    are loaded once for the span from the longest window before the first
+    anchor to the last anchor, so pages hold REPORT_PAGE_STORES stores
+    scaled down by how much longer than PAGE_SPAN that span is, and are
+    halved like the streaming engine's when resident memory exceeds
+    REPORT_MEMORY_LIMIT_MB after a page. Every store's observations are
+    localized and checked against business hours once. Each anchor then takes the slice of observations inside its
+    windows, so a row is exactly the one a report at that time would have.
+    Polls compacted by retention are rebuilt from their intervals and
+    merged in (see load_compacted_polls), which makes rows covering them
+    close to but not always the same as before compaction.
+
+    Args:
+        anchors: Ascending naive UTC as_of times
+        db: The database session
+        windows: Report windows
+        default_timezone: Timezone used for stores without a timezone record
+
+    Yields:
+        tuple: (anchor index, report row), for every store observed at or
+            before the anchor, in store order
+    """
+    from app.services.report_service import (
+        MIN_PAGE_STORES, calculate_windows_us, rounded_row, empty_result, load_report_window
+    )
+
+    longest = max(window.length for window in windows)
+    last_anchor = anchors[-1]
+    lookback = last_anchor - anchors[0] + longest
+    span_us = to_us(last_anchor - lookback), to_us(last_anchor)
+    page_size = max(MIN_PAGE_STORES, int(REPORT_PAGE_STORES * min(1, PAGE_SPAN / lookback)))
+    last_store = None
+    while True:
+        with timed('load'):
+            page_query = db.query(StoreStatus.store_id, func.min(StoreStatus.timestamp_utc)).group_by(
+                StoreStatus.store_id
+            ).order_by(StoreStatus.store_id)
+            if last_store is not None:
+                page_query = page_query.filter(StoreStatus.store_id > last_store)
+            page = page_query.limit(page_size).all()
+        if not page:
+            return
+
+        store_range = (page[0][0], page[-1][0])
+        timezones, business_hours, observations = load_report_window(last_anchor, db, store_range, lookback)
+        with timed('load'):
+            compacted = load_compacted_polls(db, last_anchor - lookback, last_anchor, store_range)
+            compacted_first = compacted_first_seen(db, store_range)
+        for store_id, first_seen in page:
+            with timed('load'):
+                index = business_hours_cache.get_or_build(store_id, lambda: business_hours.get(store_id, []))
+            rows = observations.get(store_id, [])
+            timestamps = [to_us(row.timestamp_utc) for row in rows]
+            active = [row.status == 'active' for row in rows]
+            first_seen = min(first_seen, compacted_first.get(store_id, first_seen))
+            if store_id in compacted:
+                polls = sorted(compacted[store_id] + list(zip(timestamps, active)))
+                timestamps = [t for t, _ in polls]
+                active = [a for _, a in polls]
+            tz = open_mask = None
+            for k, anchor in enumerate(anchors):
+                if first_seen > anchor:
+                    continue
+                try:
+                    if tz is None:
+                        tz = timezone_service.offsets(timezones.get(store_id, default_timezone), *span_us)
+                        if not index.is_24x7:
+                            with timed('timezone'):
+                                week_positions = tz.week_positions(np.array(timestamps, dtype=np.int64))
+                            with timed('interpolation'):
+                                open_mask = index.open_mask(week_positions).tolist()
+                    lo = bisect_left(timestamps, to_us(anchor - longest))
+                    hi = bisect_right(timestamps, to_us(anchor))
+                    values = calculate_windows_us(
+                        timestamps[lo:hi], active[lo:hi], anchor, index, tz, windows,
+                        open_mask[lo:hi] if open_mask is not None else None
+                    )
+                    row = rounded_row(store_id, windows, values)
+                except Exception as e:
+                    print(f"Error computing uptime/downtime for store {store_id} as of {anchor}: {e}")
+                    row = empty_result(store_id, windows)
+                yield k, row
+        last_store = page[-1][0]
+        del observations, compacted
+
+        rss = rss_bytes()
+        if REPORT_MEMORY_LIMIT_MB and rss > REPORT_MEMORY_LIMIT_MB * 1024 * 1024 and page_size > MIN_PAGE_STORES:
+            page_size = max(MIN_PAGE_STORES, page_size // 2)
+            print(f"WARNING: backfill memory {rss / 1024 / 1024:.0f} MiB is over REPORT_MEMORY_LIMIT_MB, "
+                  f"computing {page_size} stores per page")
+
+def write_anchor_reports(output_files, results, fieldnames, on_progress=None, report_format=None):
+    """
+    Write the rows of several reports computed together, one file per anchor.
+
+    Args:
+        output_files: Report file path per anchor
+        results: Iterable of (anchor index, row) from iter_anchor_results
+        fieldnames: Report columns, from report_fieldnames for the reports' windows
+        on_progress: Optional callable receiving the rows written per anchor
+            after every flush
+        report_format: ReportFormat of the files (defaults to CSV)
+
+    Returns:
+        list: Rows written per anchor
+    """
+    values = itemgetter(*fieldnames)
+    counts = [0] * len(output_files)
+    with ExitStack() as stack:
+        writers = [
+            stack.enter_context(open_writer(path, fieldnames, report_format or FORMATS["csv"]))
+            for path in output_files
+        ]
+        buffers = [[] for _ in output_files]
+
+        def write_buffers():
+            with timed('csv_write'):
+                for writer, rows in zip(writers, buffers):
+                    if rows:
+                        writer.write_batch(list(zip(*rows)))
+                        writer.flush()
+                        rows.clear()
+
+        for i, (k, row) in enumerate(results):
+            buffers[k].append(values(row))
+            counts[k] += 1
+            if (i + 1) % REPORT_FLUSH_ROWS == 0:
+                write_buffers()
+                if on_progress:
+                    on_progress(counts)
+        write_buffers()
+    return counts
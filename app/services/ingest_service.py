@@ -0,0 +1,341 @@
+import hashlib
+import io
+import os
+import threading
+import time
+import pandas as pd
+from collections import defaultdict
+from datetime import datetime
+from operator import itemgetter
+from sqlalchemy import func
+from app.core.config import INGEST_CHUNK_SIZE, MAINTAIN_HOURLY_ROLLUP, MAINTAIN_STATUS_SNAPSHOT
+from app.models.models import (
+    SessionLocal, StoreStatus, BusinessHours, StoreTimezone, IngestWatermark, ensure_status_partitions
+)
+from app.services.business_hours import business_hours_cache
+from app.utils.helpers import parse_status_chunk, parse_hours_chunk, parse_timezone_chunk, insert_ignoring_duplicates
+
+STATUS_FILE = 'store_status.csv'
+HOURS_FILE = 'menu_hours.csv'
+TIMEZONE_FILE = 'timezones.csv'
+
+# Bytes hashed from the start of a file to notice it was replaced rather than appended to
+HEAD_DIGEST_BYTES = 64 * 1024
+
+# Incremental runs read file offsets and append rows, so they must not overlap
+_ingest_lock = threading.Lock()
+
+def ingest_incremental(data_dir: str = '.'):
+    """
+    Ingest only what changed in the CSV files since the last load.
+
+    New store_status rows are read from the byte offset where the previous run
+    stopped; menu_hours and timezones are re-read only when the file changed
+    and only stores whose rows differ are rewritten. The hourly rollup is
+    brought forward for the affected stores. Rows, rollup buckets and
+    watermarks are committed in one transaction, after which the store_status
+    snapshot is rewritten if rows were appended and the store uptime index,
+    if in use, picks up the changes.
+
+    Args:
+        data_dir: Directory containing the CSV files
+
+    Returns:
+        dict: Rows appended, stores updated and elapsed seconds
+    """
+    with _ingest_lock:
+        started = time.perf_counter()
+        db = SessionLocal()
+        changes = {}
+        try:
+            summary = {
+                'status_rows': ingest_store_status(db, os.path.join(data_dir, STATUS_FILE), changes),
+                'business_hours_stores': upsert_business_hours(db, os.path.join(data_dir, HOURS_FILE), changes),
+                'timezone_stores': upsert_timezones(db, os.path.join(data_dir, TIMEZONE_FILE), changes),
+            }
+            if MAINTAIN_HOURLY_ROLLUP:
+                from app.services.rollup_service import refresh_hourly_rollup
+                if summary['business_hours_stores']:
+                    business_hours_cache.clear()
+                summary['rollup_buckets'] = refresh_hourly_rollup(db, changes)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        if summary['business_hours_stores']:
+            business_hours_cache.clear()
+
+        if MAINTAIN_STATUS_SNAPSHOT and summary['status_rows']:
+            from app.services.status_snapshot import write_status_snapshot
+            db = SessionLocal()
+            try:
+                summary['snapshot_rows'] = write_status_snapshot(db)['rows']
+            finally:
+                db.close()
+
+        # Queries see the new rows right away rather than at the index's next check
+        from app.services.store_uptime_index import store_uptime_index
+        if store_uptime_index.is_built and any(summary.values()):
+            db = SessionLocal()
+            try:
+                store_uptime_index.refresh(db, force=True)
+            finally:
+                db.close()
+
+        summary['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+        print(f"Incremental ingest: {summary}")
+        return summary
+
+def append_status_records(records, changes=None):
+    """
+    Insert store_status observations received live, in one transaction.
+
+    Polls of a store and instant already stored are skipped. Runs under the
+    same lock as incremental CSV ingestion.
+
+    Args:
+        records: Insert parameters with store_id, naive UTC timestamp_utc and status
+        changes: Optional mapping updated with the earliest inserted timestamp
+            of each store, accumulated until refresh_changed_rollup
+
+    Returns:
+        int: Number of rows inserted
+    """
+    with _ingest_lock:
+        db = SessionLocal()
+        try:
+            # In index order, posts from many stores touch each index page once rather than at random
+            records = sorted(records, key=itemgetter('store_id', 'timestamp_utc'))
+            ensure_status_partitions(db, [record['timestamp_utc'] for record in records])
+            rows = db.execute(insert_ignoring_duplicates(StoreStatus.__table__), records).rowcount
+            _note_status_changes(changes, records)
+            db.commit()
+            return rows
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+def refresh_changed_rollup(changes):
+    """
+    Bring the hourly rollup forward for the stores in changes (if MAINTAIN_HOURLY_ROLLUP).
+
+    Runs in its own transaction and outside the ingest lock, so inserts
+    don't wait for it; only the changed stores are read and written.
+
+    Args:
+        changes: Mapping of store_id to the earliest new timestamp, as
+            accumulated by append_status_records
+
+    Returns:
+        int: Number of buckets written
+    """
+    if not MAINTAIN_HOURLY_ROLLUP or not changes:
+        return 0
+    from app.services.rollup_service import refresh_hourly_rollup
+    db = SessionLocal()
+    try:
+        written = refresh_hourly_rollup(db, changes, stores=list(changes))
+        db.commit()
+        return written
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def record_full_load(db, data_dir: str = '.'):
+    """Record watermarks for files that were just loaded in full."""
+    max_timestamp = db.query(func.max(StoreStatus.timestamp_utc)).scalar()
+    for name in (STATUS_FILE, HOURS_FILE, TIMEZONE_FILE):
+        path = os.path.join(data_dir, name)
+        if os.path.exists(path):
+            _save_watermark(db, path, os.path.getsize(path), max_timestamp if name == STATUS_FILE else None)
+    db.commit()
+
+def ingest_store_status(db, path, changes=None):
+    """
+    Append store_status rows added to the CSV file since the last run.
+
+    Complete lines after the stored byte offset are parsed and inserted. If
+    the file was replaced (it shrank or its head changed) or has no watermark,
+    the whole file is scanned and only rows newer than the stored maximum
+    timestamp_utc are inserted. Duplicate polls of a store and instant already
+    stored are skipped. If changes is given, it is updated with the earliest
+    inserted timestamp of each store.
+
+    Returns:
+        int: Number of rows inserted
+    """
+    if not os.path.exists(path):
+        return 0
+
+    watermark = db.query(IngestWatermark).filter(IngestWatermark.source == path).first()
+    size = os.path.getsize(path)
+
+    if watermark and size == watermark.byte_offset and _head_digest(path) == watermark.head_digest:
+        return 0
+
+    table = StoreStatus.__table__
+    rows = 0
+    if watermark and size >= watermark.byte_offset and _head_digest(path) == watermark.head_digest:
+        with open(path, 'rb') as f:
+            header = f.readline()
+            f.seek(watermark.byte_offset)
+            data = f.read(size - watermark.byte_offset)
+
+        # Leave a partially written last line for the next run
+        data = data[:data.rfind(b'\n') + 1]
+        offset = watermark.byte_offset + len(data)
+        max_timestamp = watermark.max_timestamp
+
+        if data:
+            for chunk in pd.read_csv(io.BytesIO(header + data), chunksize=INGEST_CHUNK_SIZE, dtype=str):
+                records = parse_status_chunk(chunk)
+                if records:
+                    ensure_status_partitions(db, [record['timestamp_utc'] for record in records])
+                    rows += db.execute(insert_ignoring_duplicates(table), records).rowcount
+                    max_timestamp = _newest(records, max_timestamp)
+                    _note_status_changes(changes, records)
+    else:
+        # Replaced or never tracked: fall back to the timestamp high-water mark
+        max_timestamp = watermark.max_timestamp if watermark else db.query(func.max(StoreStatus.timestamp_utc)).scalar()
+        previous_max = max_timestamp
+        offset = size
+        for chunk in pd.read_csv(path, chunksize=INGEST_CHUNK_SIZE, dtype=str):
+            records = parse_status_chunk(chunk)
+            if previous_max is not None:
+                records = [r for r in records if r['timestamp_utc'] > previous_max]
+            if records:
+                ensure_status_partitions(db, [record['timestamp_utc'] for record in records])
+                rows += db.execute(insert_ignoring_duplicates(table), records).rowcount
+                max_timestamp = _newest(records, max_timestamp)
+                _note_status_changes(changes, records)
+
+    _save_watermark(db, path, offset, max_timestamp)
+    return rows
+
+def upsert_business_hours(db, path, changes=None):
+    """
+    Rewrite the business hours of stores whose rows changed in menu_hours.csv.
+
+    If changes is given, the rewritten stores are marked in it for a rebuild.
+
+    Returns:
+        int: Number of stores whose business hours were replaced
+    """
+    if not _file_changed(db, path):
+        return 0
+
+    incoming = defaultdict(list)
+    for chunk in pd.read_csv(path, chunksize=INGEST_CHUNK_SIZE, dtype=str):
+        for record in parse_hours_chunk(chunk):
+            incoming[record['store_id']].append(record)
+
+    existing = defaultdict(list)
+    for hours in db.query(BusinessHours.store_id, BusinessHours.day_of_week,
+                          BusinessHours.start_time_local, BusinessHours.end_time_local):
+        existing[hours.store_id].append((hours.day_of_week, hours.start_time_local, hours.end_time_local))
+
+    changed = [
+        store_id for store_id, records in incoming.items()
+        if sorted((r['day_of_week'], r['start_time_local'], r['end_time_local']) for r in records)
+        != sorted(existing.get(store_id, []))
+    ]
+    for start in range(0, len(changed), 500):
+        batch = changed[start:start + 500]
+        db.query(BusinessHours).filter(BusinessHours.store_id.in_(batch)).delete(synchronize_session=False)
+        db.execute(BusinessHours.__table__.insert(), [r for store_id in batch for r in incoming[store_id]])
+
+    if changes is not None:
+        changes.update((store_id, None) for store_id in changed)
+    _save_watermark(db, path, os.path.getsize(path), None)
+    return len(changed)
+
+def upsert_timezones(db, path, changes=None):
+    """
+    Insert new stores and update changed timezones from timezones.csv.
+
+    If changes is given, the inserted and updated stores are marked in it for
+    a rebuild.
+
+    Returns:
+        int: Number of stores inserted or updated
+    """
+    if not _file_changed(db, path):
+        return 0
+
+    incoming = {}
+    for chunk in pd.read_csv(path, chunksize=INGEST_CHUNK_SIZE, dtype=str):
+        for record in parse_timezone_chunk(chunk):
+            incoming[record['store_id']] = record['timezone_str']
+
+    existing = dict(db.query(StoreTimezone.store_id, StoreTimezone.timezone_str))
+    inserts = [
+        {'store_id': store_id, 'timezone_str': timezone_str}
+        for store_id, timezone_str in incoming.items() if store_id not in existing
+    ]
+    updates = [
+        (store_id, timezone_str) for store_id, timezone_str in incoming.items()
+        if store_id in existing and existing[store_id] != timezone_str
+    ]
+
+    if inserts:
+        db.execute(StoreTimezone.__table__.insert(), inserts)
+    for store_id, timezone_str in updates:
+        db.query(StoreTimezone).filter(StoreTimezone.store_id == store_id).update(
+            {'timezone_str': timezone_str}, synchronize_session=False
+        )
+
+    if changes is not None:
+        changes.update((r['store_id'], None) for r in inserts)
+        changes.update((store_id, None) for store_id, _ in updates)
+    _save_watermark(db, path, os.path.getsize(path), None)
+    return len(inserts) + len(updates)
+
+def _newest(records, max_timestamp):
+    newest = max(r['timestamp_utc'] for r in records)
+    return newest if max_timestamp is None else max(max_timestamp, newest)
+
+def _note_status_changes(changes, records):
+    """Track the earliest new timestamp per store, leaving stores marked for rebuild."""
+    if changes is None:
+        return
+    for r in records:
+        store_id = r['store_id']
+        if store_id not in changes:
+            changes[store_id] = r['timestamp_utc']
+        elif changes[store_id] is not None and r['timestamp_utc'] < changes[store_id]:
+            changes[store_id] = r['timestamp_utc']
+
+def _head_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(HEAD_DIGEST_BYTES)).hexdigest()
+
+def _file_changed(db, path):
+    """Whether a snapshot file differs from when it was last ingested."""
+    if not os.path.exists(path):
+        return False
+    watermark = db.query(IngestWatermark).filter(IngestWatermark.source == path).first()
+    if watermark is None:
+        return True
+    stat = os.stat(path)
+    return stat.st_size != watermark.file_size or stat.st_mtime != watermark.file_mtime
+
+def _save_watermark(db, path, offset, max_timestamp):
+    watermark = db.query(IngestWatermark).filter(IngestWatermark.source == path).first()
+    if watermark is None:
+        watermark = IngestWatermark(source=path)
+        db.add(watermark)
+    stat = os.stat(path)
+    watermark.byte_offset = offset
+    watermark.max_timestamp = max_timestamp
+    watermark.file_size = stat.st_size
+    watermark.file_mtime = stat.st_mtime
+    watermark.head_digest = _head_digest(path)
+    watermark.updated_at = datetime.utcnow()
+    db.flush()
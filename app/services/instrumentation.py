@@ -0,0 +1,425 @@
+import os
+import resource
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from sqlalchemy import event
+from app.models.models import engine
+
+_local = threading.local()
+
+class PhaseTimer:
+    """
+    Exclusive wall time and call count per phase of one report run.
+
+    Phases nest: time spent in an inner phase (including database queries,
+    recorded as "db_query") is not counted again in the outer one, so the
+    phases add up to at most the total run time. A timer is active on the
+    thread that started it, and timed() is a no-op on other threads.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.started = None
+        self.elapsed = None
+        self._stack = []
+
+    def start(self):
+        self.started = time.perf_counter()
+        _local.timer = self
+        return self
+
+    def stop(self):
+        if getattr(_local, 'timer', None) is self:
+            _local.timer = None
+        self.elapsed = time.perf_counter() - self.started
+        return self.elapsed
+
+    def add(self, name, seconds, calls=1):
+        """Record time measured outside a timed() block, e.g. by an event hook."""
+        self.seconds[name] += seconds
+        self.calls[name] += calls
+        if self._stack:
+            self._stack[-1].children += seconds
+
+    def merge(self, phases):
+        """Add the phases of a timer that ran elsewhere, e.g. in a worker process."""
+        for name, phase in phases.items():
+            self.seconds[name] += phase['seconds']
+            self.calls[name] += phase['calls']
+
+    def phases(self):
+        return {
+            name: {'seconds': round(self.seconds[name], 6), 'calls': self.calls[name]}
+            for name in sorted(self.seconds)
+        }
+
+class _Phase:
+    __slots__ = ('timer', 'name', 'started', 'children')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.children = 0.0
+        self.timer._stack.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        timer = self.timer
+        timer._stack.pop()
+        timer.seconds[self.name] += elapsed - self.children
+        timer.calls[self.name] += 1
+        if timer._stack:
+            timer._stack[-1].children += elapsed
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NO_PHASE = _NoPhase()
+
+def timed(name):
+    """Context manager charging the enclosed block to a phase of the active timer."""
+    timer = getattr(_local, 'timer', None)
+    return _NO_PHASE if timer is None else _Phase(timer, name)
+
+def current_timer():
+    """The PhaseTimer active on this thread, or None."""
+    return getattr(_local, 'timer', None)
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and getattr(_local, 'timer', None) is not None:
+        context._query_started = time.perf_counter()
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    timer = getattr(_local, 'timer', None)
+    if started is not None and timer is not None:
+        timer.add('db_query', time.perf_counter() - started)
+
+def rss_bytes():
+    """Resident memory of this process, or its peak where the current figure isn't available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, KiB elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+class ReportMetrics:
+    """
+    Process-wide report job metrics rendered in the Prometheus text format.
+
+    Counts are kept in memory, so they start from zero with every process.
+    """
+
+    DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = Counter()
+        self.duration_buckets = Counter()
+        self.duration_sum = 0.0
+        self.duration_count = 0
+        self.phase_seconds = defaultdict(float)
+        self.stores = 0
+        self.queries = 0
+        self.last_stores_per_second = 0.0
+        self.last_peak_rss_bytes = 0
+
+    def observe(self, status, duration, stores=0, queries=0, phases=None, peak_rss=None):
+        """Record a finished report job."""
+        with self._lock:
+            self.jobs[status] += 1
+            self.duration_sum += duration
+            self.duration_count += 1
+            for bound in self.DURATION_BUCKETS:
+                if duration <= bound:
+                    self.duration_buckets[bound] += 1
+            for name, phase in (phases or {}).items():
+                self.phase_seconds[name] += phase['seconds']
+            if status == "Complete":
+                self.stores += stores
+                self.queries += queries
+                self.last_stores_per_second = stores / duration if duration else 0.0
+                self.last_peak_rss_bytes = peak_rss or 0
+
+    def render(self, scheduler_stats=None):
+        """
+        Render all metrics as Prometheus text exposition format.
+
+        Args:
+            scheduler_stats: Optional dict from ReportScheduler.stats() for
+                the queue gauges
+        """
+        with self._lock:
+            lines = [
+                "# HELP report_jobs_total Report jobs finished, by status.",
+                "# TYPE report_jobs_total counter",
+            ]
+            for status in sorted(self.jobs):
+                lines.append(f'report_jobs_total{{status="{status}"}} {self.jobs[status]}')
+
+            lines += [
+                "# HELP report_job_duration_seconds Wall time of report jobs.",
+                "# TYPE report_job_duration_seconds histogram",
+            ]
+            for bound in self.DURATION_BUCKETS:
+                lines.append(f'report_job_duration_seconds_bucket{{le="{bound}"}} {self.duration_buckets[bound]}')
+            lines += [
+                f'report_job_duration_seconds_bucket{{le="+Inf"}} {self.duration_count}',
+                f"report_job_duration_seconds_sum {self.duration_sum:.6f}",
+                f"report_job_duration_seconds_count {self.duration_count}",
+                "# HELP report_phase_seconds_total Time spent per report phase, summed over jobs.",
+                "# TYPE report_phase_seconds_total counter",
+            ]
+            for name in sorted(self.phase_seconds):
+                lines.append(f'report_phase_seconds_total{{phase="{name}"}} {self.phase_seconds[name]:.6f}')
+
+            lines += [
+                "# HELP report_stores_total Stores written by completed reports.",
+                "# TYPE report_stores_total counter",
+                f"report_stores_total {self.stores}",
+                "# HELP report_queries_total Database statements issued by completed reports.",
+                "# TYPE report_queries_total counter",
+                f"report_queries_total {self.queries}",
+                "# HELP report_stores_per_second Throughput of the last completed report.",
+                "# TYPE report_stores_per_second gauge",
+                f"report_stores_per_second {self.last_stores_per_second:.3f}",
+                "# HELP report_peak_rss_bytes Highest resident memory of the process seen during the last completed report.",
+                "# TYPE report_peak_rss_bytes gauge",
+                f"report_peak_rss_bytes {self.last_peak_rss_bytes}",
+            ]
+
+        lines += [
+            "# HELP process_resident_memory_bytes Resident memory of the process.",
+            "# TYPE process_resident_memory_bytes gauge",
+            f"process_resident_memory_bytes {rss_bytes()}",
+        ]
+        if scheduler_stats is not None:
+            lines += [
+                "# HELP report_queue_depth Report jobs waiting for a worker.",
+                "# TYPE report_queue_depth gauge",
+                f"report_queue_depth {scheduler_stats['queued']}",
+                "# HELP report_queue_capacity Report jobs that may wait before triggers are rejected.",
+                "# TYPE report_queue_capacity gauge",
+                f"report_queue_capacity {scheduler_stats['max_queued']}",
+                "# HELP report_jobs_running Report jobs being generated.",
+                "# TYPE report_jobs_running gauge",
+                f"report_jobs_running {scheduler_stats['running']}",
+                "# HELP report_workers Report worker threads.",
+                "# TYPE report_workers gauge",
+                f"report_workers {scheduler_stats['workers']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+report_metrics = ReportMetrics()
+
+class IngestMetrics:
+    """
+    Process-wide metrics of live status ingestion in the Prometheus text format.
+
+    Latency is the time from an observation being accepted to its
+    transaction committing, counted per observation.
+    """
+
+    LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    FLUSH_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+    # Window over which the ingest rate gauge is computed
+    RATE_SECONDS = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.received = 0
+        self.rejected = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.flush_errors = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flush_buckets = Counter()
+        self.flush_sum = 0.0
+        self.latency_buckets = Counter()
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self._recent = deque()  # (monotonic time, rows) of recent flushes
+
+    def accept(self, rows):
+        with self._lock:
+            self.received += rows
+
+    def reject(self, rows):
+        with self._lock:
+            self.rejected += rows
+
+    def flush_failed(self):
+        with self._lock:
+            self.flush_errors += 1
+
+    def drop(self, rows):
+        with self._lock:
+            self.dropped += rows
+
+    def observe_flush(self, rows, inserted, duration, latencies):
+        """
+        Record a committed flush.
+
+        Args:
+            rows: Observations written
+            inserted: Rows inserted; the rest were duplicate polls
+            duration: Seconds the transaction took
+            latencies: (observations, seconds since accepted) per accepted batch
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.inserted += inserted
+            self.duplicates += rows - inserted
+            self.flushes += 1
+            self.flush_sum += duration
+            for bound in self.FLUSH_BUCKETS:
+                if duration <= bound:
+                    self.flush_buckets[bound] += 1
+            for count, latency in latencies:
+                self.latency_sum += count * latency
+                self.latency_count += count
+                for bound in self.LATENCY_BUCKETS:
+                    if latency <= bound:
+                        self.latency_buckets[bound] += count
+            self._recent.append((now, rows))
+            while self._recent and self._recent[0][0] < now - self.RATE_SECONDS:
+                self._recent.popleft()
+
+    def render(self, buffer_stats=None):
+        """
+        Render all metrics as Prometheus text exposition format.
+
+        Args:
+            buffer_stats: Optional dict from StatusBuffer.stats() for the
+                buffer gauges
+        """
+        with self._lock:
+            now = time.monotonic()
+            recent = sum(rows for at, rows in self._recent if at >= now - self.RATE_SECONDS)
+            lines = [
+                "# HELP ingest_observations_received_total Status observations accepted by /ingest_status.",
+                "# TYPE ingest_observations_received_total counter",
+                f"ingest_observations_received_total {self.received}",
+                "# HELP ingest_observations_rejected_total Status observations rejected because the buffer was full.",
+                "# TYPE ingest_observations_rejected_total counter",
+                f"ingest_observations_rejected_total {self.rejected}",
+                "# HELP ingest_rows_inserted_total store_status rows inserted from live observations.",
+                "# TYPE ingest_rows_inserted_total counter",
+                f"ingest_rows_inserted_total {self.inserted}",
+                "# HELP ingest_duplicates_total Live observations skipped as already stored.",
+                "# TYPE ingest_duplicates_total counter",
+                f"ingest_duplicates_total {self.duplicates}",
+                "# HELP ingest_flush_errors_total Group commit attempts that failed.",
+                "# TYPE ingest_flush_errors_total counter",
+                f"ingest_flush_errors_total {self.flush_errors}",
+                "# HELP ingest_observations_dropped_total Observations dropped after INGEST_FLUSH_ATTEMPTS failed commits.",
+                "# TYPE ingest_observations_dropped_total counter",
+                f"ingest_observations_dropped_total {self.dropped}",
+                "# HELP ingest_observations_per_second Observations committed per second over the last 10 seconds.",
+                "# TYPE ingest_observations_per_second gauge",
+                f"ingest_observations_per_second {recent / self.RATE_SECONDS:.1f}",
+                "# HELP ingest_flush_duration_seconds Wall time of group commits.",
+                "# TYPE ingest_flush_duration_seconds histogram",
+            ]
+            for bound in self.FLUSH_BUCKETS:
+                lines.append(f'ingest_flush_duration_seconds_bucket{{le="{bound}"}} {self.flush_buckets[bound]}')
+            lines += [
+                f'ingest_flush_duration_seconds_bucket{{le="+Inf"}} {self.flushes}',
+                f"ingest_flush_duration_seconds_sum {self.flush_sum:.6f}",
+                f"ingest_flush_duration_seconds_count {self.flushes}",
+                "# HELP ingest_latency_seconds Time from accepting an observation to committing it.",
+                "# TYPE ingest_latency_seconds histogram",
+            ]
+            for bound in self.LATENCY_BUCKETS:
+                lines.append(f'ingest_latency_seconds_bucket{{le="{bound}"}} {self.latency_buckets[bound]}')
+            lines += [
+                f'ingest_latency_seconds_bucket{{le="+Inf"}} {self.latency_count}',
+                f"ingest_latency_seconds_sum {self.latency_sum:.6f}",
+                f"ingest_latency_seconds_count {self.latency_count}",
+            ]
+
+        if buffer_stats is not None:
+            lines += [
+                "# HELP ingest_buffer_rows Observations waiting to be written, including the flush in progress.",
+                "# TYPE ingest_buffer_rows gauge",
+                f"ingest_buffer_rows {buffer_stats['buffered']}",
+                "# HELP ingest_buffer_capacity Observations that may wait before posts are held back.",
+                "# TYPE ingest_buffer_capacity gauge",
+                f"ingest_buffer_capacity {buffer_stats['capacity']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+ingest_metrics = IngestMetrics()
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread at a fixed interval.
+
+    Stacks are aggregated in the folded format ("outer;inner;leaf count")
+    understood by flamegraph.pl and speedscope. Only the sampled thread is
+    seen; work done in worker processes by the parallel engine is not.
+    """
+
+    def __init__(self, thread_id, interval_seconds):
+        self.thread_id = thread_id
+        self.interval = interval_seconds
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name="report-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def running(self):
+        return self._thread is not None and not self._stop.is_set()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def dump(self, path):
+        """Write the folded stacks, most frequent first."""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top(self, limit=10):
+        """The leaf frames with the most samples, as (frame, share) pairs."""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return [(frame, count / self.samples) for frame, count in leaves.most_common(limit)] if self.samples else []
@@ -0,0 +1,141 @@
+import multiprocessing
+import time as timer
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from app.core.config import REPORT_SHARDS_PER_WORKER
+from app.models.models import SessionLocal, ReportShard
+from app.services.instrumentation import PhaseTimer, current_timer, timed
+
+def plan_shards(store_ids, shard_count):
+    """
+    Split store IDs into contiguous shards of roughly equal size.
+
+    Returns:
+        list: Store ID lists in report order
+    """
+    shard_count = max(1, min(shard_count, len(store_ids)))
+    size, remainder = divmod(len(store_ids), shard_count)
+    shards = []
+    start = 0
+    for i in range(shard_count):
+        end = start + size + (1 if i < remainder else 0)
+        shards.append(store_ids[start:end])
+        start = end
+    return [shard for shard in shards if shard]
+
+def iter_parallel_results(report_id, store_ids, max_timestamp, db, calculator, workers, windows=None):
+    """
+    Compute store results in a process pool and yield them in store order.
+
+    Stores are split into workers * REPORT_SHARDS_PER_WORKER contiguous shards,
+    each recorded as a ReportShard row. Every worker opens its own database
+    session and loads only its shard's store range in bulk. Results are yielded
+    shard by shard in report order as soon as the next shard is done, and the
+    workers' phase timings are added to the caller's timer.
+
+    Args:
+        report_id: The report being generated
+        store_ids: Store IDs in report order
+        max_timestamp: The end of the reporting window
+        db: The database session of the caller, used to record the shard plan
+        calculator: "scalar" or "vectorized"
+        workers: Number of worker processes
+        windows: Report windows (defaults to the standard windows)
+
+    Raises:
+        RuntimeError: If any shard fails; the shard's error is recorded first
+    """
+    shards = plan_shards(store_ids, workers * REPORT_SHARDS_PER_WORKER)
+
+    db.query(ReportShard).filter(ReportShard.report_id == report_id).delete()
+    for shard_index, shard in enumerate(shards):
+        db.add(ReportShard(
+            report_id=report_id,
+            shard_index=shard_index,
+            first_store_id=min(shard),
+            last_store_id=max(shard),
+            store_count=len(shard),
+        ))
+    db.commit()
+    print(f"Split {len(store_ids)} stores into {len(shards)} shards across {workers} workers")
+
+    # Spawned workers start from a clean interpreter instead of inheriting the
+    # parent's SQLite connections and web server threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [
+            pool.submit(compute_shard, report_id, shard_index, shard, max_timestamp, calculator, windows)
+            for shard_index, shard in enumerate(shards)
+        ]
+        try:
+            parent_timer = current_timer()
+            for shard_index, future in enumerate(futures):
+                with timed('shard_wait'):
+                    rows, query_count, elapsed, phases = future.result()
+                if parent_timer is not None:
+                    parent_timer.merge(phases)
+                print(
+                    f"Shard {shard_index + 1}/{len(shards)} complete: {len(rows)} stores "
+                    f"in {elapsed:.2f}s with {query_count} queries"
+                )
+                yield from rows
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+def compute_shard(report_id, shard_index, store_ids, max_timestamp, calculator, windows=None):
+    """
+    Compute one shard of a report in a worker process.
+
+    Returns:
+        tuple: The shard's report rows, the number of queries issued, the
+            wall time in seconds and the worker's phase timings
+    """
+    from app.services.report_service import (
+        count_queries, iter_bulk_results, iter_vectorized_results
+    )
+
+    started = timer.perf_counter()
+    phase_timer = PhaseTimer().start()
+    db = SessionLocal()
+    try:
+        shard = db.query(ReportShard).filter(
+            ReportShard.report_id == report_id,
+            ReportShard.shard_index == shard_index
+        ).first()
+        shard.status = "Running"
+        shard.started_at = datetime.utcnow()
+        db.commit()
+
+        store_range = (shard.first_store_id, shard.last_store_id)
+        with count_queries(db) as query_count:
+            if calculator == 'vectorized':
+                rows = iter_vectorized_results(store_ids, max_timestamp, db, store_range, windows)
+            else:
+                rows = list(iter_bulk_results(store_ids, max_timestamp, db, store_range, windows))
+
+        shard.status = "Complete"
+        shard.stores_done = len(rows)
+        shard.completed_at = datetime.utcnow()
+        db.commit()
+        phase_timer.stop()
+        return rows, query_count[0], timer.perf_counter() - started, phase_timer.phases()
+
+    except Exception as e:
+        print(f"Error computing shard {shard_index} of report {report_id}: {e}")
+        print(traceback.format_exc())
+        db.rollback()
+        try:
+            db.query(ReportShard).filter(
+                ReportShard.report_id == report_id,
+                ReportShard.shard_index == shard_index
+            ).update({"status": "Failed", "error": str(e)[:500], "completed_at": datetime.utcnow()})
+            db.commit()
+        except Exception as inner_e:
+            print(f"Error updating shard status: {inner_e}")
+        raise
+    finally:
+        phase_timer.stop()
+        db.close()
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app.models.models import StoreStatus
+
+def report_queries(db):
+    """The store_status queries reports depend on, with representative parameters."""
+    end = datetime.utcnow()
+    start = end - timedelta(days=7)
+    return {
+        # compute_uptime_downtime, once per store
+        'store_window': db.query(StoreStatus).filter(
+            StoreStatus.store_id == '',
+            StoreStatus.timestamp_utc >= start,
+            StoreStatus.timestamp_utc <= end
+        ).order_by(StoreStatus.timestamp_utc),
+        # load_report_window over a shard's store range
+        'range_window': db.query(StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.status).filter(
+            StoreStatus.timestamp_utc >= start,
+            StoreStatus.timestamp_utc <= end,
+            StoreStatus.store_id >= '',
+            StoreStatus.store_id <= ''
+        ).order_by(StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.id),
+        'max_timestamp': db.query(func.max(StoreStatus.timestamp_utc)),
+        'store_ids': db.query(StoreStatus.store_id).distinct(),
+        # iter_streaming_results, once per page
+        'store_page': db.query(StoreStatus.store_id).distinct().filter(
+            StoreStatus.store_id > ''
+        ).order_by(StoreStatus.store_id).limit(1),
+    }
+
+def explain(db, query):
+    """
+    The SQLite query plan of an ORM query.
+
+    Returns:
+        list: The detail line of every plan step
+    """
+    compiled = query.statement.compile(dialect=db.bind.dialect)
+    parameters = tuple(
+        str(value) if isinstance(value, datetime) else value
+        for value in (compiled.params[name] for name in compiled.positiontup)
+    )
+    rows = db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", parameters)
+    return [row[-1] for row in rows]
+
+def plan_problems(plan):
+    """Plan steps that read a whole table or sort rows in a temporary B-tree."""
+    return [
+        step for step in plan
+        if (step.startswith("SCAN ") and " INDEX " not in step) or "TEMP B-TREE" in step
+    ]
+
+def check_query_plans(db):
+    """
+    Run EXPLAIN QUERY PLAN on the report queries and warn about full scans.
+
+    Only SQLite is checked. A warning usually means the database is missing
+    the store_status indexes (see add_missing_indexes).
+
+    Returns:
+        dict: The problem steps of each query with any, by query name
+    """
+    if db.bind.dialect.name != 'sqlite':
+        return {}
+
+    problems = {}
+    for name, query in report_queries(db).items():
+        steps = plan_problems(explain(db, query))
+        if steps:
+            problems[name] = steps
+            print(f"WARNING: report query {name} reads a whole table or sorts without an index: {'; '.join(steps)}")
+    return problems
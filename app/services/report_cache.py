@@ -0,0 +1,190 @@
+import hashlib
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app.core.config import (
+    REPORT_CACHE, REPORT_RETENTION_HOURS, REPORT_MAX_FILES, REPORT_ENGINE, REPORT_CALCULATOR
+)
+from app.models.models import (
+    Report, ReportShard, StoreStatus, BusinessHours, StoreTimezone, IngestWatermark
+)
+from app.services.report_formats import FORMATS
+from app.services.report_service import report_output_path, profile_output_path
+
+# Finding a reusable report and registering a new one must happen atomically
+_trigger_lock = threading.Lock()
+
+def data_version(db):
+    """
+    Fingerprint the data a report would be computed from.
+
+    Combines the newest timestamp_utc and row count of store_status, the row
+    count and highest id of business_hours and store_timezone (replaced hours
+    get new ids), the last ingest of each CSV file and the configured report
+    engine, so any change that can alter a report changes the fingerprint.
+
+    Returns:
+        str: Hex digest identifying the data version
+    """
+    parts = [
+        db.query(func.max(StoreStatus.timestamp_utc), func.count(StoreStatus.id)).one(),
+        db.query(func.max(BusinessHours.id), func.count(BusinessHours.id)).one(),
+        db.query(func.max(StoreTimezone.id), func.count(StoreTimezone.id)).one(),
+        db.query(IngestWatermark.source, IngestWatermark.updated_at).order_by(IngestWatermark.source).all(),
+        (REPORT_ENGINE, REPORT_CALCULATOR),
+    ]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def find_reusable_report(db, version, windows=None, as_of=None, report_format=None):
+    """Return the newest queued, running or completed report for a data version, windows, as_of time and format, if any."""
+    reports = db.query(Report).filter(
+        Report.data_version == version,
+        Report.windows.is_(None) if windows is None else Report.windows == windows,
+        Report.as_of.is_(None) if as_of is None else Report.as_of == as_of,
+        Report.format.is_(None) if report_format is None else Report.format == report_format,
+        Report.status.in_(("Queued", "Running", "Complete"))
+    ).order_by(Report.created_at.desc())
+    for report in reports:
+        if report.status != "Complete" or (report.file_path and os.path.exists(report.file_path)):
+            return report
+    return None
+
+def create_or_reuse_report(db, submit, priority: int = 0, reuse: bool = True, windows: str = None, as_of=None,
+                           report_format: str = None):
+    """
+    Register and submit a report for the current data, reusing an equivalent one.
+
+    If REPORT_CACHE is enabled and a report for the same data version,
+    windows, as_of time and format is queued, running or complete, the
+    caller is attached to it instead of starting another computation. Old reports are evicted on the way.
+
+    Args:
+        db: The database session
+        submit: Callable taking the new report ID and priority that queues
+            the job; if it raises, the report is discarded and the error
+            propagates
+        priority: Priority of a new report job, higher runs first
+        reuse: Whether an equivalent report may be returned instead of
+            submitting a new one
+        windows: Extra report windows as normalized by format_windows, or
+            None for the standard ones
+        as_of: Naive UTC time the windows end at, or None for the newest
+            observation
+        report_format: Name of the report's file format, or None for CSV
+
+    Returns:
+        tuple: The report ID and whether a new report was submitted
+    """
+    with _trigger_lock:
+        evict_reports(db)
+        version = data_version(db)
+        if REPORT_CACHE and reuse:
+            report = find_reusable_report(db, version, windows, as_of, report_format)
+            if report is not None:
+                print(f"Reusing {report.status.lower()} report {report.id} for data version {version[:12]}")
+                return report.id, False
+
+        report_id = str(uuid.uuid4())
+        report = Report(
+            id=report_id, status="Queued", data_version=version, windows=windows, as_of=as_of,
+            format=report_format, priority=priority, queued_at=datetime.utcnow()
+        )
+        db.add(report)
+        db.commit()
+        try:
+            submit(report_id, priority)
+        except Exception:
+            db.delete(report)
+            db.commit()
+            raise
+        return report_id, True
+
+def create_report_batch(db, submit, anchors, priority: int = 0, windows: str = None, report_format: str = None):
+    """
+    Register and submit a backfill: one report per as_of time, computed by one job.
+
+    The reports share a batch_id, the ID of the first one, which is the job
+    submitted; cancelling it cancels the whole backfill.
+
+    Args:
+        db: The database session
+        submit: Callable taking the first report's ID and priority that
+            queues the job
+        anchors: Ascending naive UTC as_of times
+        priority: Priority of the job, higher runs first
+        windows: Extra report windows as normalized by format_windows
+        report_format: Name of the reports' file format, or None for CSV
+
+    Returns:
+        list: The report IDs, in as_of order
+    """
+    with _trigger_lock:
+        evict_reports(db)
+        version = data_version(db)
+        report_ids = [str(uuid.uuid4()) for _ in anchors]
+        reports = [
+            Report(
+                id=report_id, status="Queued", data_version=version, windows=windows, as_of=as_of,
+                batch_id=report_ids[0], format=report_format, priority=priority, queued_at=datetime.utcnow()
+            )
+            for report_id, as_of in zip(report_ids, anchors)
+        ]
+        db.add_all(reports)
+        db.commit()
+        try:
+            submit(report_ids[0], priority)
+        except Exception:
+            for report in reports:
+                db.delete(report)
+            db.commit()
+            raise
+        return report_ids
+
+def evict_reports(db, now=None):
+    """
+    Delete finished reports past retention and their files.
+
+    Completed, failed and cancelled reports older than REPORT_RETENTION_HOURS are removed,
+    then the oldest completed reports beyond REPORT_MAX_FILES, along with any
+    profile saved for them and copies converted to other formats. Only files
+    belonging to a report record are touched, so CSVs placed in the reports
+    directory by hand are left alone.
+
+    Returns:
+        int: Number of reports evicted
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(hours=REPORT_RETENTION_HOURS)
+    finished = db.query(Report).filter(Report.status.in_(("Complete", "Failed", "Cancelled")))
+
+    expired = finished.filter(Report.created_at < cutoff).all()
+    kept = finished.filter(Report.status == "Complete", Report.created_at >= cutoff).order_by(
+        Report.created_at.desc()
+    ).all()
+    expired += kept[REPORT_MAX_FILES:]
+
+    for report in expired:
+        paths = {report_output_path(report.id, report_format) for report_format in FORMATS.values()}
+        paths.update(path for path in (report.file_path, profile_output_path(report.id)) if path)
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        db.query(ReportShard).filter(ReportShard.report_id == report.id).delete(synchronize_session=False)
+        db.delete(report)
+    db.commit()
+
+    if expired:
+        print(f"Evicted {len(expired)} reports")
+    return len(expired)
+
+def fail_interrupted_reports(db):
+    """Mark reports left Queued or Running by a previous process as Failed."""
+    count = db.query(Report).filter(Report.status.in_(("Queued", "Running"))).update(
+        {"status": "Failed"}, synchronize_session=False
+    )
+    db.commit()
+    if count:
+        print(f"Marked {count} interrupted reports as Failed")
+    return count
@@ -0,0 +1,233 @@
+import csv
+import gzip
+import json
+import os
+import uuid
+from itertools import chain
+from typing import NamedTuple
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class ReportFormat(NamedTuple):
+    """A report file format: its name in the API, file extension, media type and optional dependency."""
+    name: str
+    extension: str
+    media_type: str
+    requires: str = None
+
+FORMATS = {
+    "csv": ReportFormat("csv", ".csv", "text/csv"),
+    "csv.gz": ReportFormat("csv.gz", ".csv.gz", "application/gzip"),
+    "csv.zst": ReportFormat("csv.zst", ".csv.zst", "application/zstd", "zstandard"),
+    "ndjson": ReportFormat("ndjson", ".ndjson", "application/x-ndjson"),
+    "parquet": ReportFormat("parquet", ".parquet", "application/vnd.apache.parquet", "pyarrow"),
+    "arrow": ReportFormat("arrow", ".arrow", "application/vnd.apache.arrow.file", "pyarrow"),
+}
+
+_AVAILABLE = {"pyarrow": pyarrow is not None, "zstandard": zstandard is not None}
+
+def get_format(name):
+    """
+    Look up a report format by name.
+
+    Args:
+        name: One of FORMATS, or None for csv
+
+    Returns:
+        ReportFormat: The format
+
+    Raises:
+        ValueError: If the format is unknown or its package isn't installed
+    """
+    report_format = FORMATS.get((name or "csv").strip().lower())
+    if report_format is None:
+        raise ValueError(f"Unknown report format '{name}', expected one of {', '.join(FORMATS)}")
+    if report_format.requires and not _AVAILABLE[report_format.requires]:
+        raise ValueError(f"The {report_format.name} format requires the {report_format.requires} package")
+    return report_format
+
+def _open_text(path, mode, report_format):
+    # Text streams of the CSV formats and ndjson
+    if report_format.name == "csv.gz":
+        return gzip.open(path, mode + "t", newline="", compresslevel=6)
+    if report_format.name == "csv.zst":
+        return zstandard.open(path, mode + "t", newline="")
+    return open(path, mode, newline="")
+
+class ReportWriter:
+    """
+    Writes a report file from batches of columns.
+
+    A batch is a list with one list of values per field, in fieldnames
+    order. Subclasses write the header when opened and each batch in one
+    call.
+    """
+
+    # Whether rows are readable from the file while it is being written
+    streamable = False
+
+    def __init__(self, path, fieldnames, report_format):
+        self.path = path
+        self.fieldnames = fieldnames
+        self.report_format = report_format
+
+    def write_batch(self, columns):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class CsvWriter(ReportWriter):
+    def __init__(self, path, fieldnames, report_format):
+        super().__init__(path, fieldnames, report_format)
+        self.streamable = report_format.name == "csv"
+        self.file = _open_text(path, "w", report_format)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(fieldnames)
+        self.flush()
+
+    def write_batch(self, columns):
+        self.writer.writerows(zip(*columns))
+
+    def flush(self):
+        # Compressed streams are only readable once closed
+        if self.streamable:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class NdjsonWriter(ReportWriter):
+    def __init__(self, path, fieldnames, report_format):
+        super().__init__(path, fieldnames, report_format)
+        self.file = _open_text(path, "w", report_format)
+
+    def write_batch(self, columns):
+        fieldnames = self.fieldnames
+        self.file.write("".join(json.dumps(dict(zip(fieldnames, values))) + "\n" for values in zip(*columns)))
+
+    def close(self):
+        self.file.close()
+
+class ArrowWriter(ReportWriter):
+    """Parquet (zstd-compressed) or Arrow IPC file; store_id is a string and every other column a double."""
+
+    def __init__(self, path, fieldnames, report_format):
+        super().__init__(path, fieldnames, report_format)
+        self.schema = pyarrow.schema(
+            [(fieldnames[0], pyarrow.string())] + [(name, pyarrow.float64()) for name in fieldnames[1:]]
+        )
+        if report_format.name == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            self.sink = pyarrow.OSFile(path, "wb")
+            self.writer = pyarrow.ipc.new_file(self.sink, self.schema)
+
+    def write_batch(self, columns):
+        arrays = [pyarrow.array(values, type=field.type) for values, field in zip(columns, self.schema)]
+        batch = pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.report_format.name == "parquet":
+            self.writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+        if self.report_format.name == "arrow":
+            self.sink.close()
+
+_WRITERS = {
+    "csv": CsvWriter, "csv.gz": CsvWriter, "csv.zst": CsvWriter,
+    "ndjson": NdjsonWriter, "parquet": ArrowWriter, "arrow": ArrowWriter,
+}
+
+def open_writer(path, fieldnames, report_format):
+    """Create a report file and return its ReportWriter."""
+    return _WRITERS[report_format.name](path, fieldnames, report_format)
+
+def _number(text):
+    # CSV values as written: an int 0 or a float
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def iter_column_batches(path, report_format, batch_rows):
+    """
+    Read a report file back as column batches.
+
+    Returns:
+        tuple: The field names and an iterator of batches of at most
+            batch_rows rows, as taken by ReportWriter.write_batch
+    """
+    if report_format.name in ("parquet", "arrow"):
+        if report_format.name == "parquet":
+            parquet_file = pyarrow.parquet.ParquetFile(path)
+            fieldnames = parquet_file.schema_arrow.names
+            batches = parquet_file.iter_batches(batch_size=batch_rows)
+        else:
+            reader = pyarrow.ipc.open_file(pyarrow.memory_map(path))
+            fieldnames = reader.schema.names
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        return fieldnames, ([column.to_pylist() for column in batch.columns] for batch in batches)
+
+    f = _open_text(path, "r", report_format)
+    if report_format.name == "ndjson":
+        first = f.readline()
+        fieldnames = list(json.loads(first)) if first else []
+        lines = (json.loads(line) for line in chain([first], f) if line.strip())
+        rows = ([record[name] for name in fieldnames] for record in lines)
+    else:
+        reader = csv.reader(f)
+        fieldnames = next(reader, [])
+        rows = ([values[0]] + [_number(value) for value in values[1:]] for values in reader)
+
+    def batches():
+        with f:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == batch_rows:
+                    yield [list(column) for column in zip(*batch)]
+                    batch = []
+            if batch:
+                yield [list(column) for column in zip(*batch)]
+
+    return fieldnames, batches()
+
+def convert_report(source_path, source_format, target_path, target_format, batch_rows=10000):
+    """
+    Write a report file in another format.
+
+    The file is written next to the target and renamed into place, so
+    concurrent conversions of the same report never expose a partial file.
+    """
+    fieldnames, batches = iter_column_batches(source_path, source_format, batch_rows)
+    temporary_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open_writer(temporary_path, fieldnames, target_format) as writer:
+            for columns in batches:
+                writer.write_batch(columns)
+        os.replace(temporary_path, target_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
@@ -0,0 +1,141 @@
+import heapq
+import itertools
+import threading
+import traceback
+from datetime import datetime
+from sqlalchemy import or_
+from app.core.config import REPORT_JOB_WORKERS, REPORT_QUEUE_SIZE
+from app.models.models import SessionLocal, Report
+
+class QueueFull(Exception):
+    """Raised when a report is submitted while the job queue is at capacity."""
+
+class ReportScheduler:
+    """
+    Runs report jobs on a fixed number of worker threads.
+
+    Jobs wait in a bounded priority queue (higher priority first, then first
+    come first served) and submit() raises QueueFull once max_queued jobs are
+    waiting. Every job opens its own database session. Queued jobs can be
+    cancelled outright; running jobs are asked to stop and do so at their next
+    progress update.
+    """
+
+    def __init__(self, workers: int, max_queued: int):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._queue = []
+        self._sequence = itertools.count()
+        self._running = {}
+        self._cancelled = set()
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def submit(self, report_id: str, priority: int = 0, profile: bool = False):
+        """
+        Queue a report for generation.
+
+        Args:
+            report_id: The report to generate
+            priority: Higher runs first
+            profile: Run the report under the sampling profiler
+
+        Raises:
+            QueueFull: If max_queued jobs are already waiting
+        """
+        with self._condition:
+            if len(self._queue) - len(self._cancelled) >= self.max_queued:
+                raise QueueFull(f"{self.max_queued} reports are already queued")
+            heapq.heappush(self._queue, (-priority, next(self._sequence), report_id, profile))
+            self._start_workers()
+            self._condition.notify()
+
+    def cancel(self, report_id: str):
+        """
+        Cancel a queued or running report.
+
+        Returns:
+            str: "Cancelled" if it was removed from the queue, "Cancelling" if
+                it is running and will stop shortly, None if it isn't scheduled
+        """
+        with self._condition:
+            if report_id in self._running:
+                self._running[report_id].set()
+                return "Cancelling"
+            queued = report_id not in self._cancelled and any(job[2] == report_id for job in self._queue)
+            if queued:
+                # Dropped from the heap when a worker pops it
+                self._cancelled.add(report_id)
+        if not queued:
+            return None
+        _set_status(report_id, "Cancelled")
+        return "Cancelled"
+
+    def queue_position(self, report_id: str):
+        """1-based position of a queued report in run order, or None."""
+        with self._condition:
+            waiting = [job for job in sorted(self._queue) if job[2] not in self._cancelled]
+        for position, job in enumerate(waiting, start=1):
+            if job[2] == report_id:
+                return position
+        return None
+
+    def stats(self):
+        with self._condition:
+            return {
+                'workers': self.workers,
+                'running': len(self._running),
+                'queued': len(self._queue) - len(self._cancelled),
+                'max_queued': self.max_queued,
+            }
+
+    def _start_workers(self):
+        # Threads are started on first use so importing the module has no side effects
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"report-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                _, _, report_id, profile = heapq.heappop(self._queue)
+                if report_id in self._cancelled:
+                    self._cancelled.discard(report_id)
+                    continue
+                cancel_event = threading.Event()
+                self._running[report_id] = cancel_event
+
+            try:
+                self._run(report_id, cancel_event, profile)
+            finally:
+                with self._condition:
+                    self._running.pop(report_id, None)
+
+    def _run(self, report_id, cancel_event, profile):
+        from app.services.report_service import generate_report
+
+        db = SessionLocal()
+        try:
+            generate_report(report_id, db, cancel_event=cancel_event, profile=profile)
+        except Exception as e:
+            # generate_report records its own failures; this guards the worker thread
+            print(f"Error running report job {report_id}: {e}")
+            print(traceback.format_exc())
+        finally:
+            db.close()
+
+def _set_status(report_id, status):
+    db = SessionLocal()
+    try:
+        # A backfill is queued as its first report and its status applies to all of them
+        db.query(Report).filter(or_(Report.id == report_id, Report.batch_id == report_id)).update(
+            {"status": status, "completed_at": datetime.utcnow()}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+report_scheduler = ReportScheduler(REPORT_JOB_WORKERS, REPORT_QUEUE_SIZE)
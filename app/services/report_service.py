@@ -1,22 +1,92 @@
+import numpy as np
 import pandas as pd
-import pytz
 from datetime import datetime, timedelta, time
 import os
-import csv
+import json
+import threading
+import time as timer
 import traceback
-from sqlalchemy import func
+from bisect import bisect_left
+from operator import itemgetter
+from collections import defaultdict
+from contextlib import contextmanager
+from sqlalchemy import distinct, event, func
+from app.core.config import (
+    REPORT_ENGINE, REPORT_CALCULATOR, REPORT_WORKERS, BULK_FETCH_SIZE, REPORT_FLUSH_ROWS, REPORT_PROFILE_INTERVAL_MS,
+    REPORT_PAGE_STORES, REPORT_MEMORY_LIMIT_MB
+)
 from app.models.models import Report, StoreStatus, BusinessHours, StoreTimezone
+from app.services.business_hours import BusinessHoursIndex, business_hours_cache
+from app.services.instrumentation import PhaseTimer, SamplingProfiler, report_metrics, rss_bytes, timed
+from app.services.report_formats import FORMATS, get_format, open_writer
+from app.services.report_windows import STANDARD_WINDOWS, parse_windows, report_fieldnames, report_row
+from app.services.timezone_service import ZoneOffsets, timezone_service, to_us
+from app.utils.helpers import store_range_filter
 
-def generate_report(report_id: str, db):
+DEFAULT_TIMEZONE = 'America/Chicago'
+
+REPORT_FIELDNAMES = report_fieldnames(STANDARD_WINDOWS)
+
+# Smallest page the streaming engine shrinks to under memory pressure
+MIN_PAGE_STORES = 100
+
+class ReportCancelled(Exception):
+    """Raised inside generate_report when its job was cancelled."""
+
+def generate_report(report_id: str, db, mode: str = None, calculator: str = None, workers: int = None,
+                    cancel_event=None, profile: bool = False):
     """
     Generate a report of store uptime and downtime.
     
     Args:
         report_id: The unique identifier for the report
         db: The database session
+        mode: "bulk" to read the reporting window with a few set-based queries,
+            "per_store" to query each store separately, "parallel" to compute
+            store shards in a process pool, "rollup" to add up the hourly
+            rollup, "snapshot" to slice observations out of the memory-mapped
+            store_status snapshot, "streaming" to compute pages of stores in
+            store_id order with bounded memory, "distributed" to publish store
+            shards to the report_shard queue for worker processes (defaults to
+            REPORT_ENGINE)
+        calculator: "scalar" to compute stores one at a time, "vectorized" to
+            compute all stores with array operations (defaults to REPORT_CALCULATOR;
+            not used by the rollup engine)
+        workers: Worker processes for the parallel engine (defaults to REPORT_WORKERS)
+        cancel_event: Optional threading.Event; once set, generation stops at
+            the next progress update and the report is marked Cancelled
+        profile: Sample the generating thread's stack and save it next to the
+            report as folded stacks
+    
+    Besides the hour, day and week, the report covers the extra windows
+    recorded on its record (see report_windows.parse_windows). Windows end
+    at the newest observation, or at the report's as_of time; reports of a
+    backfill (sharing a batch_id) are all generated by this call, in one
+    pass over the stores, whichever the engine.
+    
+    Per-phase timings of the run, with the highest resident memory seen, are
+    stored as JSON on the report record and added to the process-wide report
+    metrics, whatever the outcome.
     """
+    mode = mode or REPORT_ENGINE
+    calculator = calculator or REPORT_CALCULATOR
+    workers = workers or REPORT_WORKERS
+    phase_timer = PhaseTimer().start()
+    profiler = SamplingProfiler(threading.get_ident(), REPORT_PROFILE_INTERVAL_MS / 1000).start() if profile else None
+    query_count = [0]
+    stores_written = [0]
+    peak_rss = [rss_bytes()]
+    report_ids = [report_id]
+    report_format = None
     try:
-        print(f"Starting report generation for report_id: {report_id}")
+        print(f"Starting report generation for report_id: {report_id} ({mode} engine, {calculator} calculator)")
+        if mode not in ('bulk', 'per_store', 'parallel', 'rollup', 'snapshot', 'streaming', 'distributed'):
+            raise ValueError(f"Unknown report engine: {mode}")
+        if calculator not in ('scalar', 'vectorized'):
+            raise ValueError(f"Unknown report calculator: {calculator}")
+        if calculator == 'vectorized' and mode == 'per_store':
+            raise ValueError("The vectorized calculator requires the bulk, parallel, snapshot, streaming or distributed engine")
+        started = timer.perf_counter()
         
         # Check if report exists, if not create one
         report = db.query(Report).filter(Report.id == report_id).first()
@@ -26,150 +96,632 @@ def generate_report(report_id: str, db):
             db.add(report)
             db.commit()
         
-        # Get all unique store IDs
-        stores_query = db.query(StoreStatus.store_id).distinct()
-        
-        # Process all stores
-        store_ids = [row[0] for row in stores_query]
-        print(f"Processing {len(store_ids)} stores")
+        windows = parse_windows(report.windows)
+        report_format = get_format(report.format)
         
-        # Get current timestamp (max timestamp in our data)
-        max_timestamp = db.query(func.max(StoreStatus.timestamp_utc)).scalar()
-        print(f"Max timestamp in data: {max_timestamp}")
-        
-        # Create output directory if it doesn't exist
-        output_dir = os.path.join(os.getcwd(), 'reports')
-        os.makedirs(output_dir, exist_ok=True)
+        # A backfill's reports are computed together by the job of its first report
+        reports = [report]
+        if report.batch_id is not None:
+            reports = db.query(Report).filter(Report.batch_id == report.batch_id).order_by(Report.as_of).all()
+        report_ids[:] = [member.id for member in reports]
+        if report.as_of is not None:
+            print(f"Computing {len(reports)} reports as of {reports[0].as_of} to {reports[-1].as_of}")
         
         # Create output file
-        output_file = os.path.join(output_dir, f"report_{report_id}.csv")
+        output_file = report_output_path(report_id, report_format)
         print(f"Report will be saved to: {output_file}")
         
-        with open(output_file, 'w', newline='') as csvfile:
-            fieldnames = [
-                'store_id', 
-                'uptime_last_hour(in minutes)', 
-                'uptime_last_day(in hours)', 
-                'update_last_week(in hours)', 
-                'downtime_last_hour(in minutes)', 
-                'downtime_last_day(in hours)', 
-                'downtime_last_week(in hours)'
-            ]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            
-            # Process each store
-            for i, store_id in enumerate(store_ids):
-                # Print progress every 100 stores
-                if i % 100 == 0:
-                    print(f"Processing store {i+1}/{len(store_ids)}")
+        # Record the path up front so the partial report can be streamed
+        for member in reports:
+            member.status = "Running"
+            member.started_at = datetime.utcnow()
+            member.file_path = os.path.abspath(report_output_path(member.id, report_format))
+        db.commit()
+        
+        def on_progress(stores_done):
+            if cancel_event is not None and cancel_event.is_set():
+                raise ReportCancelled(report_id)
+            # Rows written to each report of a backfill, or to the one report
+            done = stores_done if isinstance(stores_done, list) else [stores_done]
+            for member, count in zip(reports, done):
+                member.stores_done = count
+            stores_written[0] = sum(done)
+            peak_rss[0] = max(peak_rss[0], rss_bytes())
+            db.commit()
+        
+        with count_queries(db) as query_count:
+            if report.as_of is not None:
+                # Historical reports: every anchor in one pass, whatever the engine
+                from app.services.historical_report import (
+                    count_stores_by_anchor, iter_anchor_results, write_anchor_reports
+                )
+                anchors = [member.as_of for member in reports]
+                for member, total in zip(reports, count_stores_by_anchor(db, anchors)):
+                    member.stores_total = total
+                on_progress([0] * len(reports))
                 
-                # Get timezone for the store
-                timezone_record = db.query(StoreTimezone).filter(StoreTimezone.store_id == store_id).first()
-                timezone_str = timezone_record.timezone_str if timezone_record else 'America/Chicago'
+                results = iter_anchor_results(anchors, db, windows, DEFAULT_TIMEZONE)
+                stores_done = write_anchor_reports(
+                    [member.file_path for member in reports], results, report_fieldnames(windows), on_progress,
+                    report_format
+                )
+            else:
+                if mode == 'streaming':
+                    # Stores are paged through as the report is written
+                    store_ids = None
+                    stores_total = db.query(func.count(distinct(StoreStatus.store_id))).scalar()
+                else:
+                    # Get all unique store IDs
+                    stores_query = db.query(StoreStatus.store_id).distinct()
+                    
+                    # Process all stores
+                    store_ids = [row[0] for row in stores_query]
+                    stores_total = len(store_ids)
+                print(f"Processing {stores_total} stores")
+                
+                # Get current timestamp (max timestamp in our data)
+                max_timestamp = db.query(func.max(StoreStatus.timestamp_utc)).scalar()
+                print(f"Max timestamp in data: {max_timestamp}")
                 
-                # Get business hours for the store
-                business_hours = db.query(BusinessHours).filter(BusinessHours.store_id == store_id).all()
+                report.stores_total = stores_total
+                on_progress(0)
                 
-                # Compute uptime and downtime
-                result = compute_uptime_downtime(store_id, max_timestamp, timezone_str, business_hours, db)
+                if mode == 'parallel':
+                    from app.services.parallel_report import iter_parallel_results
+                    results = iter_parallel_results(
+                        report_id, store_ids, max_timestamp, db, calculator, workers, windows
+                    )
+                elif mode == 'rollup':
+                    from app.services.rollup_service import iter_rollup_results
+                    results = iter_rollup_results(
+                        store_ids, max_timestamp, db, DEFAULT_TIMEZONE, empty_result, windows
+                    )
+                elif mode == 'snapshot':
+                    from app.services.status_snapshot import iter_snapshot_results
+                    results = iter_snapshot_results(store_ids, max_timestamp, db, calculator, DEFAULT_TIMEZONE, windows)
+                elif mode == 'streaming':
+                    results = iter_streaming_results(max_timestamp, db, calculator, windows)
+                elif mode == 'distributed':
+                    from app.services.shard_queue import iter_distributed_results
+                    results = iter_distributed_results(
+                        report_id, store_ids, max_timestamp, db, calculator, cancel_event
+                    )
+                elif calculator == 'vectorized':
+                    results = iter_vectorized_results(store_ids, max_timestamp, db, windows=windows)
+                elif mode == 'bulk':
+                    results = iter_bulk_results(store_ids, max_timestamp, db, windows=windows)
+                else:
+                    results = iter_per_store_results(store_ids, max_timestamp, db, windows)
                 
-                # Write result to CSV
-                writer.writerow(result)
+                write_report(
+                    output_file, results, stores_total, on_progress, report_fieldnames(windows), report_format
+                )
+                stores_done = [stores_total]
+        
+        elapsed = timer.perf_counter() - started
+        print(f"Computed {sum(stores_done)} stores in {elapsed:.2f}s with {query_count[0]} queries")
         
         # Update report status
-        report.status = "Complete"
-        report.completed_at = datetime.utcnow()
-        report.file_path = os.path.abspath(output_file)
+        peak_rss[0] = max(peak_rss[0], rss_bytes())
+        timings = json.dumps(
+            finish_timings(report_id, "Complete", phase_timer, profiler, sum(stores_done), query_count[0], peak_rss[0])
+        )
+        for member, count in zip(reports, stores_done):
+            member.status = "Complete"
+            member.stores_done = count
+            member.completed_at = datetime.utcnow()
+            member.timings = timings
         db.commit()
         print(f"Report generation completed for report_id: {report_id}")
         
+    except ReportCancelled:
+        print(f"Report generation cancelled for report_id: {report_id}")
+        db.rollback()
+        try:
+            timings = finish_timings(
+                report_id, "Cancelled", phase_timer, profiler, stores_written[0], query_count[0], peak_rss[0]
+            )
+            db.query(Report).filter(Report.id.in_(report_ids)).update(
+                {"status": "Cancelled", "completed_at": datetime.utcnow(), "timings": json.dumps(timings)},
+                synchronize_session=False
+            )
+            db.commit()
+            for cancelled_id in report_ids:
+                output_file = report_output_path(cancelled_id, report_format)
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+        except Exception as inner_e:
+            print(f"Error updating report status: {inner_e}")
+        
     except Exception as e:
         print(f"Error generating report: {e}")
         print(traceback.format_exc())
         
         # Update report as failed
         try:
-            report = db.query(Report).filter(Report.id == report_id).first()
-            if report:
+            db.rollback()
+            timings = finish_timings(
+                report_id, "Failed", phase_timer, profiler, stores_written[0], query_count[0], peak_rss[0]
+            )
+            for report in db.query(Report).filter(Report.id.in_(report_ids)):
                 report.status = "Failed"
-                db.commit()
+                report.timings = json.dumps(timings)
+            db.commit()
         except Exception as inner_e:
             print(f"Error updating report status: {inner_e}")
+    
+    finally:
+        # Normally stopped by finish_timings already
+        if phase_timer.elapsed is None:
+            phase_timer.stop()
+        if profiler is not None and profiler.running:
+            profiler.stop()
+
+def finish_timings(report_id, status, phase_timer, profiler, stores, queries, peak_rss=None):
+    """
+    Stop timing a report run, record it in the report metrics and save its profile.
+    
+    Returns:
+        dict: Total wall time, throughput, query count, exclusive seconds and
+            calls per phase (worker process phases of the parallel engine are
+            summed, so they can exceed the wall time), the highest resident
+            memory of the generating process sampled at progress updates and
+            the profile path
+    """
+    elapsed = phase_timer.stop()
+    phases = phase_timer.phases()
+    timings = {
+        'status': status,
+        'total_seconds': round(elapsed, 6),
+        'stores': stores,
+        'stores_per_second': round(stores / elapsed, 1) if elapsed else None,
+        'queries': queries,
+        'phases': phases,
+        'untimed_seconds': round(max(0.0, elapsed - sum(phase['seconds'] for phase in phases.values())), 6),
+        'peak_rss_bytes': peak_rss,
+        'profile': None,
+    }
+    if profiler is not None:
+        profiler.stop()
+        path = profile_output_path(report_id)
+        profiler.dump(path)
+        timings['profile'] = os.path.abspath(path)
+        timings['profile_samples'] = profiler.samples
+        timings['profile_top'] = [
+            {'frame': frame, 'share': round(share, 4)} for frame, share in profiler.top()
+        ]
+        print(f"Saved {profiler.samples} stack samples to {path}")
+    report_metrics.observe(status, elapsed, stores, queries, phases, peak_rss)
+    return timings
+
+def report_output_path(report_id: str, report_format=None):
+    """Return the file path for a report in a format (CSV by default), creating the reports directory if needed."""
+    # Create output directory if it doesn't exist
+    output_dir = os.path.join(os.getcwd(), 'reports')
+    os.makedirs(output_dir, exist_ok=True)
+    extension = (report_format or FORMATS["csv"]).extension
+    return os.path.join(output_dir, f"report_{report_id}{extension}")
+
+def profile_output_path(report_id: str):
+    """Return the folded stack profile path for a report."""
+    return os.path.join(os.path.dirname(report_output_path(report_id)), f"profile_{report_id}.folded")
+
+def write_report(output_file, results, total_stores, on_progress=None, fieldnames=REPORT_FIELDNAMES,
+                 report_format=None):
+    """
+    Write per-store results to the report file.
+    
+    Args:
+        output_file: Path of the file to create
+        results: Iterable of result rows as returned by compute_uptime_downtime
+        total_stores: Number of stores expected, used for progress output
+        on_progress: Optional callable receiving the number of rows written
+            after every flush
+        fieldnames: Report columns, from report_fieldnames for the report's windows
+        report_format: ReportFormat of the file (defaults to CSV)
+    
+    Rows are buffered and handed to the format's writer as column batches of
+    REPORT_FLUSH_ROWS stores, after which CSV files are flushed so readers
+    can stream the report while it is being generated.
+    """
+    values = itemgetter(*fieldnames)
+    with open_writer(output_file, fieldnames, report_format or FORMATS["csv"]) as writer:
+        rows = []
+        for i, result in enumerate(results):
+            # Print progress every 100 stores
+            if i % 100 == 0:
+                print(f"Processing store {i+1}/{total_stores}")
+            
+            rows.append(values(result))
+            if len(rows) < REPORT_FLUSH_ROWS:
+                continue
+            with timed('csv_write'):
+                writer.write_batch(list(zip(*rows)))
+                writer.flush()
+            rows = []
+            if on_progress:
+                on_progress(i + 1)
+        
+        if rows:
+            with timed('csv_write'):
+                writer.write_batch(list(zip(*rows)))
 
-def compute_uptime_downtime(store_id, current_timestamp, timezone_str, business_hours_data, db):
+@contextmanager
+def count_queries(db):
+    """Count the statements executed through a session while the block runs."""
+    count = [0]
+    
+    def on_execute(orm_execute_state):
+        count[0] += 1
+    
+    event.listen(db, "do_orm_execute", on_execute)
     try:
-        # Get the store's timezone
-        tz = pytz.timezone(timezone_str)
+        yield count
+    finally:
+        event.remove(db, "do_orm_execute", on_execute)
+
+def iter_per_store_results(store_ids, max_timestamp, db, windows=None):
+    """Compute each store's result with its own timezone, business hours and status queries."""
+    for store_id in store_ids:
+        with timed('load'):
+            # Get timezone for the store
+            timezone_record = db.query(StoreTimezone).filter(StoreTimezone.store_id == store_id).first()
+            timezone_str = timezone_record.timezone_str if timezone_record else DEFAULT_TIMEZONE
+            
+            # Get business hours for the store, compiled once and cached across reports
+            business_hours = business_hours_cache.get_or_build(
+                store_id, lambda: db.query(BusinessHours).filter(BusinessHours.store_id == store_id).all()
+            )
         
-        # Define the time intervals
-        hour_ago = current_timestamp - timedelta(hours=1)
-        day_ago = current_timestamp - timedelta(days=1)
-        week_ago = current_timestamp - timedelta(days=7)
+        # Compute uptime and downtime
+        yield compute_uptime_downtime(store_id, max_timestamp, timezone_str, business_hours, db, windows)
+
+def iter_bulk_results(store_ids, max_timestamp, db, store_range=None, windows=None):
+    """Compute each store's result from the reporting window loaded in bulk."""
+    windows = windows or STANDARD_WINDOWS
+    lookback = max(window.length for window in windows)
+    timezones, business_hours, observations = load_report_window(max_timestamp, db, store_range, lookback)
+    
+    for store_id in store_ids:
+        with timed('load'):
+            index = business_hours_cache.get_or_build(store_id, lambda: business_hours.get(store_id, []))
+        yield compute_uptime_downtime_from_week(
+            store_id,
+            max_timestamp,
+            timezones.get(store_id, DEFAULT_TIMEZONE),
+            index,
+            observations.get(store_id, []),
+            windows
+        )
+
+def iter_vectorized_results(store_ids, max_timestamp, db, store_range=None, windows=None):
+    """Compute every store's result at once from the reporting window loaded as arrays."""
+    from app.services.vectorized_calculator import load_report_columns, compute_report_rows
+    
+    windows = windows or STANDARD_WINDOWS
+    lookback = max(window.length for window in windows)
+    with timed('load'):
+        columns = load_report_columns(store_ids, max_timestamp, db, DEFAULT_TIMEZONE, store_range, lookback)
+    return compute_report_rows(store_ids, max_timestamp, columns, empty_result, windows)
+
+def iter_streaming_results(max_timestamp, db, calculator, windows=None):
+    """
+    Compute report rows a page of stores at a time, in store_id order.
+    
+    Store IDs are paged through with keyset pagination (REPORT_PAGE_STORES
+    after the last one seen) rather than listed up front, and each page's
+    reporting window is loaded and computed like the bulk engine's for its
+    store range, so only one page of observations is held at a time. When
+    the process's resident memory exceeds REPORT_MEMORY_LIMIT_MB after a
+    page, the page size is halved for the rest of the report.
+    """
+    page_size = REPORT_PAGE_STORES
+    last_store = None
+    while True:
+        with timed('load'):
+            stores_query = db.query(StoreStatus.store_id).distinct().order_by(StoreStatus.store_id)
+            if last_store is not None:
+                stores_query = stores_query.filter(StoreStatus.store_id > last_store)
+            page = [row[0] for row in stores_query.limit(page_size)]
+        if not page:
+            return
         
-        # Get store status data for each interval
-        hour_data = db.query(StoreStatus).filter(
-            StoreStatus.store_id == store_id,
-            StoreStatus.timestamp_utc >= hour_ago,
-            StoreStatus.timestamp_utc <= current_timestamp
-        ).order_by(StoreStatus.timestamp_utc).all()
+        store_range = (page[0], page[-1])
+        if calculator == 'vectorized':
+            yield from iter_vectorized_results(page, max_timestamp, db, store_range, windows)
+        else:
+            yield from iter_bulk_results(page, max_timestamp, db, store_range, windows)
+        last_store = page[-1]
         
-        day_data = db.query(StoreStatus).filter(
-            StoreStatus.store_id == store_id,
-            StoreStatus.timestamp_utc >= day_ago,
-            StoreStatus.timestamp_utc <= current_timestamp
-        ).order_by(StoreStatus.timestamp_utc).all()
+        rss = rss_bytes()
+        if REPORT_MEMORY_LIMIT_MB and rss > REPORT_MEMORY_LIMIT_MB * 1024 * 1024 and page_size > MIN_PAGE_STORES:
+            page_size = max(MIN_PAGE_STORES, page_size // 2)
+            print(f"WARNING: report memory {rss / 1024 / 1024:.0f} MiB is over REPORT_MEMORY_LIMIT_MB, "
+                  f"computing {page_size} stores per page")
+
+def load_report_window(current_timestamp, db, store_range=None, lookback=timedelta(days=7)):
+    """
+    Load everything a report needs with one streaming query per table.
+    
+    Args:
+        current_timestamp: The end of the reporting window
+        db: The database session
+        store_range: Optional inclusive (first, last) store_id range to load
+        lookback: Length of the longest report window
         
-        week_data = db.query(StoreStatus).filter(
-            StoreStatus.store_id == store_id,
-            StoreStatus.timestamp_utc >= week_ago,
-            StoreStatus.timestamp_utc <= current_timestamp
-        ).order_by(StoreStatus.timestamp_utc).all()
+    Returns:
+        tuple: Timezone string by store, business hours by store and the
+            status observations of the longest window by store sorted by timestamp
+    """
+    window_start = current_timestamp - lookback
+    timezones, business_hours = load_store_metadata(db, store_range)
+    
+    with timed('load'):
+        observations = defaultdict(list)
+        status_query = db.query(
+            StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.status
+        ).filter(
+            StoreStatus.timestamp_utc >= window_start,
+            StoreStatus.timestamp_utc <= current_timestamp,
+            *store_range_filter(StoreStatus.store_id, store_range)
+        ).order_by(StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.id)
+        for row in status_query.yield_per(BULK_FETCH_SIZE):
+            observations[row.store_id].append(row)
+    
+    return timezones, business_hours, observations
+
+def load_store_metadata(db, store_range=None):
+    """
+    Load the timezone and business hours of every store in a range.
+    
+    Args:
+        db: The database session
+        store_range: Optional inclusive (first, last) store_id range to load
+    
+    Returns:
+        tuple: Timezone string by store and business hours rows by store
+    """
+    with timed('load'):
+        timezones = dict(db.query(StoreTimezone.store_id, StoreTimezone.timezone_str).filter(
+            *store_range_filter(StoreTimezone.store_id, store_range)
+        ))
         
-        # Calculate uptime and downtime for each interval
-        uptime_last_hour, downtime_last_hour = calculate_uptime_downtime(
-            hour_data, hour_ago, current_timestamp, business_hours_data, tz, interval='hour'
-        )
+        # Plain rows rather than entities: the progress commits made while the
+        # report is written would expire entities and reload them one by one
+        business_hours = defaultdict(list)
+        hours_query = db.query(
+            BusinessHours.store_id, BusinessHours.day_of_week,
+            BusinessHours.start_time_local, BusinessHours.end_time_local
+        ).filter(
+            *store_range_filter(BusinessHours.store_id, store_range)
+        ).order_by(BusinessHours.store_id, BusinessHours.id)
+        for hours in hours_query.yield_per(BULK_FETCH_SIZE):
+            business_hours[hours.store_id].append(hours)
+    
+    return timezones, business_hours
+
+def compute_uptime_downtime(store_id, current_timestamp, timezone_str, business_hours_data, db, windows=None):
+    """
+    Compute a store's uptime and downtime, querying its observations.
+    
+    The observations of the longest window are queried once; shorter windows
+    are suffixes of it.
+    """
+    windows = windows or STANDARD_WINDOWS
+    try:
+        window_start = current_timestamp - max(window.length for window in windows)
         
-        uptime_last_day, downtime_last_day = calculate_uptime_downtime(
-            day_data, day_ago, current_timestamp, business_hours_data, tz, interval='day'
-        )
+        # Get the store's timezone offsets over the longest window
+        tz = timezone_service.offsets(timezone_str, to_us(window_start), to_us(current_timestamp))
         
-        uptime_last_week, downtime_last_week = calculate_uptime_downtime(
-            week_data, week_ago, current_timestamp, business_hours_data, tz, interval='week'
-        )
+        # Get store status data for the longest window
+        with timed('load'):
+            status_data = db.query(StoreStatus).filter(
+                StoreStatus.store_id == store_id,
+                StoreStatus.timestamp_utc >= window_start,
+                StoreStatus.timestamp_utc <= current_timestamp
+            ).order_by(StoreStatus.timestamp_utc).all()
+        
+        return summarize_windows(store_id, current_timestamp, tz, business_hours_data, status_data, windows)
+    except Exception as e:
+        print(f"Error computing uptime/downtime for store {store_id}: {e}")
+        return empty_result(store_id, windows)
+
+def compute_uptime_downtime_from_week(store_id, current_timestamp, timezone_str, business_hours_data, week_data,
+                                      windows=None):
+    """
+    Compute uptime and downtime from a store's already loaded observations.
+    
+    Args:
+        store_id: The store to compute
+        current_timestamp: The end of the reporting window
+        timezone_str: The store's timezone
+        business_hours_data: The store's BusinessHoursIndex or business hours rows
+        week_data: The store's observations for the longest window (the last
+            week by default) sorted by timestamp
+        windows: Report windows (defaults to STANDARD_WINDOWS)
+        
+    Returns:
+        dict: The report row for the store
+    """
+    windows = windows or STANDARD_WINDOWS
+    try:
+        window_start = current_timestamp - max(window.length for window in windows)
+        tz = timezone_service.offsets(timezone_str, to_us(window_start), to_us(current_timestamp))
         
-        return {
-            'store_id': store_id,
-            'uptime_last_hour(in minutes)': round(uptime_last_hour, 2),
-            'uptime_last_day(in hours)': round(uptime_last_day, 2),
-            'update_last_week(in hours)': round(uptime_last_week, 2),
-            'downtime_last_hour(in minutes)': round(downtime_last_hour, 2),
-            'downtime_last_day(in hours)': round(downtime_last_day, 2),
-            'downtime_last_week(in hours)': round(downtime_last_week, 2)
-        }
+        return summarize_windows(store_id, current_timestamp, tz, business_hours_data, week_data, windows)
     except Exception as e:
         print(f"Error computing uptime/downtime for store {store_id}: {e}")
-        return {
-            'store_id': store_id,
-            'uptime_last_hour(in minutes)': 0,
-            'uptime_last_day(in hours)': 0,
-            'update_last_week(in hours)': 0,
-            'downtime_last_hour(in minutes)': 0,
-            'downtime_last_day(in hours)': 0,
-            'downtime_last_week(in hours)': 0
-        }
+        return empty_result(store_id, windows)
+
+def summarize_windows(store_id, current_timestamp, tz, business_hours_data, status_data, windows=None):
+    """Build a store's report row from its observations over the longest window."""
+    windows = windows or STANDARD_WINDOWS
+    values = calculate_windows(status_data, current_timestamp, business_hours_data, tz, windows)
+    return rounded_row(store_id, windows, values)
+
+def rounded_row(store_id, windows, values):
+    """Build a report row from unrounded (uptime, downtime) values per window."""
+    return report_row(store_id, windows, [(round(up, 2), round(down, 2)) for up, down in values])
+
+def empty_result(store_id, windows=None):
+    """Report row used when a store's metrics could not be computed."""
+    windows = windows or STANDARD_WINDOWS
+    return report_row(store_id, windows, [(0, 0)] * len(windows))
+
+def calculate_windows(status_data, end_time, business_hours, tz, windows):
+    """
+    Calculate uptime and downtime of several trailing windows in one pass.
+    
+    Gives exactly what calculate_uptime_downtime returns for each window
+    given the observations inside it. Each window adds up the same terms in
+    the same order, but every observation is localized, checked against
+    business hours and diffed with its predecessor once, however many
+    windows contain it.
+    
+    Args:
+        status_data: The store's observations over the longest window, sorted by timestamp
+        end_time: The end of every window
+        business_hours: The store's BusinessHoursIndex or business hours rows
+        tz: The store's ZoneOffsets or pytz timezone
+        windows: ReportWindows ending at end_time
+        
+    Returns:
+        list: (uptime, downtime) per window, in minutes for windows with
+            divisor 1 and in hours otherwise
+    """
+    return calculate_windows_us(
+        [to_us(entry.timestamp_utc) for entry in status_data],
+        [entry.status == 'active' for entry in status_data],
+        end_time, business_hours, tz, windows
+    )
+
+def calculate_windows_us(timestamps, active_flags, end_time, business_hours, tz, windows, open_mask=None):
+    """
+    calculate_windows for observations given as columns.
+    
+    Args:
+        timestamps: Sorted observation instants as UTC microseconds since the epoch
+        active_flags: Whether each observation was active
+        end_time: The end of every window
+        business_hours: The store's BusinessHoursIndex or business hours rows
+        tz: The store's ZoneOffsets or pytz timezone
+        windows: ReportWindows ending at end_time
+        open_mask: Optional list of whether each observation is within
+            business hours, when already computed for these observations
+    
+    Differences of microseconds are turned into minutes the way
+    timedelta.total_seconds() does, so the results are the same floats.
+    """
+    if not isinstance(business_hours, BusinessHoursIndex):
+        business_hours = BusinessHoursIndex(business_hours)
+    if not isinstance(tz, ZoneOffsets):
+        tz = timezone_service.offsets(tz.zone)
+    
+    n = len(timestamps)
+    end_us = to_us(end_time)
+    with timed('timezone'):
+        local_end_us = end_us + tz.offset_at(end_us)
+    
+    starts = []
+    firsts = []
+    totals = []
+    for window in windows:
+        start_us = to_us(end_time - window.length)
+        with timed('business_minutes'):
+            totals.append(business_hours.business_minutes_us(
+                start_us + tz.offset_at(start_us), local_end_us, end_us - start_us
+            ))
+        starts.append(start_us)
+        firsts.append(bisect_left(timestamps, start_us))
+    
+    uptime = [0] * len(windows)
+    for w in range(len(windows)):
+        # A single observation is extrapolated to the entire window
+        if totals[w] != 0 and n - firsts[w] == 1 and active_flags[-1]:
+            uptime[w] = totals[w]
+    
+    # Windows with business time and several observations are interpolated,
+    # longest first so the windows containing an observation are a prefix
+    walking = sorted((w for w in range(len(windows)) if totals[w] != 0 and n - firsts[w] > 1), key=firsts.__getitem__)
+    if walking:
+        lowest = firsts[walking[0]]
+        open_flags = None
+        if not business_hours.is_24x7 and open_mask is not None:
+            open_flags = open_mask[lowest:]
+        elif not business_hours.is_24x7:
+            with timed('timezone'):
+                week_positions = tz.week_positions(np.array(timestamps[lowest:], dtype=np.int64))
+            with timed('interpolation'):
+                open_flags = business_hours.open_mask(week_positions).tolist()
+        
+        with timed('interpolation'):
+            prev_index = -1
+            prev_time = None
+            prev_active = False
+            for i in range(lowest, n):
+                # Skip if outside business hours
+                if open_flags is not None and not open_flags[i - lowest]:
+                    continue
+                
+                status_time = timestamps[i]
+                active = active_flags[i]
+                gap = (status_time - prev_time) / 1000000 / 60 if prev_time is not None else None
+                
+                for w in walking:
+                    first = firsts[w]
+                    if first > i:
+                        break
+                    if prev_index < first:
+                        # First valid observation - extrapolate backward to the window start
+                        if i == first and active:
+                            time_diff = (status_time - starts[w]) / 1000000 / 60
+                            uptime[w] += min(time_diff, totals[w])
+                    else:
+                        uptime[w] += gap if prev_active else 0
+                    
+                    # Last observation - extrapolate forward to the end
+                    if i == n - 1:
+                        time_diff = (end_us - status_time) / 1000000 / 60
+                        business_time_diff = min(time_diff, totals[w] - uptime[w])
+                        uptime[w] += business_time_diff if active else 0
+                
+                prev_index = i
+                prev_time = status_time
+                prev_active = active
+    
+    values = []
+    for window, total, up in zip(windows, totals, uptime):
+        if total == 0:
+            values.append((0, 0))
+        elif window.divisor == 1:
+            values.append((up, total - up))
+        else:
+            values.append((up / window.divisor, (total - up) / window.divisor))
+    return values
 
 def calculate_uptime_downtime(status_data, start_time, end_time, business_hours, tz, interval='hour'):
+    # Accept compiled business hours or the raw rows
+    if not isinstance(business_hours, BusinessHoursIndex):
+        business_hours = BusinessHoursIndex(business_hours)
+    
+    # Accept the store's offset table or a pytz timezone
+    if not isinstance(tz, ZoneOffsets):
+        tz = timezone_service.offsets(tz.zone)
+    
     # If no business hours defined, assume 24/7 operation
-    is_24x7 = len(business_hours) == 0
+    is_24x7 = business_hours.is_24x7
     
     # Convert UTC times to local timezone for business hours comparison
-    local_start_time = start_time.replace(tzinfo=pytz.UTC).astimezone(tz)
-    local_end_time = end_time.replace(tzinfo=pytz.UTC).astimezone(tz)
+    with timed('timezone'):
+        start_us = to_us(start_time)
+        end_us = to_us(end_time)
+        local_start_us = start_us + tz.offset_at(start_us)
+        local_end_us = end_us + tz.offset_at(end_us)
     
     # Calculate total business time in the interval
-    total_business_minutes = calculate_business_minutes(local_start_time, local_end_time, business_hours, is_24x7)
+    with timed('business_minutes'):
+        total_business_minutes = business_hours.business_minutes_us(local_start_us, local_end_us, end_us - start_us)
     
     # If no business hours in this interval, return zeros
     if total_business_minutes == 0:
@@ -196,37 +748,45 @@ def calculate_uptime_downtime(status_data, start_time, end_time, business_hours,
         prev_time = None
         prev_status = None
         
-        for i, status_entry in enumerate(status_data):
-            status_time = status_entry.timestamp_utc
-            status = status_entry.status
-            local_time = status_time.replace(tzinfo=pytz.UTC).astimezone(tz)
-            
-            # Skip if outside business hours
-            if not is_24x7 and not is_within_business_hours(local_time, business_hours):
-                continue
+        # Local week positions of all observations in one vectorized lookup
+        if not is_24x7:
+            with timed('timezone'):
+                week_positions = tz.week_positions(
+                    np.fromiter((to_us(entry.timestamp_utc) for entry in status_data), np.int64, len(status_data))
+                )
+        
+        with timed('interpolation'):
+            open_flags = None if is_24x7 else business_hours.open_mask(week_positions).tolist()
+            for i, status_entry in enumerate(status_data):
+                status_time = status_entry.timestamp_utc
+                status = status_entry.status
+                
+                # Skip if outside business hours
+                if open_flags is not None and not open_flags[i]:
+                    continue
                 
-            if prev_time is None:
-                # First valid observation - extrapolate backward to start
-                if i == 0 and status == 'active':
-                    # Calculate minutes from interval start to first observation
-                    time_diff = (status_time - start_time).total_seconds() / 60
+                if prev_time is None:
+                    # First valid observation - extrapolate backward to start
+                    if i == 0 and status == 'active':
+                        # Calculate minutes from interval start to first observation
+                        time_diff = (status_time - start_time).total_seconds() / 60
+                        # Adjust for business hours
+                        business_time_diff = min(time_diff, total_business_minutes)
+                        uptime_minutes += business_time_diff if status == 'active' else 0
+                else:
+                    # Calculate minutes between observations
+                    time_diff = (status_time - prev_time).total_seconds() / 60
+                    uptime_minutes += time_diff if prev_status == 'active' else 0
+                
+                # If last observation, extrapolate forward to end
+                if i == len(status_data) - 1:
+                    time_diff = (end_time - status_time).total_seconds() / 60
                     # Adjust for business hours
-                    business_time_diff = min(time_diff, total_business_minutes)
+                    business_time_diff = min(time_diff, total_business_minutes - uptime_minutes)
                     uptime_minutes += business_time_diff if status == 'active' else 0
-            else:
-                # Calculate minutes between observations
-                time_diff = (status_time - prev_time).total_seconds() / 60
-                uptime_minutes += time_diff if prev_status == 'active' else 0
-            
-            # If last observation, extrapolate forward to end
-            if i == len(status_data) - 1:
-                time_diff = (end_time - status_time).total_seconds() / 60
-                # Adjust for business hours
-                business_time_diff = min(time_diff, total_business_minutes - uptime_minutes)
-                uptime_minutes += business_time_diff if status == 'active' else 0
-            
-            prev_time = status_time
-            prev_status = status
+                
+                prev_time = status_time
+                prev_status = status
     
     # Calculate downtime
     downtime_minutes = total_business_minutes - uptime_minutes
@@ -245,69 +805,8 @@ def calculate_business_minutes(start_time, end_time, business_hours, is_24x7):
         # If 24/7 operation, all minutes are business minutes
         return (end_time - start_time).total_seconds() / 60
     
-    total_minutes = 0
-    current_time = start_time
-    
-    # Iterate through each day in the interval
-    while current_time.date() <= end_time.date():
-        day_of_week = current_time.weekday()  # 0=Monday, 6=Sunday
-        
-        # Find business hours for this day
-        day_hours = [h for h in business_hours if h.day_of_week == day_of_week]
-        
-        for hours in day_hours:
-            # Convert business hours to datetime objects for this specific date
-            business_start = datetime.combine(
-                current_time.date(), 
-                hours.start_time_local
-            ).replace(tzinfo=current_time.tzinfo)
-            
-            business_end = datetime.combine(
-                current_time.date(), 
-                hours.end_time_local
-            ).replace(tzinfo=current_time.tzinfo)
-            
-            # Handle business hours that span midnight
-            if hours.end_time_local < hours.start_time_local:
-                business_end += timedelta(days=1)
-            
-            # Find overlap with our interval
-            interval_start = max(current_time, business_start)
-            interval_end = min(end_time, business_end)
-            
-            # Add minutes if there is an overlap
-            if interval_start < interval_end:
-                total_minutes += (interval_end - interval_start).total_seconds() / 60
-        
-        # Move to next day
-        next_day = (current_time + timedelta(days=1)).date()
-        current_time = datetime.combine(next_day, time.min).replace(tzinfo=current_time.tzinfo)
-    
-    return total_minutes
+    return BusinessHoursIndex(business_hours).business_minutes(start_time, end_time)
 
 def is_within_business_hours(local_time, business_hours):
     """Check if the given local time is within business hours."""
-    day_of_week = local_time.weekday()  # 0=Monday, 6=Sunday
-    
-    # Check if the time falls within any business hours for this day
-    for hours in business_hours:
-        if hours.day_of_week == day_of_week:
-            business_start = datetime.combine(
-                local_time.date(), 
-                hours.start_time_local
-            ).replace(tzinfo=local_time.tzinfo)
-            
-            business_end = datetime.combine(
-                local_time.date(), 
-                hours.end_time_local
-            ).replace(tzinfo=local_time.tzinfo)
-            
-            # Handle business hours that span midnight
-            if hours.end_time_local < hours.start_time_local:
-                business_end += timedelta(days=1)
-            
-            # Check if current time is within this business hour range
-            if business_start <= local_time <= business_end:
-                return True
-    
-    return False 
\ No newline at end of file
+    return BusinessHoursIndex(business_hours).is_open(local_time)
\ No newline at end of file
@@ -0,0 +1,121 @@
+import asyncio
+import re
+import zlib
+from app.core.config import REPORT_STREAM_CHUNK_BYTES, REPORT_FOLLOW_POLL_SECONDS
+from app.models.models import Report, run_db
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def parse_range(header: str, size: int):
+    """
+    Parse a single-range HTTP Range header against a file size.
+
+    Args:
+        header: The Range header, e.g. "bytes=0-1023", "bytes=1024-" or "bytes=-500"
+        size: Size of the file in bytes
+
+    Returns:
+        tuple: Inclusive (start, end) byte positions
+
+    Raises:
+        ValueError: If the header is malformed or the range can't be satisfied
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        raise ValueError(f"Unsupported range: {header}")
+
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+
+    if start >= size or start > end:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, end
+
+def iter_file_range(path: str, start: int, end: int):
+    """Yield bytes start..end (inclusive) of a file in chunks."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(REPORT_STREAM_CHUNK_BYTES, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+async def iter_report_file(report_id: str, path: str, follow: bool = False):
+    """
+    Yield the complete CSV lines written to a report so far.
+
+    Rows are flushed by write_report as they are computed, so the file
+    can be read while generation is still running; a partially written last
+    line is held back until it is finished. An async generator: waiting for
+    new rows holds neither a thread nor a database connection.
+
+    Args:
+        report_id: The report being read
+        path: The report's CSV file
+        follow: Keep reading as the file grows until the report is no longer
+            Running, instead of stopping at the current end of the file
+    """
+    with open(path, 'rb') as f:
+        pending = b''
+        while True:
+            data = f.read(REPORT_STREAM_CHUNK_BYTES)
+            if data:
+                data = pending + data
+                cut = data.rfind(b'\n') + 1
+                pending = data[cut:]
+                if cut:
+                    yield data[:cut]
+                continue
+
+            status = await run_db(_report_status, report_id)
+            if status != "Running":
+                # Finished (or failed) after our last read: drain what is left
+                rest = pending + f.read()
+                if rest and status == "Complete":
+                    yield rest
+                return
+            if not follow:
+                return
+            await asyncio.sleep(REPORT_FOLLOW_POLL_SECONDS)
+
+def gzip_chunks(chunks):
+    """Compress a byte stream to gzip on the fly."""
+    compressor = _gzip_compressor()
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+async def gzip_chunks_async(chunks):
+    """gzip_chunks for an async byte stream."""
+    compressor = _gzip_compressor()
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def _gzip_compressor():
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def accepts_gzip(accept_encoding: str):
+    """Whether an Accept-Encoding header allows a gzip response."""
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+def _report_status(db, report_id: str):
+    # A fresh session per check so a long-lived stream sees commits made by the generator
+    report = db.query(Report.status).filter(Report.id == report_id).first()
+    return report.status if report else None
@@ -0,0 +1,125 @@
+import re
+from collections import namedtuple
+from datetime import timedelta
+
+# A trailing window ending at the report's current timestamp. Values are
+# reported in minutes for windows up to an hour (divisor 1) and in hours
+# otherwise (divisor 60)
+ReportWindow = namedtuple('ReportWindow', ['name', 'length', 'divisor'])
+
+STANDARD_WINDOWS = [
+    ReportWindow('hour', timedelta(hours=1), 1),
+    ReportWindow('day', timedelta(days=1), 60),
+    ReportWindow('week', timedelta(days=7), 60),
+]
+
+# Longest custom window; every store's observations over it are held in memory
+MAX_WINDOW = timedelta(days=90)
+
+WINDOW_PATTERN = re.compile(r"^(\d+)([mhdw])$")
+WINDOW_UNITS = {'m': timedelta(minutes=1), 'h': timedelta(hours=1), 'd': timedelta(days=1), 'w': timedelta(weeks=1)}
+
+def parse_windows(spec):
+    """
+    Parse a comma-separated list of extra windows such as "15m,30d".
+
+    Windows are a positive count of minutes (m), hours (h), days (d) or weeks
+    (w). Windows as long as a standard or earlier window are dropped.
+
+    Args:
+        spec: The list of windows, or None/empty for none
+
+    Returns:
+        list: The standard windows followed by the extra ones
+
+    Raises:
+        ValueError: If a window is malformed, zero or longer than MAX_WINDOW
+    """
+    windows = list(STANDARD_WINDOWS)
+    for part in (spec or "").split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        window = parse_window(part)
+        if any(existing.length == window.length for existing in windows):
+            continue
+        windows.append(window)
+    return windows
+
+def parse_window(part):
+    """
+    Parse a single window length such as "15m".
+
+    Raises:
+        ValueError: If the window is malformed, zero or longer than MAX_WINDOW
+    """
+    match = WINDOW_PATTERN.match(part)
+    if not match:
+        raise ValueError(f"Invalid window {part!r}, expected a number followed by m, h, d or w")
+    length = int(match.group(1)) * WINDOW_UNITS[match.group(2)]
+    if not timedelta(0) < length <= MAX_WINDOW:
+        raise ValueError(f"Window {part!r} must be longer than zero and at most {MAX_WINDOW.days} days")
+    return ReportWindow(part, length, 1 if length <= timedelta(hours=1) else 60)
+
+def select_windows(spec):
+    """
+    Parse a comma-separated selection of windows such as "hour,day,15m".
+
+    Windows are standard window names or lengths as accepted by
+    parse_windows; a length equal to a standard window is that window.
+    Repeated windows are dropped.
+
+    Returns:
+        list: The selected windows in the order given
+
+    Raises:
+        ValueError: If a window is invalid or none is given
+    """
+    standard = {window.name: window for window in STANDARD_WINDOWS}
+    windows = []
+    for part in (spec or "").split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        window = standard.get(part) or parse_window(part)
+        window = next((s for s in STANDARD_WINDOWS if s.length == window.length), window)
+        if all(existing.length != window.length for existing in windows):
+            windows.append(window)
+    if not windows:
+        raise ValueError("At least one window is required")
+    return windows
+
+def format_windows(windows):
+    """The extra windows of a window list as a spec for parse_windows, or None."""
+    extra = [window.name for window in windows[len(STANDARD_WINDOWS):]]
+    return ",".join(extra) or None
+
+def window_fields(window):
+    """The (uptime, downtime) CSV column names of a window."""
+    if window.name == 'week':
+        # The historical column name of weekly uptime
+        return 'update_last_week(in hours)', 'downtime_last_week(in hours)'
+    unit = 'minutes' if window.divisor == 1 else 'hours'
+    return f'uptime_last_{window.name}(in {unit})', f'downtime_last_{window.name}(in {unit})'
+
+def report_fieldnames(windows):
+    """The CSV header of a report: the standard columns, then an uptime/downtime pair per extra window."""
+    standard = [window_fields(window) for window in windows[:len(STANDARD_WINDOWS)]]
+    extra = [field for window in windows[len(STANDARD_WINDOWS):] for field in window_fields(window)]
+    return ['store_id'] + [up for up, _ in standard] + [down for _, down in standard] + extra
+
+def report_row(store_id, windows, values):
+    """
+    Build a report row.
+
+    Args:
+        store_id: The store
+        windows: The report windows
+        values: (uptime, downtime) per window, already rounded
+    """
+    row = {'store_id': store_id}
+    for window, (uptime, downtime) in zip(windows, values):
+        uptime_field, downtime_field = window_fields(window)
+        row[uptime_field] = uptime
+        row[downtime_field] = downtime
+    return row
@@ -0,0 +1,510 @@
+import itertools
+import threading
+import time as timer
+import numpy as np
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import and_, case, func, or_
+from app.core.config import BULK_FETCH_SIZE
+from app.models.models import StoreStatus, BusinessHours, StoreTimezone, StoreUptimeHourly
+from app.services.business_hours import MINUTE_US, business_hours_cache
+from app.services.instrumentation import timed
+from app.services.report_windows import STANDARD_WINDOWS
+from app.services.timezone_service import EPOCH, timezone_service, to_us
+
+HOUR_US = 60 * MINUTE_US
+
+# NaT as int64 microseconds, stored as NULL
+NAT_US = np.datetime64('NaT').astype(np.int64)
+
+# Store IDs per DELETE/IN batch
+STORE_BATCH_SIZE = 500
+
+# Ingestion and reports both refresh the rollup; they must not interleave
+_refresh_lock = threading.Lock()
+
+def from_us(value):
+    """Microseconds since the epoch to a naive UTC datetime."""
+    return EPOCH + timedelta(microseconds=int(value))
+
+class StoreSchedule:
+    """
+    A store's business hours and timezone, evaluated the way calculate_windows_us does.
+    """
+
+    def __init__(self, index, timezone_str):
+        self.index = index
+        self.offsets = timezone_service.offsets(timezone_str)
+
+    def open_flags(self, utc_us):
+        """Whether each observation instant is within business hours."""
+        if self.index.is_24x7:
+            return np.ones(len(utc_us), dtype=bool)
+        return self.index.open_mask(self.offsets.week_positions(utc_us))
+
+    def business_minutes(self, start_us, end_us):
+        """Business minutes of a window, laid out with the UTC offset at its start."""
+        return self.index.business_minutes_us(
+            start_us + self.offsets.offset_at(start_us), end_us + self.offsets.offset_at(end_us), end_us - start_us
+        )
+
+def compute_buckets(schedule, hour_starts, obs_us, obs_active, carry_in):
+    """
+    The interpolation state of consecutive hourly buckets for one store.
+
+    The report calculator only counts observations within business hours: a
+    gap between two of them is uptime when the earlier one was active, and
+    the first and last observations of a window are extrapolated to its
+    edges. Each bucket keeps its first and last observations, its first one
+    within business hours, the gaps ending in it and the latest observation
+    within business hours up to its end, so that any window's uptime can be
+    put together from whole buckets and the observations around them.
+
+    Args:
+        schedule: The store's StoreSchedule
+        hour_starts: Consecutive bucket starts in UTC microseconds
+        obs_us: Sorted observation timestamps within the buckets
+        obs_active: Whether each observation was active
+        carry_in: (UTC microseconds, active) of the latest observation within
+            business hours before the first bucket, or None
+
+    Returns:
+        dict: Column arrays, one value per bucket; timestamps are int64 UTC
+            microseconds with NaT's value where a bucket has none
+    """
+    n_buckets = len(hour_starts)
+    hours = np.arange(n_buckets)
+    bucket = (obs_us - hour_starts[0]) // HOUR_US
+    is_open = schedule.open_flags(obs_us)
+
+    # Each observation within business hours, and the gap since the one before it
+    # (carried in for the first) that counts as uptime when that one was active
+    open_us, open_active, open_bucket = obs_us[is_open], obs_active[is_open], bucket[is_open]
+    carry_us, carry_active = carry_in if carry_in is not None else (0, False)
+    previous_us = np.r_[np.int64(carry_us), open_us[:-1]]
+    previous_active = np.r_[bool(carry_active), open_active[:-1]]
+    gaps = np.where(previous_active, open_us - previous_us, 0)
+
+    # Arrays end with a NaT sentinel that indexes of -1 and past the end both pick
+    obs_us, obs_active, is_open = np.r_[obs_us, NAT_US], np.r_[obs_active, False], np.r_[is_open, False]
+    open_us, open_active = np.r_[open_us, NAT_US], np.r_[open_active, False]
+
+    counts = np.bincount(bucket, minlength=n_buckets)
+    first = np.where(counts > 0, np.searchsorted(bucket, hours, side='left'), -1)
+    last = np.where(counts > 0, np.searchsorted(bucket, hours, side='right') - 1, -1)
+    first_open = np.where(
+        np.bincount(open_bucket, minlength=n_buckets) > 0, np.searchsorted(open_bucket, hours, side='left'), -1
+    )
+    latest_open = np.searchsorted(open_bucket, hours, side='right') - 1
+    carried = (latest_open < 0) & (carry_in is not None)
+
+    return {
+        'observations': counts,
+        'first_utc': obs_us[first],
+        'first_open': is_open[first],
+        'first_active': obs_active[first],
+        'last_utc': obs_us[last],
+        'last_open': is_open[last],
+        'last_active': obs_active[last],
+        'first_open_utc': open_us[first_open],
+        'up_us': np.bincount(open_bucket, weights=gaps, minlength=n_buckets).astype(np.int64),
+        'up_pairs': np.bincount(open_bucket, weights=previous_active, minlength=n_buckets).astype(np.int64),
+        'open_utc': np.where(carried, carry_us, open_us[latest_open]),
+        'open_active': np.where(carried, bool(carry_active), open_active[latest_open]),
+    }
+
+def load_schedules(db, store_ids, default_timezone):
+    """Build StoreSchedules for the given stores, skipping invalid timezones."""
+    store_ids = set(store_ids)
+    timezones = dict(db.query(StoreTimezone.store_id, StoreTimezone.timezone_str))
+    business_hours = defaultdict(list)
+    for hours in db.query(BusinessHours).order_by(BusinessHours.store_id, BusinessHours.id).yield_per(BULK_FETCH_SIZE):
+        if hours.store_id in store_ids:
+            business_hours[hours.store_id].append(hours)
+
+    schedules = {}
+    for store_id in store_ids:
+        index = business_hours_cache.get_or_build(store_id, lambda: business_hours.get(store_id, []))
+        try:
+            schedules[store_id] = StoreSchedule(index, timezones.get(store_id, default_timezone))
+        except Exception as e:
+            print(f"Error loading schedule for store {store_id}: {e}")
+    return schedules
+
+def refresh_hourly_rollup(db, changes=None, default_timezone='America/Chicago', stores=None):
+    """
+    Bring store_uptime_hourly up to date with store_status.
+
+    Every store gets a bucket for each complete UTC hour from its first
+    observation up to the hour containing the latest observation overall.
+    Stores continue from their last bucket; stores listed in changes are
+    recomputed from the hour of their earliest new observation, or from
+    scratch when mapped to None (e.g. their business hours changed). Only
+    the given stores are brought forward when stores is passed; the others
+    catch up at the next full refresh, which reports run first.
+
+    Args:
+        db: The database session; the caller commits
+        changes: Optional mapping of store_id to the earliest new observation
+            timestamp, or None to rebuild the store
+        default_timezone: Timezone used for stores without a timezone record
+        stores: Optional store IDs to refresh, e.g. those in changes, instead
+            of every store in store_status
+
+    Returns:
+        int: Number of buckets written
+    """
+    changes = changes or {}
+    with _refresh_lock:
+        started = timer.perf_counter()
+        max_timestamp = db.query(func.max(StoreStatus.timestamp_utc)).scalar()
+        if max_timestamp is None:
+            return 0
+        current_hour = to_us(max_timestamp) // HOUR_US * HOUR_US
+
+        last_buckets = _last_buckets(db, stores)
+        if stores is None:
+            stores = (row[0] for row in db.query(StoreStatus.store_id).distinct())
+
+        # Plan where each store resumes: (start hour or None for its first observation, carry-in)
+        plan = {}
+        rebuilt = []
+        late = []
+        for store_id in stores:
+            last = last_buckets.get(store_id)
+            if last is None or (store_id in changes and changes[store_id] is None):
+                plan[store_id] = (None, None)
+                if last is not None:
+                    rebuilt.append(store_id)
+                continue
+            start, carry_in = last[0] + HOUR_US, last[1]
+            if store_id in changes:
+                changed_hour = to_us(changes[store_id]) // HOUR_US * HOUR_US
+                if changed_hour < start:
+                    start = changed_hour
+                    carry_in = _carry(db.query(StoreUptimeHourly.open_utc, StoreUptimeHourly.open_active).filter(
+                        StoreUptimeHourly.store_id == store_id,
+                        StoreUptimeHourly.hour_start == from_us(start - HOUR_US)
+                    ).first())
+                    late.append((store_id, start))
+            if start < current_hour:
+                plan[store_id] = (start, carry_in)
+
+        if not plan:
+            return 0
+
+        # Clear the buckets that are about to be recomputed
+        for i in range(0, len(rebuilt), STORE_BATCH_SIZE):
+            db.query(StoreUptimeHourly).filter(
+                StoreUptimeHourly.store_id.in_(rebuilt[i:i + STORE_BATCH_SIZE])
+            ).delete(synchronize_session=False)
+        for store_id, start in late:
+            db.query(StoreUptimeHourly).filter(
+                StoreUptimeHourly.store_id == store_id,
+                StoreUptimeHourly.hour_start >= from_us(start)
+            ).delete(synchronize_session=False)
+
+        schedules = load_schedules(db, plan, default_timezone)
+        table = StoreUptimeHourly.__table__
+        pending = []
+        written = 0
+
+        for store_id, observations in _iter_plan_observations(db, plan):
+            start, carry_in = plan[store_id]
+            schedule = schedules.get(store_id)
+            if schedule is None or not observations and start is None:
+                continue
+            obs_us = np.array([row.timestamp_utc for row in observations], dtype='datetime64[us]').astype(np.int64)
+            obs_active = np.array([row.status == 'active' for row in observations], dtype=bool)
+            if start is None:
+                start = obs_us[0] // HOUR_US * HOUR_US
+            if start >= current_hour:
+                continue
+
+            in_range = obs_us < current_hour
+            hour_starts = np.arange(start, current_hour, HOUR_US, dtype=np.int64)
+            buckets = compute_buckets(schedule, hour_starts, obs_us[in_range], obs_active[in_range], carry_in)
+            names = list(buckets)
+            values = [
+                (column.astype('datetime64[us]') if name.endswith('_utc') else column).tolist()
+                for name, column in buckets.items()
+            ]
+            pending.extend(
+                dict(zip(names, bucket), store_id=store_id, hour_start=hour_start)
+                for hour_start, *bucket in zip(hour_starts.astype('datetime64[us]').tolist(), *values)
+            )
+            written += len(hour_starts)
+
+            # Insert across stores in large batches
+            if len(pending) >= BULK_FETCH_SIZE:
+                db.execute(table.insert(), pending)
+                pending = []
+
+        if pending:
+            db.execute(table.insert(), pending)
+
+        print(f"Refreshed hourly rollup for {len(plan)} stores: {written} buckets in {timer.perf_counter() - started:.2f}s")
+        return written
+
+def _last_buckets(db, store_ids=None):
+    """Latest bucket start and carried observation (see _carry) of the given stores, or of all of them."""
+    if store_ids is None:
+        return _query_last_buckets(db)
+    store_ids = sorted(store_ids)
+    last_buckets = {}
+    for i in range(0, len(store_ids), STORE_BATCH_SIZE):
+        last_buckets.update(_query_last_buckets(db, store_ids[i:i + STORE_BATCH_SIZE]))
+    return last_buckets
+
+def _query_last_buckets(db, store_ids=None):
+    latest = db.query(
+        StoreUptimeHourly.store_id.label('store_id'),
+        func.max(StoreUptimeHourly.hour_start).label('hour_start')
+    )
+    if store_ids is not None:
+        latest = latest.filter(StoreUptimeHourly.store_id.in_(store_ids))
+    latest = latest.group_by(StoreUptimeHourly.store_id).subquery()
+    rows = db.query(
+        StoreUptimeHourly.store_id, StoreUptimeHourly.hour_start, StoreUptimeHourly.open_utc,
+        StoreUptimeHourly.open_active
+    ).join(
+        latest,
+        (StoreUptimeHourly.store_id == latest.c.store_id) & (StoreUptimeHourly.hour_start == latest.c.hour_start)
+    )
+    return {
+        store_id: (to_us(hour_start), _carry((open_utc, open_active)))
+        for store_id, hour_start, open_utc, open_active in rows
+    }
+
+def _carry(row):
+    """A bucket's latest observation within business hours as (UTC microseconds, active), or None."""
+    if row is None or row[0] is None:
+        return None
+    return to_us(row[0]), bool(row[1])
+
+def _iter_plan_observations(db, plan):
+    """
+    Yield (store_id, observations) for every planned store, sorted by timestamp.
+
+    Stores are read STORE_BATCH_SIZE at a time by store_id: those rebuilt
+    from scratch in full, those resuming from a bucket from the earliest
+    resume hour of their batch.
+    """
+    columns = (StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.status)
+    order = (StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.id)
+
+    rebuild = sorted(store_id for store_id, (start, _) in plan.items() if start is None)
+    resume = sorted((store_id, start) for store_id, (start, _) in plan.items() if start is not None)
+    batches = [dict.fromkeys(rebuild[i:i + STORE_BATCH_SIZE]) for i in range(0, len(rebuild), STORE_BATCH_SIZE)]
+    batches += [dict(resume[i:i + STORE_BATCH_SIZE]) for i in range(0, len(resume), STORE_BATCH_SIZE)]
+    for batch in batches:
+        rows = db.query(*columns).filter(StoreStatus.store_id.in_(list(batch)))
+        starts = [start for start in batch.values() if start is not None]
+        if starts:
+            rows = rows.filter(StoreStatus.timestamp_utc >= from_us(min(starts)))
+        found = set()
+        for store_id, group in itertools.groupby(
+            rows.order_by(*order).yield_per(BULK_FETCH_SIZE), key=lambda row: row.store_id
+        ):
+            found.add(store_id)
+            if batch[store_id] is None:
+                yield store_id, list(group)
+            else:
+                start = from_us(batch[store_id])
+                yield store_id, [row for row in group if row.timestamp_utc >= start]
+        for store_id in batch:
+            if store_id not in found:
+                yield store_id, []
+
+def iter_rollup_results(store_ids, max_timestamp, db, default_timezone, empty_result, windows=None):
+    """
+    Compute report rows from the hourly rollup.
+
+    Gives what calculate_windows_us gives from the raw observations. A
+    window's complete hours are added up from their buckets with a single
+    grouped query; only observations in the partial hour at the start of
+    each window and in the current hour are read from store_status.
+
+    Args:
+        store_ids: Store IDs in report order
+        max_timestamp: The end of every window
+        db: The database session
+        default_timezone: Timezone used for stores without a timezone record
+        empty_result: Builder for the row of a store that could not be computed
+        windows: Report windows (defaults to STANDARD_WINDOWS)
+    """
+    from app.services.report_service import rounded_row
+    windows = windows or STANDARD_WINDOWS
+    with timed('rollup_refresh'):
+        refresh_hourly_rollup(db, default_timezone=default_timezone)
+        db.commit()
+
+    end_us = to_us(max_timestamp)
+    current_hour = end_us // HOUR_US * HOUR_US
+    # Each window's start and first complete hour; windows starting in the current hour have none
+    spans = []
+    for window in windows:
+        start_us = to_us(max_timestamp - window.length)
+        spans.append((start_us, min(-(-start_us // HOUR_US) * HOUR_US, current_hour)))
+
+    bucket = StoreUptimeHourly
+    columns = [bucket.store_id]
+    for _, full_start in spans:
+        inside = bucket.hour_start >= from_us(full_start)
+        columns += [
+            func.sum(case((inside, bucket.observations), else_=0)),
+            func.sum(case((inside, bucket.up_us), else_=0)),
+            func.sum(case((inside, bucket.up_pairs), else_=0)),
+            func.min(case((inside, bucket.first_utc))),
+            func.min(case((and_(inside, bucket.first_open, bucket.first_active), bucket.first_utc))),
+            func.min(case((inside, bucket.first_open_utc))),
+            func.max(case((inside, bucket.last_utc))),
+            func.max(case((and_(inside, bucket.last_active), bucket.last_utc))),
+            func.max(case((and_(inside, bucket.last_open, bucket.last_active), bucket.last_utc))),
+        ]
+    carry_hours = {full_start - HOUR_US for _, full_start in spans} | {current_hour - HOUR_US}
+    raw_ranges = [
+        and_(StoreStatus.timestamp_utc >= from_us(start_us), StoreStatus.timestamp_utc < from_us(full_start))
+        for start_us, full_start in spans if start_us < full_start
+    ]
+    raw_ranges.append(
+        and_(StoreStatus.timestamp_utc >= from_us(current_hour), StoreStatus.timestamp_utc <= max_timestamp)
+    )
+
+    with timed('load'):
+        sums = {
+            row[0]: [
+                value if i % 9 < 3 or value is None else to_us(value) for i, value in enumerate(row[1:])
+            ]
+            for row in db.query(*columns).filter(
+                bucket.hour_start >= from_us(min(full_start for _, full_start in spans)),
+                bucket.hour_start < from_us(current_hour)
+            ).group_by(bucket.store_id)
+        }
+        carries = {
+            (store_id, to_us(hour_start)): _carry((open_utc, open_active))
+            for store_id, hour_start, open_utc, open_active in db.query(
+                bucket.store_id, bucket.hour_start, bucket.open_utc, bucket.open_active
+            ).filter(bucket.hour_start.in_([from_us(hour) for hour in sorted(carry_hours)]))
+        }
+        raw = defaultdict(list)
+        for row in db.query(StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.status).filter(
+            or_(*raw_ranges)
+        ).order_by(StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.id).yield_per(BULK_FETCH_SIZE):
+            raw[row.store_id].append(row)
+
+        schedules = load_schedules(db, store_ids, default_timezone)
+
+    no_buckets = [0, 0, 0] + [None] * 6
+    for store_id in store_ids:
+        schedule = schedules.get(store_id)
+        if schedule is None:
+            yield empty_result(store_id, windows)
+            continue
+
+        observations = raw.get(store_id, [])
+        raw_us = [to_us(row.timestamp_utc) for row in observations]
+        with timed('interpolation'):
+            raw_open = schedule.open_flags(np.array(raw_us, dtype=np.int64)).tolist()
+        raw_obs = [(t, row.status == 'active', is_open) for t, row, is_open in zip(raw_us, observations, raw_open)]
+        store_sums = sums.get(store_id)
+
+        values = []
+        for w, (window, (start_us, full_start)) in enumerate(zip(windows, spans)):
+            with timed('business_minutes'):
+                total = schedule.business_minutes(start_us, end_us)
+            if total == 0:
+                values.append((0, 0))
+                continue
+            with timed('interpolation'):
+                up = _window_uptime(
+                    start_us, end_us, total,
+                    raw_obs[bisect_left(raw_us, start_us):bisect_left(raw_us, full_start)],
+                    store_sums[w * 9:w * 9 + 9] if store_sums is not None else no_buckets,
+                    carries.get((store_id, full_start - HOUR_US)),
+                    carries.get((store_id, current_hour - HOUR_US)),
+                    raw_obs[bisect_left(raw_us, max(start_us, current_hour)):]
+                )
+            if window.divisor == 1:
+                values.append((up, total - up))
+            else:
+                values.append((up / window.divisor, (total - up) / window.divisor))
+        yield rounded_row(store_id, windows, values)
+
+def _window_uptime(start_us, end_us, total, head, sums, carry_start, carry_end, tail):
+    """
+    A window's uptime in minutes, as calculate_windows_us computes it.
+
+    Args:
+        start_us: Start of the window in UTC microseconds
+        end_us: End of the window
+        total: Business minutes of the window
+        head: (UTC microseconds, active, within business hours) of the
+            observations before the window's first complete hour
+        sums: The window's aggregates of bucket columns (see iter_rollup_results)
+        carry_start: Carried observation of the bucket before the first complete hour
+        carry_end: Carried observation of the bucket before the current hour
+        tail: Observations of the window in the current hour
+
+    Returns:
+        The uptime: 0 when nothing was counted, a float otherwise
+    """
+    count, up_us, up_pairs, first_us, first_up_us, first_open_us, last_us, last_active_us, last_up_us = sums
+    n = len(head) + count + len(tail)
+    if n == 0:
+        return 0
+    if n == 1:
+        # A single observation is extrapolated to the entire window
+        active = (tail or head)[-1][1] if tail or head else last_active_us is not None
+        return total if active else 0
+
+    total_us = round(total * MINUTE_US)
+    uptime = 0
+    counted = False
+    previous = None
+    seen = False
+    for part in (head, None, tail):
+        if part is None:
+            if not count:
+                continue
+            if previous is None:
+                # First observation within business hours - extrapolate backward to the start
+                if not seen and first_up_us is not None and first_up_us == first_us:
+                    uptime += min(first_us - start_us, total_us)
+                    counted = True
+                if first_open_us is not None:
+                    # Gaps ending in the buckets, less the one into the window from before it
+                    if carry_start is not None and carry_start[1]:
+                        up_us -= first_open_us - carry_start[0]
+                        up_pairs -= 1
+                    previous = carry_end
+            else:
+                previous = carry_end
+            uptime += up_us
+            counted = counted or up_pairs > 0
+            seen = True
+            continue
+        for status_time, active, is_open in part:
+            if is_open:
+                if previous is None:
+                    if not seen and active:
+                        uptime += min(status_time - start_us, total_us)
+                        counted = True
+                elif previous[1]:
+                    uptime += status_time - previous[0]
+                    counted = True
+                previous = (status_time, active)
+            seen = True
+
+    # Last observation within business hours - extrapolate forward to the end
+    if tail:
+        last_time, last_up = tail[-1][0], tail[-1][1] and tail[-1][2]
+    elif count:
+        last_time, last_up = last_us, last_up_us == last_us
+    else:
+        last_time, last_up = head[-1][0], head[-1][1] and head[-1][2]
+    if last_up:
+        uptime += min(end_us - last_time, total_us - uptime)
+        counted = True
+    return uptime / MINUTE_US if counted else 0
@@ -0,0 +1,303 @@
+import csv
+import io
+import math
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, select
+from app.core.config import SHARD_LEASE_SECONDS, SHARD_MAX_ATTEMPTS, SHARD_POLL_SECONDS, SHARD_STORES
+from app.models.models import SessionLocal, Report, ReportShard, StoreStatus
+from app.services.instrumentation import timed
+from app.services.parallel_report import plan_shards
+from app.services.report_service import (
+    ReportCancelled, count_queries, iter_bulk_results, iter_vectorized_results
+)
+from app.services.report_windows import parse_windows, report_fieldnames
+
+# Shards of the distributed engine live in the report_shard table: the
+# coordinator publishes them as Queued, workers claim them by taking a lease
+# with a conditional UPDATE (so two workers never both win a shard), renew the
+# lease while computing, and upload the shard's CSV rows with the same
+# condition. A shard whose lease expired, because its worker died or hung, is
+# claimed again; the database is the only thing workers share.
+
+def worker_name():
+    """Default ID of a worker: host, process and a random suffix."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def publish_shards(db, report_id, store_ids, max_timestamp, calculator):
+    """
+    Split a report's stores into shards of about SHARD_STORES and queue them.
+
+    Shards are contiguous store_id ranges, which is all a worker needs to
+    load and compute its stores.
+
+    Returns:
+        int: Number of shards
+    """
+    shards = plan_shards(sorted(store_ids), math.ceil(len(store_ids) / SHARD_STORES))
+    db.query(ReportShard).filter(ReportShard.report_id == report_id).delete()
+    for shard_index, shard in enumerate(shards):
+        db.add(ReportShard(
+            report_id=report_id,
+            shard_index=shard_index,
+            first_store_id=shard[0],
+            last_store_id=shard[-1],
+            store_count=len(shard),
+            status="Queued",
+            max_timestamp=max_timestamp,
+            calculator=calculator,
+            attempts=0,
+        ))
+    db.commit()
+    return len(shards)
+
+def _claimable(now):
+    # Queued, or claimed by a worker whose lease ran out, of a report still running
+    return and_(
+        ReportShard.max_timestamp.isnot(None),
+        or_(
+            ReportShard.status == "Queued",
+            and_(ReportShard.status == "Running", ReportShard.lease_expires_at < now),
+        ),
+        ReportShard.report_id.in_(select(Report.id).where(Report.status == "Running")),
+    )
+
+def claim_shard(db, worker_id, report_id=None):
+    """
+    Take the lease of the next claimable shard.
+
+    Shards that lost their lease SHARD_MAX_ATTEMPTS times are marked Failed
+    instead of being claimed again.
+
+    Args:
+        db: The database session
+        worker_id: ID of the claiming worker
+        report_id: Only claim shards of this report
+
+    Returns:
+        int: The claimed shard's row ID, or None if there is none
+    """
+    now = datetime.utcnow()
+    candidates = db.query(ReportShard.id, ReportShard.attempts).filter(_claimable(now))
+    if report_id is not None:
+        candidates = candidates.filter(ReportShard.report_id == report_id)
+    for shard_id, attempts in candidates.order_by(ReportShard.id).limit(16).all():
+        condition = and_(ReportShard.id == shard_id, _claimable(now))
+        if (attempts or 0) >= SHARD_MAX_ATTEMPTS:
+            db.query(ReportShard).filter(condition).update({
+                "status": "Failed", "completed_at": now,
+                "error": f"Shard lost its lease or failed {attempts} times",
+            }, synchronize_session=False)
+            db.commit()
+            continue
+        claimed = db.query(ReportShard).filter(condition).update({
+            "status": "Running",
+            "worker_id": worker_id,
+            "lease_expires_at": now + timedelta(seconds=SHARD_LEASE_SECONDS),
+            "attempts": (attempts or 0) + 1,
+            "started_at": now,
+            "error": None,
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return shard_id
+    return None
+
+def _held(shard_id, worker_id):
+    return and_(ReportShard.id == shard_id, ReportShard.worker_id == worker_id, ReportShard.status == "Running")
+
+def renew_lease(db, shard_id, worker_id):
+    """Extend a claimed shard's lease; False if the worker no longer holds it."""
+    renewed = db.query(ReportShard).filter(_held(shard_id, worker_id)).update(
+        {"lease_expires_at": datetime.utcnow() + timedelta(seconds=SHARD_LEASE_SECONDS)},
+        synchronize_session=False
+    )
+    db.commit()
+    return renewed == 1
+
+def run_shard(shard_id, worker_id):
+    """
+    Compute a claimed shard and upload its rows.
+
+    The lease is renewed from a background thread while the shard computes.
+    The rows are only stored if the worker still holds the lease; on an error
+    the shard is queued again, or failed once it used SHARD_MAX_ATTEMPTS.
+
+    Returns:
+        bool: Whether the shard's rows were uploaded
+    """
+    db = SessionLocal()
+    stop = threading.Event()
+
+    def heartbeat():
+        lease_db = SessionLocal()
+        try:
+            while not stop.wait(SHARD_LEASE_SECONDS / 3):
+                if not renew_lease(lease_db, shard_id, worker_id):
+                    return
+        except Exception as e:
+            print(f"Error renewing the lease of shard {shard_id}: {e}")
+        finally:
+            lease_db.close()
+
+    renewer = threading.Thread(target=heartbeat, name=f"lease-{shard_id}", daemon=True)
+    renewer.start()
+    try:
+        shard = db.query(ReportShard).filter(ReportShard.id == shard_id).first()
+        report = db.query(Report).filter(Report.id == shard.report_id).first()
+        windows = parse_windows(report.windows)
+        store_range = (shard.first_store_id, shard.last_store_id)
+        started = time.perf_counter()
+
+        with count_queries(db) as query_count:
+            with timed('load'):
+                store_ids = [row[0] for row in db.query(StoreStatus.store_id).distinct().filter(
+                    StoreStatus.store_id.between(*store_range)
+                ).order_by(StoreStatus.store_id)]
+            if shard.calculator == 'vectorized':
+                rows = iter_vectorized_results(store_ids, shard.max_timestamp, db, store_range, windows)
+            else:
+                rows = list(iter_bulk_results(store_ids, shard.max_timestamp, db, store_range, windows))
+
+        with timed('csv_write'):
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=report_fieldnames(windows))
+            writer.writerows(rows)
+        stop.set()
+        uploaded = db.query(ReportShard).filter(_held(shard_id, worker_id)).update({
+            "status": "Complete",
+            "stores_done": len(rows),
+            "result": buffer.getvalue(),
+            "completed_at": datetime.utcnow(),
+            "lease_expires_at": None,
+        }, synchronize_session=False)
+        db.commit()
+        if not uploaded:
+            print(f"Shard {shard.shard_index} of report {shard.report_id} was taken over, discarding its rows")
+            return False
+        print(
+            f"Shard {shard.shard_index} of report {shard.report_id} complete: {len(rows)} stores "
+            f"in {time.perf_counter() - started:.2f}s with {query_count[0]} queries"
+        )
+        return True
+
+    except Exception as e:
+        print(f"Error computing shard {shard_id}: {e}")
+        print(traceback.format_exc())
+        db.rollback()
+        stop.set()
+        try:
+            attempts = db.query(ReportShard.attempts).filter(ReportShard.id == shard_id).scalar() or 0
+            db.query(ReportShard).filter(_held(shard_id, worker_id)).update({
+                "status": "Failed" if attempts >= SHARD_MAX_ATTEMPTS else "Queued",
+                "error": str(e)[:500],
+                "lease_expires_at": None,
+            }, synchronize_session=False)
+            db.commit()
+        except Exception as inner_e:
+            print(f"Error updating shard status: {inner_e}")
+        return False
+    finally:
+        stop.set()
+        renewer.join()
+        db.close()
+
+def work(worker_id=None, report_id=None, stop_event=None, exit_when_idle=False):
+    """
+    Run a shard worker: claim and compute shards until stopped.
+
+    Args:
+        worker_id: ID recorded on claimed shards (defaults to worker_name())
+        report_id: Only work on shards of this report
+        stop_event: Optional threading.Event; the worker stops once it is
+            set, after the shard in progress
+        exit_when_idle: Return as soon as no shard can be claimed instead of
+            polling every SHARD_POLL_SECONDS
+
+    Returns:
+        int: Number of shards uploaded
+    """
+    worker_id = worker_id or worker_name()
+    print(f"Shard worker {worker_id} started")
+    done = 0
+    while stop_event is None or not stop_event.is_set():
+        db = SessionLocal()
+        try:
+            shard_id = claim_shard(db, worker_id, report_id)
+        finally:
+            db.close()
+        if shard_id is None:
+            if exit_when_idle:
+                break
+            time.sleep(SHARD_POLL_SECONDS)
+            continue
+        done += run_shard(shard_id, worker_id)
+    return done
+
+def iter_distributed_results(report_id, store_ids, max_timestamp, db, calculator, cancel_event=None):
+    """
+    Coordinate a report computed by shard workers and yield its rows in store_id order.
+
+    The stores are published as shards of about SHARD_STORES to the
+    report_shard queue. Shards are merged in order as their rows are
+    uploaded; while the next one isn't, the coordinator claims and computes
+    a shard itself, so a report completes even without workers and every
+    worker added takes shards off it. A shard that failed SHARD_MAX_ATTEMPTS
+    times fails the report. Shards left when the report stops are cancelled
+    so workers drop them.
+
+    Args:
+        report_id: The report being generated
+        store_ids: Store IDs in report order
+        max_timestamp: The end of the reporting window
+        db: The database session of the coordinator
+        calculator: "scalar" or "vectorized", used by the workers
+        cancel_event: Optional threading.Event checked while waiting for shards
+
+    Raises:
+        RuntimeError: If a shard failed
+        ReportCancelled: If cancel_event was set
+    """
+    shard_count = publish_shards(db, report_id, store_ids, max_timestamp, calculator)
+    print(f"Published {len(store_ids)} stores as {shard_count} shards")
+    coordinator_id = f"{worker_name()}:coordinator"
+    report = db.query(Report).filter(Report.id == report_id).first()
+    fieldnames = report_fieldnames(parse_windows(report.windows))
+    try:
+        for shard_index in range(shard_count):
+            while True:
+                with timed('shard_wait'):
+                    shard = db.query(ReportShard).filter(
+                        ReportShard.report_id == report_id,
+                        ReportShard.shard_index == shard_index
+                    ).populate_existing().one()
+                if shard.status == "Complete":
+                    break
+                if shard.status == "Failed":
+                    raise RuntimeError(f"Shard {shard_index} of report {report_id} failed: {shard.error}")
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ReportCancelled(report_id)
+                claimed = claim_shard(db, coordinator_id, report_id)
+                if claimed is not None:
+                    run_shard(claimed, coordinator_id)
+                else:
+                    with timed('shard_wait'):
+                        time.sleep(SHARD_POLL_SECONDS)
+
+            rows = list(csv.DictReader(io.StringIO(shard.result), fieldnames=fieldnames))
+            # Merged rows aren't needed in the queue any more
+            shard.result = None
+            db.commit()
+            yield from rows
+    finally:
+        db.rollback()
+        db.query(ReportShard).filter(
+            ReportShard.report_id == report_id,
+            ReportShard.status.in_(["Queued", "Running"])
+        ).update({"status": "Cancelled", "lease_expires_at": None}, synchronize_session=False)
+        db.commit()
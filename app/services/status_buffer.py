@@ -0,0 +1,264 @@
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from app.core.config import (
+    INGEST_BUFFER_ROWS, INGEST_BACKPRESSURE_SECONDS, INGEST_BATCH_ROWS, INGEST_FLUSH_ATTEMPTS, INGEST_FLUSH_MS,
+    INGEST_ROLLUP_SECONDS
+)
+from app.services.ingest_service import append_status_records, refresh_changed_rollup
+from app.services.instrumentation import ingest_metrics
+
+STATUSES = ('active', 'inactive')
+
+class IngestBufferFull(Exception):
+    """Raised when observations can't be buffered within INGEST_BACKPRESSURE_SECONDS."""
+
+class IngestFailed(Exception):
+    """Raised to a post waiting for observations that were dropped because they couldn't be written."""
+
+def parse_observations(payload):
+    """
+    Validate posted status observations and convert them to insert parameters.
+
+    Args:
+        payload: Decoded JSON: one observation, a list of them, or an object
+            with an "observations" list. An observation has a store_id, a
+            timestamp_utc (ISO 8601, UTC unless it has an offset; a trailing
+            " UTC" as in store_status.csv is accepted) and a status of
+            "active" or "inactive".
+
+    Returns:
+        list: Dicts with store_id, naive UTC timestamp_utc and status
+
+    Raises:
+        ValueError: If the payload or any observation is invalid
+    """
+    if isinstance(payload, dict):
+        payload = payload['observations'] if 'observations' in payload else [payload]
+    if not isinstance(payload, list):
+        raise ValueError("Expected an observation, a list of observations or {\"observations\": [...]}")
+
+    records = []
+    for i, observation in enumerate(payload):
+        try:
+            store_id = observation['store_id']
+            status = observation['status']
+            timestamp = datetime.fromisoformat(observation['timestamp_utc'].removesuffix(' UTC'))
+        except (KeyError, TypeError, AttributeError, ValueError) as e:
+            raise ValueError(f"Invalid observation {i}: {e!r}")
+        if status not in STATUSES:
+            raise ValueError(f"Invalid observation {i}: status must be 'active' or 'inactive'")
+        if isinstance(store_id, bool) or not isinstance(store_id, (str, int)) or store_id == '':
+            raise ValueError(f"Invalid observation {i}: store_id must be a non-empty string")
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        records.append({'store_id': str(store_id), 'timestamp_utc': timestamp, 'status': status})
+    return records
+
+class StatusBuffer:
+    """
+    In-memory buffer of live status observations written in group commits.
+
+    Posted observations are appended to the buffer and a background thread
+    writes the oldest `batch_rows` of them in one transaction once that many
+    are waiting or the oldest has waited `flush_seconds`, so the write cost
+    is shared by many posts, and keeps writing batches until the buffer is
+    drained; a large post may be split across transactions. Observations being written still count against
+    `capacity`; when it would be exceeded, submit waits for a flush to make
+    room, and gives up after `backpressure_seconds`. A failed transaction is
+    retried with the same observations, while later posts keep buffering,
+    up to `flush_attempts` times; then its observations are dropped and
+    posts waiting for them get IngestFailed.
+    """
+
+    def __init__(self, capacity, batch_rows, flush_seconds, backpressure_seconds, rollup_seconds, flush_attempts=3):
+        self.capacity = capacity
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.backpressure_seconds = backpressure_seconds
+        self.rollup_seconds = rollup_seconds
+        self.flush_attempts = flush_attempts
+        self._condition = threading.Condition()
+        self._records = []
+        self._arrivals = deque()  # (observations, monotonic time accepted) per submit, in order
+        self._in_flight = 0
+        self._accepted = 0
+        self._committed = 0
+        self._dropped = 0
+        self._waiting = {}  # last sequence -> [first sequence, error or None] of each submit waiting for its commit
+        self._closed = False
+        self._thread = None
+        self._changes = {}  # store_id -> earliest new timestamp since the last rollup refresh
+        self._rollup_at = time.monotonic()
+
+    def submit(self, records, wait: bool = False):
+        """
+        Buffer observations for writing.
+
+        Args:
+            records: Insert parameters from parse_observations
+            wait: Return only once the observations are committed
+
+        Returns:
+            int: Number of observations accepted
+
+        Raises:
+            IngestBufferFull: If no room was made within backpressure_seconds
+            IngestFailed: If waiting and the observations were dropped after
+                failing to be written
+            ValueError: If there are more observations than the buffer holds
+        """
+        if len(records) > self.capacity:
+            raise ValueError(f"At most {self.capacity} observations can be posted at once")
+        if not records:
+            return 0
+        with self._condition:
+            if self._closed:
+                raise IngestBufferFull("Ingestion is shutting down")
+            self._start()
+            deadline = time.monotonic() + self.backpressure_seconds
+            while len(self._records) + self._in_flight + len(records) > self.capacity:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    ingest_metrics.reject(len(records))
+                    raise IngestBufferFull(
+                        f"Ingest buffer full ({len(self._records) + self._in_flight} of {self.capacity} observations)"
+                    )
+                self._condition.wait(remaining)
+            # An idle writer waits for the first observation; a batching one for a full batch
+            if not self._records or len(self._records) + len(records) >= self.batch_rows:
+                self._condition.notify_all()
+            self._records.extend(records)
+            self._arrivals.append((len(records), time.monotonic()))
+            self._accepted += len(records)
+            sequence = self._accepted
+            ingest_metrics.accept(len(records))
+            if wait:
+                self._waiting[sequence] = [sequence - len(records), None]
+                while self._committed + self._dropped < sequence:
+                    self._condition.wait()
+                _, error = self._waiting.pop(sequence)
+                if error is not None:
+                    raise IngestFailed(error)
+        return len(records)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'buffered': len(self._records) + self._in_flight,
+                'capacity': self.capacity,
+                'accepted': self._accepted,
+                'committed': self._committed,
+                'dropped': self._dropped,
+            }
+
+    def close(self, timeout: float = 30):
+        """Write everything buffered and stop the writer thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _start(self):
+        # The writer thread is started on first use so importing the module has no side effects
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="status-ingest", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        attempt = 0  # Attempts at writing records so far; they are retried without taking more from the buffer
+        while True:
+            if not attempt:
+                with self._condition:
+                    while not self._records and not self._closed:
+                        if self._changes and time.monotonic() - self._rollup_at >= self.rollup_seconds:
+                            break
+                        # Wake up for the rollup refresh of observations already written
+                        self._condition.wait(self.rollup_seconds if self._changes else None)
+                    if not self._records and not self._changes:
+                        return
+                    # Let a batch build up, unless the oldest observation is due
+                    while self._records and len(self._records) < self.batch_rows and not self._closed:
+                        remaining = self._arrivals[0][1] + self.flush_seconds - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    records = self._records[:self.batch_rows]
+                    del self._records[:self.batch_rows]
+                    arrivals = self._take_arrivals(len(records))
+                    self._in_flight = len(records)
+
+            started = time.perf_counter()
+            attempt += 1
+            try:
+                inserted = append_status_records(records, self._changes) if records else 0
+            except Exception as e:
+                ingest_metrics.flush_failed()
+                if attempt < self.flush_attempts:
+                    print(f"Error writing {len(records)} ingested observations (attempt {attempt}), retrying: {e}")
+                    print(traceback.format_exc())
+                    time.sleep(self.flush_seconds * attempt)
+                    continue
+                print(f"Error writing {len(records)} ingested observations, dropping them after {attempt} attempts: {e}")
+                print(traceback.format_exc())
+                ingest_metrics.drop(len(records))
+                with self._condition:
+                    first = self._committed + self._dropped
+                    for sequence, waiting in self._waiting.items():
+                        # Any of the submit's observations in the batch
+                        if waiting[0] < first + len(records) and sequence > first:
+                            waiting[1] = f"Observations could not be written and were dropped: {e}"
+                    self._in_flight = 0
+                    self._dropped += len(records)
+                    self._condition.notify_all()
+            else:
+                duration = time.perf_counter() - started
+                if records:
+                    now = time.monotonic()
+                    ingest_metrics.observe_flush(
+                        len(records), inserted, duration, [(count, now - at) for count, at in arrivals]
+                    )
+                with self._condition:
+                    self._in_flight = 0
+                    self._committed += len(records)
+                    self._condition.notify_all()
+            attempt = 0
+
+            if self._closed or time.monotonic() - self._rollup_at >= self.rollup_seconds:
+                self._refresh_rollup()
+            with self._condition:
+                if self._closed and not self._records:
+                    return
+
+    def _take_arrivals(self, count):
+        # The (observations, time accepted) of the oldest count observations, splitting a submit if needed
+        arrivals = []
+        while count:
+            observations, at = self._arrivals[0]
+            if observations <= count:
+                arrivals.append(self._arrivals.popleft())
+                count -= observations
+            else:
+                arrivals.append((count, at))
+                self._arrivals[0] = (observations - count, at)
+                count = 0
+        return arrivals
+
+    def _refresh_rollup(self):
+        # In its own transaction after the insert, so posts aren't held up by it
+        try:
+            refresh_changed_rollup(self._changes)
+            self._changes.clear()
+        except Exception as e:
+            print(f"Error refreshing the hourly rollup for ingested observations, retrying later: {e}")
+            print(traceback.format_exc())
+        self._rollup_at = time.monotonic()
+
+status_buffer = StatusBuffer(
+    INGEST_BUFFER_ROWS, INGEST_BATCH_ROWS, INGEST_FLUSH_MS / 1000, INGEST_BACKPRESSURE_SECONDS, INGEST_ROLLUP_SECONDS,
+    INGEST_FLUSH_ATTEMPTS
+)
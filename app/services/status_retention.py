@@ -0,0 +1,337 @@
+import threading
+import time
+import traceback
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import func, text, tuple_
+from sqlalchemy.orm import aliased
+from app.core.config import (
+    STATUS_RETENTION_DAYS, STATUS_RETENTION_MODE, STATUS_RETENTION_BATCH_ROWS, STATUS_RETENTION_INTERVAL_SECONDS,
+    STATUS_VACUUM_HOURS, MAINTAIN_STATUS_SNAPSHOT
+)
+from app.models.models import SessionLocal, StoreStatus, StoreStatusInterval, StoreUptimeHourly, engine
+from app.services.ingest_service import _ingest_lock
+from app.services.report_windows import STANDARD_WINDOWS
+from app.services.timezone_service import to_us
+from app.utils.helpers import store_range_filter
+
+RETENTION_MODES = ('compact', 'drop')
+
+# Poll ids per DELETE, below SQLite's bound parameter limit
+DELETE_CHUNK_SIZE = 500
+
+def retention_period(days=None):
+    """
+    How far before the newest observation store_status keeps polls.
+
+    Returns:
+        timedelta: The retention period, or None if everything is kept
+
+    Raises:
+        ValueError: If it is shorter than the longest standard report window
+    """
+    days = STATUS_RETENTION_DAYS if days is None else days
+    if not days:
+        return None
+    period = timedelta(days=days)
+    longest = max(window.length for window in STANDARD_WINDOWS)
+    if period < longest:
+        raise ValueError(f"Retention must keep at least the {longest.days} days every report covers")
+    return period
+
+def check_retained_windows(windows):
+    """
+    Reject windows of live reports and uptime queries that reach past retention.
+
+    Raises:
+        ValueError: If a window is longer than STATUS_RETENTION_DAYS
+    """
+    period = retention_period()
+    if period is None:
+        return
+    for window in windows:
+        if window.length > period:
+            raise ValueError(
+                f"Window {window.name!r} is longer than the {STATUS_RETENTION_DAYS:g} days of observations kept; "
+                f"older ones are only available to as_of reports"
+            )
+
+def compact_status(days=None, mode=None, batch_rows=None, stop=None):
+    """
+    Compact or drop store_status polls older than the retention horizon.
+
+    The horizon is the retention period before the newest timestamp_utc.
+    Older polls are read in (store_id, timestamp_utc) order, batch_rows at a
+    time, and each batch is deleted in its own transaction under the ingest
+    lock, so ingestion waits for one batch at most. In "compact" mode every
+    store's runs of polls with the same status are written to
+    store_status_interval first, extending the store's latest interval when
+    a run continues it. A store's newest poll is kept however old it is, so
+    stores that stopped reporting stay in reports. Hourly rollup buckets
+    before the horizon are deleted the same way, except for each store's
+    latest one, which the rollup resumes from.
+
+    Args:
+        days: Retention period in days (defaults to STATUS_RETENTION_DAYS)
+        mode: "compact" or "drop" (defaults to STATUS_RETENTION_MODE)
+        batch_rows: Rows deleted per transaction (defaults to STATUS_RETENTION_BATCH_ROWS)
+        stop: Optional threading.Event; the run ends after the current batch once set
+
+    Returns:
+        dict: The horizon, polls deleted, intervals written and extended,
+            rollup buckets deleted and elapsed seconds
+
+    Raises:
+        ValueError: If the period is too short or the mode unknown
+    """
+    started = time.perf_counter()
+    period = retention_period(days)
+    mode = mode or STATUS_RETENTION_MODE
+    batch_rows = batch_rows or STATUS_RETENTION_BATCH_ROWS
+    if mode not in RETENTION_MODES:
+        raise ValueError(f"Unknown retention mode {mode!r}, expected one of {', '.join(RETENTION_MODES)}")
+    summary = {'horizon': None, 'polls_deleted': 0, 'intervals_written': 0, 'intervals_extended': 0,
+               'buckets_deleted': 0}
+    if period is None:
+        return summary
+
+    db = SessionLocal()
+    try:
+        max_timestamp = db.query(func.max(StoreStatus.timestamp_utc)).scalar()
+        if max_timestamp is None:
+            return summary
+        horizon = max_timestamp - period
+        summary['horizon'] = horizon.isoformat()
+
+        status_columns = (StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.status, StoreStatus.id)
+        after = None
+        while stop is None or not stop.is_set():
+            with _ingest_lock:
+                rows = _batch_before(db, status_columns, horizon, after, batch_rows)
+                if not rows:
+                    break
+                after = tuple(rows[-1][:2])
+                newest = dict(db.query(StoreStatus.store_id, func.max(StoreStatus.timestamp_utc)).filter(
+                    *store_range_filter(StoreStatus.store_id, (rows[0].store_id, rows[-1].store_id))
+                ).group_by(StoreStatus.store_id))
+                rows = [row for row in rows if row.timestamp_utc != newest.get(row.store_id)]
+                if mode == 'compact':
+                    written, extended = _write_intervals(db, rows)
+                    summary['intervals_written'] += written
+                    summary['intervals_extended'] += extended
+                ids = [row.id for row in rows]
+                for i in range(0, len(ids), DELETE_CHUNK_SIZE):
+                    db.query(StoreStatus).filter(StoreStatus.id.in_(ids[i:i + DELETE_CHUNK_SIZE])).delete(
+                        synchronize_session=False
+                    )
+                db.commit()
+                summary['polls_deleted'] += len(rows)
+
+        # The rollup engine resumes from the bucket before the first one it recomputes, and
+        # from a store's latest bucket; without one it rebuilds the store from its first poll
+        later = aliased(StoreUptimeHourly)
+        bucket_columns = (StoreUptimeHourly.store_id, StoreUptimeHourly.hour_start)
+        cutoff = horizon.replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+        after = None
+        while stop is None or not stop.is_set():
+            with _ingest_lock:
+                keys = _batch_before(db, bucket_columns, cutoff, after, batch_rows)
+                if not keys:
+                    break
+                # Every bucket before the cutoff from the previous batch's last key to this one's
+                # that isn't its store's latest
+                query = db.query(StoreUptimeHourly).filter(
+                    StoreUptimeHourly.hour_start < cutoff, tuple_(*bucket_columns) <= tuple_(*keys[-1]),
+                    db.query(later).filter(
+                        later.store_id == StoreUptimeHourly.store_id, later.hour_start > StoreUptimeHourly.hour_start
+                    ).exists()
+                )
+                if after is not None:
+                    query = query.filter(tuple_(*bucket_columns) > tuple_(*after))
+                summary['buckets_deleted'] += query.delete(synchronize_session=False)
+                after = tuple(keys[-1])
+                db.commit()
+
+        if summary['polls_deleted']:
+            if MAINTAIN_STATUS_SNAPSHOT:
+                from app.services.status_snapshot import write_status_snapshot
+                write_status_snapshot(db)
+            # Deleted polls may still be held by the uptime index if it looks back further
+            from app.services.store_uptime_index import store_uptime_index
+            if store_uptime_index.lookback > period:
+                store_uptime_index.invalidate()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    summary['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+    print(f"Status retention ({mode}): {summary}")
+    return summary
+
+def _batch_before(db, columns, horizon, after, limit):
+    """The next rows of a (store_id, time) keyed table before the horizon, in key order after a key."""
+    store_column, time_column = columns[:2]
+    query = db.query(*columns).filter(time_column < horizon)
+    if after is not None:
+        query = query.filter(tuple_(store_column, time_column) > tuple_(*after))
+    return query.order_by(store_column, time_column).limit(limit).all()
+
+def _write_intervals(db, rows):
+    """
+    Write polls sorted by store and time as runs of equal status.
+
+    Returns:
+        tuple: Intervals inserted and existing intervals extended
+    """
+    runs = []
+    for row in rows:
+        last = runs[-1] if runs else None
+        if last is not None and last['store_id'] == row.store_id and last['status'] == row.status:
+            last['end_utc'] = row.timestamp_utc
+            last['observations'] += 1
+        else:
+            runs.append({'store_id': row.store_id, 'start_utc': row.timestamp_utc, 'end_utc': row.timestamp_utc,
+                         'status': row.status, 'observations': 1})
+    if not runs:
+        return 0, 0
+
+    # A store's first run continues its latest interval, e.g. one split by the previous batch
+    latest_ids = db.query(func.max(StoreStatusInterval.id)).filter(
+        *store_range_filter(StoreStatusInterval.store_id, (runs[0]['store_id'], runs[-1]['store_id']))
+    ).group_by(StoreStatusInterval.store_id)
+    latest = {interval.store_id: interval for interval in
+              db.query(StoreStatusInterval).filter(StoreStatusInterval.id.in_(latest_ids))}
+    inserts = []
+    extended = 0
+    previous_store = None
+    for run in runs:
+        interval = latest.get(run['store_id']) if run['store_id'] != previous_store else None
+        previous_store = run['store_id']
+        if interval is not None and interval.status == run['status'] and interval.end_utc < run['start_utc']:
+            interval.end_utc = run['end_utc']
+            interval.observations += run['observations']
+            extended += 1
+        else:
+            inserts.append(run)
+    if inserts:
+        db.execute(StoreStatusInterval.__table__.insert(), inserts)
+    db.flush()
+    return len(inserts), extended
+
+def compacted_first_seen(db, store_range=None):
+    """First compacted poll of every store with intervals, by store_id."""
+    return dict(db.query(StoreStatusInterval.store_id, func.min(StoreStatusInterval.start_utc)).filter(
+        *store_range_filter(StoreStatusInterval.store_id, store_range)
+    ).group_by(StoreStatusInterval.store_id))
+
+def load_compacted_polls(db, start, end, store_range=None):
+    """
+    Rebuild the compacted polls of a span for as-of reports.
+
+    An interval's first and last polls are exact and the polls between them
+    are spaced evenly, so figures computed from them are close to those of
+    the original polls but not always identical (business hours are checked
+    at the rebuilt instants).
+
+    Args:
+        db: The database session
+        start: Start of the span, naive UTC
+        end: End of the span, inclusive
+        store_range: Optional inclusive (first, last) store_id range
+
+    Returns:
+        dict: store_id -> sorted list of (UTC microseconds, active) inside the span
+    """
+    start_us, end_us = to_us(start), to_us(end)
+    polls = defaultdict(list)
+    intervals = db.query(
+        StoreStatusInterval.store_id, StoreStatusInterval.start_utc, StoreStatusInterval.end_utc,
+        StoreStatusInterval.status, StoreStatusInterval.observations
+    ).filter(
+        StoreStatusInterval.end_utc >= start,
+        StoreStatusInterval.start_utc <= end,
+        *store_range_filter(StoreStatusInterval.store_id, store_range)
+    ).order_by(StoreStatusInterval.store_id, StoreStatusInterval.start_utc)
+    for store_id, first, last, status, count in intervals:
+        first_us, last_us = to_us(first), to_us(last)
+        active = status == 'active'
+        steps = max(count - 1, 1)
+        polls[store_id].extend(
+            (t, active) for t in
+            (first_us + (last_us - first_us) * i // steps for i in range(count if last_us > first_us else 1))
+            if start_us <= t <= end_us
+        )
+    for store_polls in polls.values():
+        store_polls.sort()
+    return polls
+
+def maintain_database(vacuum=False):
+    """
+    Refresh the planner statistics, and optionally reclaim free space, after deletes.
+
+    VACUUM rewrites the whole database on SQLite and holds the ingest lock
+    while it does, so ingestion waits instead of timing out on the write lock.
+    """
+    with _ingest_lock:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            if vacuum:
+                connection.execute(text("VACUUM"))
+            connection.execute(text("ANALYZE"))
+
+class RetentionJob:
+    """
+    Runs status retention in a background thread.
+
+    compact_status runs every `interval_seconds`, followed by ANALYZE when
+    it deleted anything and by VACUUM once `vacuum_hours` passed since the
+    job started or last vacuumed.
+    """
+
+    def __init__(self, interval_seconds, vacuum_hours):
+        self.interval_seconds = interval_seconds
+        self.vacuum_hours = vacuum_hours
+        self._stop = threading.Event()
+        self._thread = None
+        self._vacuumed_at = time.monotonic()
+        self.last_run = None
+
+    def start(self):
+        """Start the job unless it is running; the first run is right away."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="status-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 30):
+        """Stop after the current batch of a run, if any."""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def run_once(self):
+        """Run retention and the database maintenance that is due; returns compact_status's summary."""
+        summary = compact_status(stop=self._stop)
+        vacuum = bool(self.vacuum_hours) and time.monotonic() - self._vacuumed_at >= self.vacuum_hours * 3600
+        if summary['polls_deleted'] or summary['buckets_deleted'] or vacuum:
+            started = time.perf_counter()
+            maintain_database(vacuum)
+            summary['maintenance_seconds'] = round(time.perf_counter() - started, 3)
+            summary['vacuumed'] = vacuum
+            if vacuum:
+                self._vacuumed_at = time.monotonic()
+        self.last_run = summary
+        return summary
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error running status retention: {e}")
+                print(traceback.format_exc())
+            self._stop.wait(self.interval_seconds)
+
+retention_job = RetentionJob(STATUS_RETENTION_INTERVAL_SECONDS, STATUS_VACUUM_HOURS)
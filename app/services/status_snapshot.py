@@ -0,0 +1,252 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import String, cast, func, select
+from app.core.config import BULK_FETCH_SIZE, STATUS_SNAPSHOT_DIR, SNAPSHOT_BATCH_STORES
+from app.models.models import StoreStatus
+from app.services.business_hours import business_hours_cache
+from app.services.instrumentation import timed
+from app.services.report_windows import STANDARD_WINDOWS
+from app.services.timezone_service import timezone_service, to_us
+from app.services.vectorized_calculator import compute_report_rows, load_store_columns, parse_timestamps
+
+# Names the snapshot version readers should open
+CURRENT_FILE = "CURRENT"
+META_FILE = "meta.json"
+
+# Snapshots are written by ingestion and by reports finding them stale
+_write_lock = threading.Lock()
+
+class StatusSnapshot:
+    """
+    A memory-mapped columnar copy of store_status.
+
+    Rows are sorted by (store_id, timestamp_utc, id). store_ids holds the
+    distinct stores in that order and the rows of store i are
+    offsets[i]:offsets[i + 1] of timestamps (int64 UTC microseconds since the
+    epoch) and of the active bitmap (one bit per row, packed eight to a byte).
+    Slicing a store reads only the pages of its rows; nothing is loaded up front.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.store_ids = self._column('store_ids')
+        self.offsets = self._column('offsets')
+        self.timestamps = self._column('timestamps')
+        self.active_bits = self._column('active')
+
+    def _column(self, name):
+        column = self.meta['columns'][name]
+        shape = tuple(column['shape'])
+        if not np.prod(shape):
+            # Empty files can't be mapped
+            return np.zeros(shape, dtype=column['dtype'])
+        return np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=column['dtype'], mode='r', shape=shape)
+
+    def is_current(self, db):
+        """Whether store_status still has the rows the snapshot was written from."""
+        rows, max_id, max_timestamp = db.query(
+            func.count(StoreStatus.id), func.max(StoreStatus.id), func.max(StoreStatus.timestamp_utc)
+        ).one()
+        return (rows, max_id, to_us(max_timestamp) if max_timestamp else None) == (
+            self.meta['rows'], self.meta['max_id'], self.meta['max_timestamp_us']
+        )
+
+    def codes(self, store_ids):
+        """Position of each store in the snapshot, or -1 for stores without rows."""
+        if not len(store_ids) or not len(self.store_ids):
+            return np.full(len(store_ids), -1, dtype=np.int64)
+        wanted = np.array(store_ids, dtype=str)
+        codes = np.minimum(np.searchsorted(self.store_ids, wanted), len(self.store_ids) - 1)
+        return np.where(self.store_ids[codes] == wanted, codes, -1)
+
+    def spans(self, codes, start_us, end_us):
+        """
+        Row ranges of stores' observations in [start_us, end_us].
+
+        Returns:
+            tuple: Arrays of first and past-the-end rows; empty for code -1
+        """
+        first = np.zeros(len(codes), dtype=np.int64)
+        last = np.zeros(len(codes), dtype=np.int64)
+        for i, code in enumerate(codes.tolist()):
+            if code < 0:
+                continue
+            lo, hi = int(self.offsets[code]), int(self.offsets[code + 1])
+            timestamps = self.timestamps[lo:hi]
+            first[i] = lo + np.searchsorted(timestamps, start_us, side='left')
+            last[i] = lo + np.searchsorted(timestamps, end_us, side='right')
+        return first, last
+
+    def active(self, rows):
+        """Active flags of an array of rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        return (self.active_bits[rows >> 3] >> (7 - (rows & 7))) & 1 == 1
+
+def write_status_snapshot(db, directory=STATUS_SNAPSHOT_DIR):
+    """
+    Write a new snapshot of store_status and make it current.
+
+    Rows are streamed in BULK_FETCH_SIZE partitions and appended to the
+    column files, so memory stays flat however large the table is. Each
+    snapshot goes to its own directory and CURRENT is switched to it
+    atomically, so reports keep reading the previous one until then.
+
+    Args:
+        db: The database session
+        directory: Directory holding the snapshot versions
+
+    Returns:
+        dict: The snapshot's metadata (row count, highest id, newest timestamp)
+    """
+    with _write_lock:
+        version = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(directory, version)
+        os.makedirs(path)
+        try:
+            meta = _write_columns(db, path)
+            with open(os.path.join(path, META_FILE), "w") as f:
+                json.dump(meta, f)
+            current = os.path.join(directory, f"{CURRENT_FILE}.{version}")
+            with open(current, "w") as f:
+                f.write(version)
+            os.replace(current, os.path.join(directory, CURRENT_FILE))
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+
+        # Readers that already mapped an older version keep their mappings
+        for name in os.listdir(directory):
+            if name < version and os.path.isdir(os.path.join(directory, name)):
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+        print(f"Wrote store_status snapshot {version} with {meta['rows']} rows")
+        return meta
+
+def _write_columns(db, path):
+    statement = select(
+        StoreStatus.id, StoreStatus.store_id, cast(StoreStatus.timestamp_utc, String), StoreStatus.status
+    ).order_by(StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.id)
+
+    store_ids = []
+    offsets = []
+    rows = 0
+    max_id = None
+    max_timestamp = None
+    carry = np.zeros(0, dtype=bool)
+    with open(os.path.join(path, "timestamps.bin"), "wb") as timestamps_file, \
+            open(os.path.join(path, "active.bin"), "wb") as active_file:
+        result = db.execute(statement.execution_options(stream_results=True))
+        for chunk in result.partitions(BULK_FETCH_SIZE):
+            frame = pd.DataFrame(chunk, columns=['id', 'store_id', 'timestamp_utc', 'status'])
+            timestamps = parse_timestamps(frame['timestamp_utc'])
+            timestamps_file.write(timestamps.tobytes())
+
+            # Pack whole bytes and carry the remaining bits into the next chunk
+            bits = np.concatenate([carry, frame['status'].values == 'active'])
+            whole = len(bits) // 8 * 8
+            active_file.write(np.packbits(bits[:whole]).tobytes())
+            carry = bits[whole:]
+
+            stores = frame['store_id'].values
+            starts = np.flatnonzero(np.r_[True, stores[1:] != stores[:-1]])
+            if store_ids and stores[0] == store_ids[-1]:
+                starts = starts[1:]
+            store_ids.extend(stores[starts].tolist())
+            offsets.extend((rows + starts).tolist())
+
+            rows += len(frame)
+            max_id = max(max_id or 0, int(frame['id'].max()))
+            max_timestamp = max(max_timestamp or 0, int(timestamps.max()))
+        active_file.write(np.packbits(carry).tobytes())
+    offsets.append(rows)
+
+    store_column = np.array(store_ids, dtype=f"<U{max((len(s) for s in store_ids), default=1)}")
+    store_column.tofile(os.path.join(path, "store_ids.bin"))
+    np.array(offsets, dtype=np.int64).tofile(os.path.join(path, "offsets.bin"))
+
+    return {
+        'rows': rows,
+        'max_id': max_id,
+        'max_timestamp_us': max_timestamp,
+        'columns': {
+            'store_ids': {'dtype': store_column.dtype.str, 'shape': [len(store_ids)]},
+            'offsets': {'dtype': '<i8', 'shape': [len(offsets)]},
+            'timestamps': {'dtype': '<i8', 'shape': [rows]},
+            'active': {'dtype': '|u1', 'shape': [(rows + 7) // 8]},
+        },
+    }
+
+def load_status_snapshot(directory=STATUS_SNAPSHOT_DIR):
+    """Map the current snapshot, or return None if none was written."""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return StatusSnapshot(os.path.join(directory, version))
+
+def open_status_snapshot(db, directory=STATUS_SNAPSHOT_DIR):
+    """Map the current snapshot, writing it first if it is missing or behind store_status."""
+    snapshot = load_status_snapshot(directory)
+    if snapshot is None or not snapshot.is_current(db):
+        print("Store status snapshot is missing or stale, rewriting it")
+        write_status_snapshot(db, directory)
+        snapshot = load_status_snapshot(directory)
+    return snapshot
+
+def iter_snapshot_results(store_ids, max_timestamp, db, calculator, default_timezone, windows=None):
+    """
+    Compute report rows from the store_status snapshot.
+
+    Stores are computed in batches of SNAPSHOT_BATCH_STORES: business hours
+    and timezones are queried per batch and observations are sliced out of
+    the mapped columns, so memory depends on the batch size rather than the
+    number of stores. Rows are the same as the bulk engine's.
+    """
+    from app.services.report_service import calculate_windows_us, rounded_row, empty_result, load_store_metadata
+
+    windows = windows or STANDARD_WINDOWS
+    window_start = max_timestamp - max(window.length for window in windows)
+    start_us, end_us = to_us(window_start), to_us(max_timestamp)
+    with timed('load'):
+        snapshot = open_status_snapshot(db)
+
+    for batch_start in range(0, len(store_ids), SNAPSHOT_BATCH_STORES):
+        batch = store_ids[batch_start:batch_start + SNAPSHOT_BATCH_STORES]
+        store_range = (min(batch), max(batch))
+        with timed('load'):
+            first, last = snapshot.spans(snapshot.codes(batch), start_us, end_us)
+
+        if calculator == 'vectorized':
+            with timed('load'):
+                columns = load_store_columns(batch, db, default_timezone, store_range)
+                counts = last - first
+                rows = np.repeat(first - np.r_[0, np.cumsum(counts)[:-1]], counts) + np.arange(counts.sum())
+                columns['codes'] = np.repeat(np.arange(len(batch), dtype=np.int64), counts)
+                columns['timestamps'] = np.asarray(snapshot.timestamps[rows], dtype=np.int64)
+                columns['active'] = snapshot.active(rows)
+            yield from compute_report_rows(batch, max_timestamp, columns, empty_result, windows)
+            continue
+
+        timezones, business_hours = load_store_metadata(db, store_range)
+        for store_id, lo, hi in zip(batch, first.tolist(), last.tolist()):
+            with timed('load'):
+                index = business_hours_cache.get_or_build(store_id, lambda: business_hours.get(store_id, []))
+                timestamps = snapshot.timestamps[lo:hi].tolist()
+                active = snapshot.active(np.arange(lo, hi)).tolist()
+            try:
+                tz = timezone_service.offsets(timezones.get(store_id, default_timezone), start_us, end_us)
+                values = calculate_windows_us(timestamps, active, max_timestamp, index, tz, windows)
+                row = rounded_row(store_id, windows, values)
+            except Exception as e:
+                print(f"Error computing uptime/downtime for store {store_id}: {e}")
+                row = empty_result(store_id, windows)
+            yield row
@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+import numpy as np
+from datetime import timedelta
+from sqlalchemy import String, cast, func, select
+from app.core.config import STORE_INDEX_LOOKBACK_DAYS, STORE_INDEX_REFRESH_SECONDS
+from app.models.models import StoreStatus, BusinessHours, StoreTimezone, IngestWatermark
+from app.services.business_hours import business_hours_cache
+from app.services.ingest_service import HOURS_FILE, TIMEZONE_FILE
+from app.services.report_service import (
+    DEFAULT_TIMEZONE, calculate_windows, calculate_windows_us, load_store_metadata
+)
+from app.services.timezone_service import EPOCH, MICROSECOND, timezone_service, to_us
+from app.services.vectorized_calculator import _read_frame, parse_timestamps
+
+_EMPTY = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool))
+
+class StoreUptimeIndex:
+    """
+    In-memory index answering uptime queries for a single store.
+
+    Holds every store's observations of the last `lookback` before the newest
+    timestamp in store_status, as sorted int64 UTC microsecond and active
+    flag arrays, together with the stores' timezones and business hours. It is
+    built on first use and then kept current incrementally: rows with ids past
+    the highest one seen are merged into their stores' arrays, and timezones
+    and business hours are reloaded when their tables or the ingest
+    watermarks of their CSV files change. Answers are
+    computed with calculate_windows_us, so they are the values of the
+    store's row in a CSV report of the same data.
+    """
+
+    def __init__(self, lookback: timedelta):
+        self.lookback = lookback
+        self._lock = threading.Lock()
+        self._observations = None  # store_id -> (timestamps, active); None until built
+        self._timezones = {}
+        self._business_hours = {}
+        self._metadata_version = None
+        self._max_id = 0
+        self._current_us = None
+        self._checked_at = None
+
+    def invalidate(self):
+        """Drop the index so the next query rebuilds it, e.g. after rows were deleted."""
+        with self._lock:
+            self._observations = None
+
+    @property
+    def is_built(self):
+        return self._observations is not None
+
+    def refresh(self, db, force: bool = False):
+        """
+        Bring the index up to date with the database.
+
+        Builds the index if needed. Otherwise the database is only checked if
+        STORE_INDEX_REFRESH_SECONDS passed since the last check, or if forced.
+
+        Returns:
+            int: Number of store_status rows loaded or merged
+        """
+        with self._lock:
+            return self._refresh(db, force)
+
+    def uptime(self, store_id, windows, db):
+        """
+        Compute a store's uptime and downtime over trailing windows.
+
+        Windows end at the newest timestamp in store_status, like a report's.
+        Windows longer than the index's lookback are computed from the
+        store's rows in the database.
+
+        Args:
+            store_id: The store
+            windows: ReportWindows, e.g. from select_windows
+            db: The database session, used to refresh the index
+
+        Returns:
+            dict: The current timestamp and uptime, downtime and unit per
+                window, rounded like report rows, or None if the store has
+                no observations at all
+        """
+        with self._lock:
+            self._refresh(db)
+            entry = self._observations.get(store_id)
+            current_us = self._current_us
+            timezone_str = self._timezones.get(store_id, DEFAULT_TIMEZONE)
+            hours = self._business_hours.get(store_id, [])
+        if entry is None:
+            return None
+
+        current_timestamp = EPOCH + current_us * MICROSECOND
+        longest = max(window.length for window in windows)
+        start_us = to_us(current_timestamp - longest)
+        index = business_hours_cache.get_or_build(store_id, lambda: hours)
+        try:
+            tz = timezone_service.offsets(timezone_str, start_us, current_us)
+            if longest > self.lookback:
+                status_data = db.query(StoreStatus.timestamp_utc, StoreStatus.status).filter(
+                    StoreStatus.store_id == store_id,
+                    StoreStatus.timestamp_utc >= current_timestamp - longest,
+                    StoreStatus.timestamp_utc <= current_timestamp
+                ).order_by(StoreStatus.timestamp_utc, StoreStatus.id).all()
+                values = calculate_windows(status_data, current_timestamp, index, tz, windows)
+            else:
+                timestamps, active = entry
+                first = int(np.searchsorted(timestamps, start_us, side='left'))
+                values = calculate_windows_us(
+                    timestamps[first:].tolist(), active[first:].tolist(), current_timestamp, index, tz, windows
+                )
+            values = [(round(up, 2), round(down, 2)) for up, down in values]
+        except Exception as e:
+            print(f"Error computing uptime/downtime for store {store_id}: {e}")
+            values = [(0, 0)] * len(windows)
+
+        return {
+            'store_id': store_id,
+            'current_timestamp': current_timestamp.isoformat(),
+            'windows': {
+                window.name: {
+                    'uptime': up,
+                    'downtime': down,
+                    'unit': 'minutes' if window.divisor == 1 else 'hours',
+                }
+                for window, (up, down) in zip(windows, values)
+            },
+        }
+
+    def _refresh(self, db, force=False):
+        checked = self._checked_at
+        if self._observations is not None and not force and checked is not None \
+                and time.monotonic() - checked < STORE_INDEX_REFRESH_SECONDS:
+            return 0
+
+        if self._observations is None:
+            rows = self._build(db)
+        else:
+            version = self._metadata_fingerprint(db)
+            if version != self._metadata_version:
+                self._load_metadata(db, version)
+            rows = self._merge_new_rows(db)
+        self._checked_at = time.monotonic()
+        return rows
+
+    def _build(self, db):
+        current = db.query(func.max(StoreStatus.timestamp_utc)).scalar()
+        max_id = db.query(func.max(StoreStatus.id)).scalar() or 0
+        store_ids = [row[0] for row in db.query(StoreStatus.store_id).distinct()]
+        self._load_metadata(db, self._metadata_fingerprint(db))
+
+        observations = {store_id: _EMPTY for store_id in store_ids}
+        self._current_us = to_us(current) if current is not None else 0
+        if current is not None:
+            frame = self._read_rows(db, StoreStatus.id <= max_id, StoreStatus.timestamp_utc >= current - self.lookback)
+            for store_id, timestamps, active in _groups(frame):
+                observations[store_id] = (timestamps.copy(), active.copy())
+
+        self._observations = observations
+        self._max_id = max_id
+        print(f"Built store uptime index of {len(observations)} stores")
+        return int(sum(len(timestamps) for timestamps, _ in observations.values()))
+
+    def _merge_new_rows(self, db):
+        max_id = db.query(func.max(StoreStatus.id)).scalar() or 0
+        if max_id < self._max_id:
+            # store_status was reloaded; ids start over
+            return self._build(db)
+        if max_id == self._max_id:
+            return 0
+
+        frame = self._read_rows(db, StoreStatus.id > self._max_id, StoreStatus.id <= max_id)
+        if len(frame):
+            self._current_us = max(self._current_us, int(frame['timestamp_us'].max()))
+        cutoff = self._current_us - self.lookback // MICROSECOND
+
+        for store_id, timestamps, active in _groups(frame):
+            old_timestamps, old_active = self._observations.get(store_id, _EMPTY)
+            timestamps = np.concatenate([old_timestamps, timestamps])
+            active = np.concatenate([old_active, active])
+            if len(old_timestamps) and timestamps[len(old_timestamps)] < old_timestamps[-1]:
+                # Late rows: a stable sort keeps earlier inserted rows first among equal timestamps
+                order = np.argsort(timestamps, kind='stable')
+                timestamps, active = timestamps[order], active[order]
+            first = int(np.searchsorted(timestamps, cutoff, side='left'))
+            self._observations[store_id] = (timestamps[first:], active[first:])
+
+        self._max_id = max_id
+        return len(frame)
+
+    def _read_rows(self, db, *conditions):
+        frame = _read_frame(db, select(
+            StoreStatus.store_id, cast(StoreStatus.timestamp_utc, String), StoreStatus.status
+        ).where(*conditions).order_by(
+            StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.id
+        ), ['store_id', 'timestamp_utc', 'status'])
+        frame['timestamp_us'] = parse_timestamps(frame['timestamp_utc']) if len(frame) else np.zeros(0, dtype=np.int64)
+        return frame
+
+    def _metadata_fingerprint(self, db):
+        # Replaced hours get new ids, but timezones are updated in place: ingesting a
+        # changed menu_hours.csv or timezones.csv also moves its watermark
+        watermarks = sorted(
+            (source, updated_at) for source, updated_at in db.query(IngestWatermark.source, IngestWatermark.updated_at)
+            if os.path.basename(source) in (HOURS_FILE, TIMEZONE_FILE)
+        )
+        return (
+            tuple(db.query(func.max(BusinessHours.id), func.count(BusinessHours.id)).one()),
+            tuple(db.query(func.max(StoreTimezone.id), func.count(StoreTimezone.id)).one()),
+            tuple(watermarks),
+        )
+
+    def _load_metadata(self, db, version):
+        self._timezones, self._business_hours = load_store_metadata(db)
+        if self._metadata_version is not None:
+            business_hours_cache.clear()
+        self._metadata_version = version
+
+def _groups(frame):
+    """Yield (store_id, timestamps, active) of each store in rows sorted by store."""
+    if not len(frame):
+        return
+    stores = frame['store_id'].values
+    timestamps = frame['timestamp_us'].values.astype(np.int64)
+    active = frame['status'].values == 'active'
+    bounds = np.r_[np.flatnonzero(np.r_[True, stores[1:] != stores[:-1]]), len(stores)]
+    for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        yield stores[lo], timestamps[lo:hi], active[lo:hi]
+
+store_uptime_index = StoreUptimeIndex(timedelta(days=STORE_INDEX_LOOKBACK_DAYS))
@@ -0,0 +1,147 @@
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+import pytz
+from app.core.config import TIMEZONE_CACHE_SIZE
+from app.services.business_hours import DAY_US, WEEK_US
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# 1970-01-01 was a Thursday; shifting by three days puts Monday at week offset 0
+MONDAY_SHIFT_US = 3 * DAY_US
+
+def to_us(value):
+    """Naive UTC datetime to microseconds since the epoch."""
+    return (value - EPOCH) // MICROSECOND
+
+class ZoneOffsets:
+    """
+    The UTC offset transition table of a timezone.
+
+    transitions[i] is the UTC instant (microseconds since the epoch) from which
+    offsets[i] applies. This is the table pytz bisects in astimezone(), so
+    lookups give the same local times, including across DST changes. A table
+    built for a window keeps only the transitions that apply inside it and is
+    only valid for instants in that window.
+    """
+
+    __slots__ = ('zone', 'transitions', 'offsets', '_transitions_array', '_offsets_array')
+
+    def __init__(self, zone, transitions, offsets):
+        self.zone = zone
+        self.transitions = transitions
+        self.offsets = offsets
+        self._transitions_array = np.array(transitions, dtype=np.int64)
+        self._offsets_array = np.array(offsets, dtype=np.int64)
+
+    def offset_at(self, utc_us):
+        """UTC offset in microseconds at one instant."""
+        if len(self.offsets) == 1:
+            return self.offsets[0]
+        return self.offsets[max(0, bisect_right(self.transitions, utc_us) - 1)]
+
+    def offsets_for(self, utc_us):
+        """UTC offsets in microseconds at an array of instants."""
+        if len(self.offsets) == 1:
+            return np.full(len(utc_us), self.offsets[0], dtype=np.int64)
+        i = np.searchsorted(self._transitions_array, utc_us, side='right') - 1
+        return self._offsets_array[np.maximum(i, 0)]
+
+    def local_us(self, utc_us):
+        """Local wall-clock microseconds since the epoch of an array of UTC instants."""
+        return utc_us + self.offsets_for(utc_us)
+
+    def week_positions(self, utc_us):
+        """Local microsecond of the week (Monday 00:00 is 0) of an array of UTC instants."""
+        return (self.local_us(utc_us) + MONDAY_SHIFT_US) % WEEK_US
+
+    def window(self, start_us, end_us):
+        """The part of the table that applies between two UTC instants."""
+        first = max(0, bisect_right(self.transitions, start_us) - 1)
+        last = max(first + 1, bisect_right(self.transitions, end_us))
+        return ZoneOffsets(self.zone, self.transitions[first:last], self.offsets[first:last])
+
+class TimezoneService:
+    """
+    Thread-safe cache of timezones and their UTC offset transition tables.
+
+    Reports only see a few dozen distinct zones, so every zone is loaded and
+    its table extracted once per process. Tables cut to a report window are
+    kept in an LRU cache bounded to max_windows entries.
+    """
+
+    def __init__(self, max_windows: int):
+        self.max_windows = max_windows
+        self._zones = {}
+        self._tables = {}
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def zone(self, name):
+        """
+        The pytz timezone for a name.
+
+        Raises:
+            pytz.UnknownTimeZoneError: If the name isn't a known timezone
+        """
+        zone = self._zones.get(name)
+        if zone is None:
+            zone = pytz.timezone(name)
+            with self._lock:
+                self._zones[name] = zone
+        return zone
+
+    def offsets(self, name, start_us=None, end_us=None):
+        """
+        The transition table of a timezone, optionally cut to a UTC window.
+
+        Args:
+            name: Timezone name
+            start_us: Optional start of the window in UTC microseconds
+            end_us: Optional end of the window in UTC microseconds
+
+        Raises:
+            pytz.UnknownTimeZoneError: If the name isn't a known timezone
+        """
+        table = self._tables.get(name)
+        if table is None:
+            table = _transition_table(self.zone(name))
+            with self._lock:
+                self._tables[name] = table
+        if start_us is None:
+            return table
+
+        key = (name, start_us, end_us)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None:
+                self._windows.move_to_end(key)
+                return window
+        window = table.window(start_us, end_us)
+        with self._lock:
+            self._windows[key] = window
+            while len(self._windows) > self.max_windows:
+                self._windows.popitem(last=False)
+        return window
+
+    def clear(self):
+        with self._lock:
+            self._zones.clear()
+            self._tables.clear()
+            self._windows.clear()
+
+def _transition_table(zone):
+    transitions = getattr(zone, '_utc_transition_times', None)
+    if transitions is None:
+        # Fixed-offset zones such as UTC have no transitions
+        return ZoneOffsets(zone, [0], [zone.utcoffset(EPOCH) // MICROSECOND])
+    return ZoneOffsets(
+        zone,
+        [to_us(instant) for instant in transitions],
+        [info[0] // MICROSECOND for info in zone._transition_info]
+    )
+
+timezone_service = TimezoneService(TIMEZONE_CACHE_SIZE)
@@ -0,0 +1,321 @@
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from sqlalchemy import String, cast, select
+from app.core.config import BULK_FETCH_SIZE
+from app.models.models import StoreStatus, BusinessHours, StoreTimezone
+from app.services.instrumentation import timed
+from app.services.report_windows import STANDARD_WINDOWS, report_row
+from app.services.timezone_service import timezone_service
+from app.utils.helpers import store_range_filter
+
+MINUTE_US = 60 * 1000 * 1000
+DAY_US = 24 * 60 * MINUTE_US
+
+def load_report_columns(store_ids, current_timestamp, db, default_timezone, store_range=None,
+                        lookback=timedelta(days=7)):
+    """
+    Load the reporting window as columnar arrays.
+
+    Args:
+        store_ids: Store IDs in report order; array codes index into this list
+        current_timestamp: The end of the reporting window
+        db: The database session
+        default_timezone: Timezone used for stores without a timezone record
+        store_range: Optional inclusive (first, last) store_id range to load
+        lookback: Length of the longest report window
+
+    Returns:
+        dict: Observation arrays (store code, int64 UTC microseconds, active flag)
+            sorted by store and timestamp, business hours arrays and the
+            timezone of every store
+    """
+    window_start = current_timestamp - lookback
+    categories = pd.Index(store_ids)
+    columns = load_store_columns(store_ids, db, default_timezone, store_range)
+
+    status = _read_frame(db, select(
+        StoreStatus.store_id, cast(StoreStatus.timestamp_utc, String), StoreStatus.status
+    ).where(
+        StoreStatus.timestamp_utc >= window_start,
+        StoreStatus.timestamp_utc <= current_timestamp,
+        *store_range_filter(StoreStatus.store_id, store_range)
+    ).order_by(StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.id), ['store_id', 'timestamp_utc', 'status'])
+
+    codes = categories.get_indexer(status['store_id']).astype(np.int64)
+    timestamps = parse_timestamps(status['timestamp_utc'])
+
+    # Keep report order so groups come out in the same order as store_ids
+    order = np.lexsort((timestamps, codes))
+
+    columns.update({
+        'codes': codes[order],
+        'timestamps': timestamps[order],
+        'active': (status['status'].values == 'active')[order],
+    })
+    return columns
+
+def load_store_columns(store_ids, db, default_timezone, store_range=None):
+    """
+    Load the business hours and timezones of stores as columnar arrays.
+
+    Args:
+        store_ids: Store IDs in report order; hours_codes index into this list
+        db: The database session
+        default_timezone: Timezone used for stores without a timezone record
+        store_range: Optional inclusive (first, last) store_id range to load;
+            stores in it but not in store_ids are left out
+
+    Returns:
+        dict: Business hours arrays and the timezone of every store
+    """
+    categories = pd.Index(store_ids)
+
+    timezones = dict(db.execute(select(StoreTimezone.store_id, StoreTimezone.timezone_str).where(
+        *store_range_filter(StoreTimezone.store_id, store_range)
+    )).all())
+    store_timezones = np.array([timezones.get(store_id, default_timezone) for store_id in store_ids], dtype=object)
+
+    hours = _read_frame(db, select(
+        BusinessHours.store_id, BusinessHours.day_of_week,
+        BusinessHours.start_time_local, BusinessHours.end_time_local
+    ).where(
+        *store_range_filter(BusinessHours.store_id, store_range)
+    ).order_by(BusinessHours.store_id, BusinessHours.id), ['store_id', 'day_of_week', 'start', 'end'])
+    hours_codes = categories.get_indexer(hours['store_id'])
+    hours = hours[hours_codes >= 0]
+
+    return {
+        'hours_codes': hours_codes[hours_codes >= 0].astype(np.int64),
+        'hours_day': hours['day_of_week'].values.astype(np.int64),
+        'hours_start': _time_to_us(hours['start']),
+        'hours_end': _time_to_us(hours['end']),
+        'timezones': store_timezones,
+    }
+
+def parse_timestamps(values):
+    """Convert timestamps read as strings to int64 UTC microseconds since the epoch."""
+    return pd.to_datetime(values).values.astype('datetime64[us]').astype(np.int64)
+
+def compute_report_rows(store_ids, current_timestamp, columns, empty_result, windows=None):
+    """
+    Compute every store's report row with grouped array operations.
+
+    Mirrors calculate_uptime_downtime: observations outside business hours are
+    skipped, the first observation is extrapolated back to the window start and
+    the last one forward to the window end, and windows without business time
+    report zeros. Values are integers where the scalar calculator returns ints so
+    the CSV output is formatted the same way.
+
+    Args:
+        store_ids: Store IDs in report order
+        current_timestamp: The end of the reporting window
+        columns: Arrays returned by load_report_columns
+        empty_result: Builder for the row of a store that could not be computed
+        windows: Report windows (defaults to STANDARD_WINDOWS)
+
+    Returns:
+        list: Report rows in store_ids order
+    """
+    windows = windows or STANDARD_WINDOWS
+    n_stores = len(store_ids)
+    end_us = _datetime_to_us(current_timestamp)
+
+    with timed('timezone'):
+        local_timestamps, invalid_zone = _localize(columns['codes'], columns['timestamps'], columns['timezones'])
+    with timed('interpolation'):
+        valid = _within_business_hours(columns, local_timestamps, n_stores)
+    is_24x7 = np.bincount(columns['hours_codes'], minlength=n_stores) == 0
+
+    values = []
+    for window in windows:
+        start_us = end_us - int(window.length / timedelta(microseconds=1))
+        with timed('business_minutes'):
+            total = _business_minutes(columns, start_us, end_us, is_24x7, n_stores)
+        with timed('interpolation'):
+            uptime, touched = _uptime(columns, valid, start_us, end_us, total, n_stores)
+        values.append((total, uptime, touched, window.divisor))
+
+    rows = []
+    for code, store_id in enumerate(store_ids):
+        if invalid_zone[code]:
+            rows.append(empty_result(store_id, windows))
+            continue
+
+        row = []
+        for total, uptime, touched, divisor in values:
+            if total[code] == 0:
+                row.append((0, 0))
+                continue
+            total_minutes = float(total[code]) / MINUTE_US
+            uptime_minutes = float(uptime[code]) / MINUTE_US if touched[code] else 0
+            up = uptime_minutes / divisor if divisor != 1 else uptime_minutes
+            down = (total_minutes - uptime_minutes) / divisor
+            row.append((round(up, 2), round(down, 2)))
+
+        rows.append(report_row(store_id, windows, row))
+    return rows
+
+def _read_frame(db, statement, columns):
+    """Stream a statement into a DataFrame in BULK_FETCH_SIZE partitions."""
+    result = db.execute(statement.execution_options(stream_results=True))
+    frames = [pd.DataFrame(chunk, columns=columns) for chunk in result.partitions(BULK_FETCH_SIZE)]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+def _time_to_us(times):
+    """Convert a sequence of datetime.time values to microseconds since midnight."""
+    return np.array([
+        ((t.hour * 60 + t.minute) * 60 + t.second) * 1000000 + t.microsecond for t in times
+    ], dtype=np.int64)
+
+def _datetime_to_us(value):
+    return int(np.datetime64(value, 'us').astype(np.int64))
+
+def _utc_offset_us(zone, utc_us):
+    """UTC offset of a timezone at one instant, in microseconds."""
+    return timezone_service.offsets(zone).offset_at(utc_us)
+
+def _localize(codes, timestamps, timezones):
+    """Convert UTC observation timestamps to local wall-clock microseconds with each zone's transition table."""
+    local = np.empty_like(timestamps)
+    invalid_zone = np.zeros(len(timezones), dtype=bool)
+    obs_zones = timezones[codes] if len(codes) else np.array([], dtype=object)
+
+    for zone in pd.unique(timezones):
+        try:
+            offsets = timezone_service.offsets(zone)
+        except Exception as e:
+            print(f"Error computing uptime/downtime for stores in timezone {zone}: {e}")
+            invalid_zone[timezones == zone] = True
+            continue
+        mask = obs_zones == zone
+        if not mask.any():
+            continue
+        local[mask] = offsets.local_us(timestamps[mask])
+
+    return local, invalid_zone
+
+def _within_business_hours(columns, local_timestamps, n_stores):
+    """Flag observations that is_within_business_hours would accept."""
+    codes = columns['codes']
+    if len(codes) == 0:
+        return np.zeros(0, dtype=bool)
+
+    days = np.floor_divide(local_timestamps, DAY_US)
+    weekday = (days + 3) % 7  # 1970-01-01 was a Thursday
+    time_of_day = local_timestamps - days * DAY_US
+
+    # Group business hours by (store, weekday) so each observation only checks its own day
+    hours_key = columns['hours_codes'] * 7 + columns['hours_day']
+    order = np.argsort(hours_key, kind='stable')
+    hours_key = hours_key[order]
+    starts = columns['hours_start'][order]
+    ends = columns['hours_end'][order]
+    overnight = ends < starts
+
+    obs_key = codes * 7 + weekday
+    first = np.searchsorted(hours_key, obs_key, side='left')
+    count = np.searchsorted(hours_key, obs_key, side='right') - first
+
+    valid = np.bincount(columns['hours_codes'], minlength=n_stores)[codes] == 0
+    for offset in range(int(count.max()) if len(count) else 0):
+        candidate = count > offset
+        idx = first[candidate] + offset
+        tod = time_of_day[candidate]
+        hit = (starts[idx] <= tod) & (overnight[idx] | (tod <= ends[idx]))
+        valid[np.flatnonzero(candidate)[hit]] = True
+    return valid
+
+def _business_minutes(columns, start_us, end_us, is_24x7, n_stores):
+    """Business time of every store in [start_us, end_us], in microseconds."""
+    total = np.zeros(n_stores, dtype=np.int64)
+    total[is_24x7] = end_us - start_us
+
+    codes = columns['hours_codes']
+    if len(codes) == 0:
+        return total
+
+    # calculate_business_minutes builds every day's hours with the UTC offset in
+    # effect at the window start, and walks local dates from start to end
+    zones = columns['timezones'][codes]
+    start_offset = np.zeros(len(codes), dtype=np.int64)
+    end_offset = np.zeros(len(codes), dtype=np.int64)
+    for zone in pd.unique(zones):
+        try:
+            mask = zones == zone
+            start_offset[mask] = _utc_offset_us(zone, start_us)
+            end_offset[mask] = _utc_offset_us(zone, end_us)
+        except Exception:
+            continue
+
+    first_day = np.floor_divide(start_us + start_offset, DAY_US)
+    last_day = np.floor_divide(end_us + end_offset, DAY_US)
+    starts = columns['hours_start']
+    ends = np.where(columns['hours_end'] < starts, columns['hours_end'] + DAY_US, columns['hours_end'])
+
+    for day_offset in range(int((last_day - first_day).max()) + 1):
+        day = first_day + day_offset
+        applies = (day <= last_day) & ((day + 3) % 7 == columns['hours_day'])
+        midnight = day * DAY_US - start_offset
+        overlap = np.minimum(end_us, midnight + ends) - np.maximum(start_us, midnight + starts)
+        overlap = np.where(applies & (overlap > 0), overlap, 0)
+        total += np.bincount(codes, weights=overlap, minlength=n_stores).astype(np.int64)
+    return total
+
+def _uptime(columns, valid, start_us, end_us, total, n_stores):
+    """
+    Interpolated uptime of every store in [start_us, end_us], in microseconds.
+
+    Returns:
+        tuple: Uptime per store and whether any uptime was accumulated, which is
+            what decides between an int and a float in the scalar calculator
+    """
+    in_window = columns['timestamps'] >= start_us
+    codes = columns['codes'][in_window]
+    timestamps = columns['timestamps'][in_window]
+    active = columns['active'][in_window]
+    valid = valid[in_window]
+
+    uptime = np.zeros(n_stores, dtype=np.int64)
+    touched = np.zeros(n_stores, dtype=bool)
+    if len(codes) == 0:
+        return uptime, touched
+
+    counts = np.bincount(codes, minlength=n_stores)
+    group_start = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    group_end = np.r_[group_start[1:], len(codes)] - 1
+    group_codes = codes[group_start]
+    group_total = total[group_codes]
+
+    # A single observation is extrapolated over the whole window
+    single = counts[group_codes] == 1
+    single_active = single & active[group_start]
+    uptime[group_codes[single_active]] = group_total[single_active]
+    touched[group_codes[single_active]] = True
+
+    multi = ~single
+
+    # First observation in business hours extrapolated back to the window start
+    head = multi & valid[group_start] & active[group_start]
+    head_minutes = np.minimum(timestamps[group_start] - start_us, group_total)
+    uptime[group_codes[head]] += head_minutes[head]
+    touched[group_codes[head]] = True
+
+    # Consecutive observations in business hours, counted when the earlier one was active
+    kept = np.flatnonzero(valid)
+    same_store = codes[kept[1:]] == codes[kept[:-1]]
+    counted = same_store & active[kept[:-1]]
+    gaps = timestamps[kept[1:]] - timestamps[kept[:-1]]
+    counted_codes = codes[kept[1:]][counted]
+    uptime += np.bincount(counted_codes, weights=gaps[counted], minlength=n_stores).astype(np.int64)
+    touched[counted_codes] = True
+
+    # Last observation in business hours extrapolated forward to the window end
+    tail = multi & valid[group_end] & active[group_end]
+    tail_minutes = np.minimum(end_us - timestamps[group_end], group_total - uptime[group_codes])
+    uptime[group_codes[tail]] += tail_minutes[tail]
+    touched[group_codes[tail]] = True
+
+    return uptime, touched
@@ -0,0 +1,156 @@
+"""
+Load test /get_report polling while a report is being generated.
+
+Starts the API with uvicorn in the dataset directory, then polls the status
+of a report from concurrent clients twice: while nothing runs (the report is
+cancelled right away) and while a report is generating. Throughput and
+latency percentiles of both phases are printed; with database work kept off
+the event loop they should stay close.
+
+Usage:
+    python -m benchmarks.api_load [--data-dir .] [--clients 16] [--seconds 10]
+        [--port 8765]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def start_server(data_dir, port):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", REPO_ROOT, "--port", str(port),
+         "--log-level", "warning"],
+        cwd=data_dir, env=env, stdout=subprocess.DEVNULL
+    )
+    deadline = time.time() + 600
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The API server exited during startup")
+        try:
+            request(port, "GET", "/")
+            return server
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("The API server didn't start")
+
+def request(port, method, path, connection=None):
+    own = connection is None
+    connection = connection or http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        connection.request(method, path)
+        response = connection.getresponse()
+        body = response.read()
+        return response.status, json.loads(body) if body else None
+    finally:
+        if own:
+            connection.close()
+
+def trigger(port):
+    # A window nobody asked for yet makes the report new rather than reused
+    status, body = request(port, "GET", f"/trigger_report?windows={random.randint(2, 59)}m,{random.randint(2, 89)}d")
+    if status != 200:
+        raise RuntimeError(f"trigger_report returned {status}: {body}")
+    return body['report_id']
+
+def poll(port, report_id, clients, seconds, expected_status):
+    """Poll a report's status from concurrent clients; latencies of responses with the expected status."""
+    latencies = []
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+    finished = threading.Event()
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        mine = []
+        try:
+            while time.perf_counter() < stop and not finished.is_set():
+                started = time.perf_counter()
+                status, body = request(port, "GET", f"/get_report?report_id={report_id}", connection)
+                elapsed = time.perf_counter() - started
+                if status != 200 or body.get('status') != expected_status:
+                    finished.set()
+                    break
+                mine.append(elapsed)
+        finally:
+            connection.close()
+            with lock:
+                latencies.extend(mine)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started
+
+def summarize(name, latencies, seconds):
+    if not latencies:
+        print(f"{name:<12} no responses")
+        return None
+    latencies = sorted(latencies)
+    ms = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    result = {
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / seconds, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+        'p50_ms': round(ms(0.50), 2),
+        'p95_ms': round(ms(0.95), 2),
+        'p99_ms': round(ms(0.99), 2),
+        'max_ms': round(latencies[-1] * 1000, 2),
+    }
+    print(f"{name:<12} {result['requests']:>7} {result['requests_per_second']:>9} "
+          f"{result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} {result['max_ms']:>8}")
+    return result
+
+def run(args):
+    server = start_server(args.data_dir, args.port)
+    try:
+        # Idle: a cancelled report's status is read the same way as a running one's
+        idle_id = trigger(args.port)
+        request(args.port, "POST", f"/cancel_report?report_id={idle_id}")
+        while request(args.port, "GET", f"/get_report?report_id={idle_id}")[1].get('status') != "Cancelled":
+            time.sleep(0.2)
+        idle, idle_seconds = poll(args.port, idle_id, args.clients, args.seconds, "Cancelled")
+
+        # Busy: poll while the report generates, until it finishes or time runs out
+        busy_id = trigger(args.port)
+        while request(args.port, "GET", f"/get_report?report_id={busy_id}")[1].get('status') == "Queued":
+            time.sleep(0.05)
+        busy, busy_seconds = poll(args.port, busy_id, args.clients, args.seconds, "Running")
+
+        print(f"{'phase':<12} {'requests':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        results = {
+            'clients': args.clients,
+            'idle': summarize("idle", idle, idle_seconds),
+            'generating': summarize("generating", busy, busy_seconds),
+        }
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data-dir", default=".", help="Directory with the CSV files and app/ database")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent polling clients")
+    parser.add_argument("--seconds", type=float, default=10, help="Longest time to poll per phase")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Write the results as JSON")
+    run(parser.parse_args())
+
+if __name__ == "__main__":
+    main()
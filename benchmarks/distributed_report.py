@@ -0,0 +1,97 @@
+"""
+Measure distributed report generation against the single-process bulk engine.
+
+Runs generate_report on the configured database once with the bulk engine and
+once per worker count with the distributed engine, with that many worker.py
+processes started in the current directory. Checks that every run writes the
+same CSV and prints wall time and speedup. With --kill, the first worker is
+killed as soon as it holds a shard, which must then be taken over once its
+lease (SHARD_LEASE_SECONDS) expires.
+
+Usage:
+    python -m benchmarks.distributed_report [--workers 0,1,2,4] [--calculator scalar] [--kill]
+"""
+import argparse
+import filecmp
+import os
+import subprocess
+import sys
+import threading
+import time
+from app.models.models import Base, engine, SessionLocal, ReportShard, add_missing_columns
+from app.services.report_service import report_output_path
+from benchmarks.parallel_report import run
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def start_workers(count):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    return [
+        subprocess.Popen(
+            [sys.executable, os.path.join(REPO_ROOT, "worker.py"), "--worker-id", f"bench-worker-{i}"],
+            env=env, stdout=subprocess.DEVNULL
+        )
+        for i in range(count)
+    ]
+
+def kill_when_claimed(worker, worker_id, stop):
+    """Kill a worker process once it holds a shard's lease."""
+    db = SessionLocal()
+    try:
+        while not stop.is_set():
+            held = db.query(ReportShard.id).filter(
+                ReportShard.worker_id == worker_id, ReportShard.status == "Running"
+            ).first()
+            db.rollback()
+            if held:
+                worker.kill()
+                print(f"Killed {worker_id} holding shard {held[0]}")
+                return
+            time.sleep(0.05)
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="0,1,2,4", help="comma-separated worker process counts to try")
+    parser.add_argument("--calculator", default="scalar", choices=["scalar", "vectorized"])
+    parser.add_argument("--kill", action="store_true", help="kill the first worker while it holds a shard")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+
+    baseline_id = "bench-distributed-bulk"
+    baseline = run(baseline_id, mode="bulk", calculator=args.calculator)
+    results = [("bulk", 0, baseline)]
+
+    for workers in [int(w) for w in args.workers.split(",")]:
+        report_id = f"bench-distributed-{workers}"
+        processes = start_workers(workers)
+        stop = threading.Event()
+        killer = None
+        if args.kill and processes:
+            killer = threading.Thread(target=kill_when_claimed, args=(processes[0], "bench-worker-0", stop))
+            killer.start()
+        try:
+            elapsed = run(report_id, mode="distributed", calculator=args.calculator)
+        finally:
+            stop.set()
+            if killer:
+                killer.join()
+            for process in processes:
+                process.terminate()
+                process.wait()
+        if not filecmp.cmp(report_output_path(baseline_id), report_output_path(report_id), shallow=False):
+            raise RuntimeError(f"Distributed report with {workers} workers differs from the bulk report")
+        results.append(("distributed", workers, elapsed))
+        os.remove(report_output_path(report_id))
+    os.remove(report_output_path(baseline_id))
+
+    # The coordinator computes shards too, so 0 workers is one process
+    print(f"\n{'engine':<12}{'workers':>8}{'seconds':>10}{'speedup':>10}")
+    for mode, workers, elapsed in results:
+        print(f"{mode:<12}{workers:>8}{elapsed:>10.2f}{baseline / elapsed:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Load test live ingestion through /ingest_status.
+
+Starts the API with uvicorn in the dataset directory, then posts batches of
+synthetic observations from concurrent clients for a while, as new polls of
+the dataset's stores just after its newest one. Meanwhile one client
+keeps reading a report's status, to show reads aren't held up by the writes.
+Prints observations per second, post and read latency percentiles, and the
+server's ingest metrics; read latency is also measured before the load for
+comparison.
+
+Usage:
+    python -m benchmarks.ingest_load [--data-dir .] [--clients 4] [--batch 2000]
+        [--seconds 10] [--port 8766]
+"""
+import argparse
+import csv
+import http.client
+import itertools
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+from benchmarks.api_load import request, start_server, trigger
+
+def post(connection, path, body):
+    connection.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+def percentiles(latencies):
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    ms = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2)
+    return {'count': len(latencies), 'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+            'p50_ms': ms(0.50), 'p99_ms': ms(0.99), 'max_ms': round(latencies[-1] * 1000, 2)}
+
+def read_latencies(port, report_id, stop, seconds=None):
+    """Poll a report's status until stopped (or for a number of seconds); latencies in seconds."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    latencies = []
+    deadline = time.perf_counter() + seconds if seconds else None
+    try:
+        while not stop.is_set() and (deadline is None or time.perf_counter() < deadline):
+            started = time.perf_counter()
+            request(port, "GET", f"/get_report?report_id={report_id}", connection)
+            latencies.append(time.perf_counter() - started)
+    finally:
+        connection.close()
+    return latencies
+
+def ingest_metrics(port):
+    """The server's ingest_* metrics, without histogram buckets."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        connection.request("GET", "/metrics")
+        lines = connection.getresponse().read().decode().splitlines()
+    finally:
+        connection.close()
+    return {
+        line.split()[0]: float(line.split()[1])
+        for line in lines if line.startswith("ingest_") and "_bucket" not in line
+    }
+
+def scan_status(data_dir):
+    """Store ids and the newest poll in the dataset's store_status.csv."""
+    stores, newest = set(), ""
+    with open(os.path.join(data_dir, "store_status.csv")) as f:
+        for row in csv.DictReader(f):
+            stores.add(row['store_id'])
+            newest = max(newest, row['timestamp_utc'])
+    return sorted(stores), datetime.fromisoformat(newest.removesuffix(" UTC"))
+
+def run(args):
+    stores, newest = scan_status(args.data_dir)
+    # Polls within the hour after the newest one, a microsecond apart so none collide; far
+    # later polls would make the hourly rollup fill every hour in between
+    base = newest + timedelta(seconds=random.randint(60, 3600))
+    server = start_server(args.data_dir, args.port)
+    try:
+        # A cancelled report's status is read the same way as a running one's
+        report_id = trigger(args.port)
+        request(args.port, "POST", f"/cancel_report?report_id={report_id}")
+        while request(args.port, "GET", f"/get_report?report_id={report_id}")[1].get('status') != "Cancelled":
+            time.sleep(0.2)
+        idle_reads = read_latencies(args.port, report_id, threading.Event(), seconds=3)
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        posts, rejected, sent = [], [0], [0]
+
+        def client(index):
+            connection = http.client.HTTPConnection("127.0.0.1", args.port, timeout=60)
+            counter = itertools.count()
+            mine = []
+            try:
+                while not stop.is_set():
+                    observations = []
+                    for _ in range(args.batch):
+                        n = next(counter)
+                        timestamp = base + timedelta(microseconds=n * args.clients + index)
+                        observations.append({
+                            "store_id": stores[n % len(stores)],
+                            "timestamp_utc": f"{timestamp.isoformat(sep=' ')} UTC",
+                            "status": "active" if n % 5 else "inactive",
+                        })
+                    body = json.dumps(observations)
+                    started = time.perf_counter()
+                    status, _ = post(connection, "/ingest_status", body)
+                    mine.append(time.perf_counter() - started)
+                    with lock:
+                        if status == 200:
+                            sent[0] += len(observations)
+                        else:
+                            rejected[0] += len(observations)
+            finally:
+                connection.close()
+                with lock:
+                    posts.extend(mine)
+
+        reads = []
+        reader = threading.Thread(target=lambda: reads.extend(read_latencies(args.port, report_id, stop)))
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+        started = time.perf_counter()
+        reader.start()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads + [reader]:
+            thread.join()
+        posting = time.perf_counter() - started
+        # Accepted observations not yet committed are still in the buffer
+        deadline = time.perf_counter() + 120
+        while (metrics := ingest_metrics(args.port)).get('ingest_buffer_rows') and time.perf_counter() < deadline:
+            time.sleep(0.1)
+        elapsed = time.perf_counter() - started
+
+        results = {
+            'clients': args.clients,
+            'batch': args.batch,
+            'observations_accepted': sent[0],
+            'observations_rejected': rejected[0],
+            'observations_per_second': round(sent[0] / posting, 1),
+            'committed_per_second': round(sent[0] / elapsed, 1),
+            'post_latency': percentiles(posts),
+            'read_latency_idle': percentiles(idle_reads),
+            'read_latency_during_ingest': percentiles(reads),
+            'rows_inserted': metrics.get('ingest_rows_inserted_total'),
+            'commit_latency_mean_ms': round(
+                1000 * metrics['ingest_latency_seconds_sum'] / metrics['ingest_latency_seconds_count'], 2
+            ) if metrics.get('ingest_latency_seconds_count') else None,
+            'flushes': metrics.get('ingest_flush_duration_seconds_count'),
+        }
+        print(json.dumps(results, indent=2))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data-dir", default=".", help="Directory with the CSV files and app/ database")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent posting clients")
+    parser.add_argument("--batch", type=int, default=2000, help="Observations per post")
+    parser.add_argument("--seconds", type=float, default=10, help="How long to post")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="Write the results as JSON")
+    run(parser.parse_args())
+
+if __name__ == "__main__":
+    main()
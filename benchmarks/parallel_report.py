@@ -0,0 +1,61 @@
+"""
+Measure parallel report generation against the single-process bulk engine.
+
+Runs generate_report on the configured database once with the bulk engine and
+once per worker count with the parallel engine, checks that every run writes
+the same CSV and prints wall time and speedup.
+
+Usage:
+    python -m benchmarks.parallel_report [--workers 1,2,4,8] [--calculator scalar]
+"""
+import argparse
+import filecmp
+import os
+import time
+from app.models.models import Base, engine, SessionLocal, Report
+from app.services.report_service import generate_report, report_output_path
+
+def run(report_id, **options):
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        generate_report(report_id, db, **options)
+        elapsed = time.perf_counter() - started
+        report = db.query(Report).filter(Report.id == report_id).first()
+        if report.status != "Complete":
+            raise RuntimeError(f"Report {report_id} finished with status {report.status}")
+        return elapsed
+    finally:
+        db.close()
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    default_workers = sorted({1, 2, 4, 8, cpu_count} & set(range(1, cpu_count + 1)))
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default=",".join(str(w) for w in default_workers),
+                        help="comma-separated worker counts to try")
+    parser.add_argument("--calculator", default="scalar", choices=["scalar", "vectorized"])
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+
+    baseline_id = "bench-parallel-bulk"
+    baseline = run(baseline_id, mode="bulk", calculator=args.calculator)
+    results = [("bulk", 1, baseline)]
+
+    for workers in [int(w) for w in args.workers.split(",")]:
+        report_id = f"bench-parallel-{workers}"
+        elapsed = run(report_id, mode="parallel", calculator=args.calculator, workers=workers)
+        if not filecmp.cmp(report_output_path(baseline_id), report_output_path(report_id), shallow=False):
+            raise RuntimeError(f"Parallel report with {workers} workers differs from the bulk report")
+        results.append(("parallel", workers, elapsed))
+        os.remove(report_output_path(report_id))
+    os.remove(report_output_path(baseline_id))
+
+    print(f"\n{'engine':<10}{'workers':>8}{'seconds':>10}{'speedup':>10}")
+    for mode, workers, elapsed in results:
+        print(f"{mode:<10}{workers:>8}{elapsed:>10.2f}{baseline / elapsed:>10.2f}")
+
+if __name__ == "__main__":
+    main()
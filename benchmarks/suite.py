@@ -0,0 +1,223 @@
+"""
+Benchmark ingestion, per-store calculation and report generation at several scales.
+
+For every store count a synthetic dataset is generated (benchmarks.synthetic)
+in a scratch directory and measured in a fresh interpreter with its own
+SQLite database. Timings are written as JSON, and --compare prints the ratio
+against an earlier results file.
+
+Usage:
+    python -m benchmarks.suite [--stores 1000 10000 100000] [--seed 42]
+        [--engines bulk,bulk:vectorized,rollup] [--output results.json]
+        [--compare previous.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_suite(args):
+    from benchmarks.synthetic import generate_dataset
+
+    results = []
+    for stores in args.stores:
+        work_dir = tempfile.mkdtemp(prefix=f"bench-{stores}-", dir=args.work_dir)
+        try:
+            started = time.perf_counter()
+            rows = generate_dataset(work_dir, stores, args.seed, args.poll_minutes, args.days)
+            generate_seconds = time.perf_counter() - started
+            print(f"[{stores} stores] generated {rows} in {generate_seconds:.2f}s")
+
+            # A fresh interpreter per scale: the database path is relative to the
+            # working directory and caches must start cold
+            result_file = os.path.join(work_dir, "result.json")
+            env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.suite", "--measure", result_file,
+                 "--engines", args.engines, "--sample", str(args.sample), "--seed", str(args.seed)],
+                cwd=work_dir, env=env, check=True,
+                stdout=None if args.verbose else subprocess.DEVNULL
+            )
+            with open(result_file) as f:
+                measured = json.load(f)
+        finally:
+            if not args.keep:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        result = {'stores': stores, 'rows': rows, 'generate_seconds': round(generate_seconds, 3), **measured}
+        print(f"[{stores} stores] {json.dumps(result)}")
+        results.append(result)
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'poll_minutes': args.poll_minutes,
+            'days': args.days,
+            'engines': args.engines.split(","),
+        },
+        'results': results,
+    }
+
+def measure(result_file, engines, sample, seed):
+    """Measure the dataset in the working directory; runs in the child process."""
+    os.makedirs("app", exist_ok=True)
+    from sqlalchemy import func
+    from app.models.models import (
+        Base, engine, SessionLocal, Report, StoreStatus, add_missing_columns, add_missing_indexes
+    )
+    from app.services.business_hours import business_hours_cache
+    from app.services.ingest_service import record_full_load
+    from app.services.report_service import (
+        DEFAULT_TIMEZONE, generate_report, load_report_window, compute_uptime_downtime_from_week
+    )
+    from app.utils.helpers import bulk_load_csv_data
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    add_missing_indexes()
+    db = SessionLocal()
+    result = {}
+
+    started = time.perf_counter()
+    bulk_load_csv_data()
+    record_full_load(db)
+    ingest_seconds = time.perf_counter() - started
+    rows = db.query(func.count(StoreStatus.id)).scalar()
+    result['ingest'] = {
+        'seconds': round(ingest_seconds, 3),
+        'rows_per_second': round(rows / ingest_seconds) if ingest_seconds else None,
+    }
+
+    if any(spec.split(":")[0] == "rollup" for spec in engines):
+        from app.services.rollup_service import refresh_hourly_rollup
+        started = time.perf_counter()
+        buckets = refresh_hourly_rollup(db)
+        db.commit()
+        result['rollup'] = {'seconds': round(time.perf_counter() - started, 3), 'buckets': buckets}
+
+    # Per-store calculation on preloaded data, so only the calculator is timed
+    max_timestamp = db.query(func.max(StoreStatus.timestamp_utc)).scalar()
+    timezones, business_hours, observations = load_report_window(max_timestamp, db)
+    store_ids = sorted(observations)
+    random.Random(seed).shuffle(store_ids)
+    timings = []
+    for store_id in store_ids[:sample]:
+        index = business_hours_cache.get_or_build(store_id, lambda: business_hours.get(store_id, []))
+        started = time.perf_counter()
+        compute_uptime_downtime_from_week(
+            store_id, max_timestamp, timezones.get(store_id, DEFAULT_TIMEZONE), index, observations[store_id]
+        )
+        timings.append((time.perf_counter() - started) * 1e6)
+    del timezones, business_hours, observations
+    result['calculate'] = _summary_us(timings)
+
+    result['reports'] = {}
+    for spec in engines:
+        mode, _, calculator = spec.partition(":")
+        business_hours_cache.clear()
+        report_id = f"bench-{mode}-{calculator or 'default'}"
+        started = time.perf_counter()
+        generate_report(report_id, db, mode=mode, calculator=calculator or None)
+        elapsed = time.perf_counter() - started
+        report = db.query(Report).filter(Report.id == report_id).first()
+        result['reports'][spec] = {
+            'seconds': round(elapsed, 3),
+            'status': report.status,
+            'phases': json.loads(report.timings)['phases'] if report.timings else None,
+        }
+
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    db.close()
+
+    with open(result_file, "w") as f:
+        json.dump(result, f)
+
+def compare(current, previous):
+    """Print the ratio of every timing in current to the same one in previous."""
+    before = {result['stores']: result for result in previous['results']}
+    print(f"\nCompared with {previous['meta'].get('commit')} (ratio > 1 is slower)")
+    for result in current['results']:
+        old = before.get(result['stores'])
+        if old is None:
+            continue
+        for name, new_value, old_value in _timings(result, old):
+            print(f"  {result['stores']:>7} stores  {name:<28}{old_value:>10.3f} -> {new_value:>10.3f}  x{new_value / old_value:.2f}")
+
+def _timings(new, old):
+    pairs = [('ingest', 'ingest', 'seconds'), ('rollup', 'rollup', 'seconds'), ('calculate p50 us', 'calculate', 'p50')]
+    for name, section, key in pairs:
+        if section in new and section in old and old[section].get(key):
+            yield name, new[section][key], old[section][key]
+    for spec, report in new.get('reports', {}).items():
+        previous = old.get('reports', {}).get(spec)
+        if previous and previous.get('seconds'):
+            yield f"report {spec}", report['seconds'], previous['seconds']
+
+def _summary_us(timings):
+    if not timings:
+        return {'stores': 0}
+    timings = sorted(timings)
+    return {
+        'stores': len(timings),
+        'mean': round(statistics.mean(timings), 1),
+        'p50': round(timings[len(timings) // 2], 1),
+        'p95': round(timings[int(len(timings) * 0.95)], 1),
+        'max': round(timings[-1], 1),
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stores", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--poll-minutes", type=float, default=60.0)
+    parser.add_argument("--days", type=int, default=8)
+    parser.add_argument("--engines", default="bulk,bulk:vectorized,rollup",
+                        help="comma-separated engine[:calculator] specs to run generate_report with")
+    parser.add_argument("--sample", type=int, default=500, help="stores timed individually by the calculator")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--work-dir", help="where scratch datasets are created (default: system temp)")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch datasets and databases")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the measured code")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.engines.split(","), args.sample, args.seed)
+        return
+
+    results = run_suite(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
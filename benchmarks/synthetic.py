@@ -0,0 +1,180 @@
+"""
+Generate a seeded synthetic dataset in the format of the real CSV files.
+
+Writes store_status.csv, menu_hours.csv and timezones.csv for any number of
+stores. The same arguments always produce byte-identical files.
+
+Usage:
+    python -m benchmarks.synthetic --stores 1000 [--seed 42] [--poll-minutes 60]
+        [--days 8] [--out DIR]
+"""
+import argparse
+import csv
+import os
+import time
+import uuid
+import numpy as np
+from datetime import datetime
+
+# End of the generated observations; fixed so reports are reproducible
+END_TIME = datetime(2023, 1, 25, 18, 13, 22)
+
+# Business hour shapes and how often each is drawn. "missing" stores have no
+# menu_hours rows and are treated as open 24/7
+HOURS_SHAPES = {
+    'missing': 0.15,
+    'day': 0.35,
+    'overnight': 0.15,
+    'split': 0.15,
+    'partial_week': 0.1,
+    'all_day': 0.1,
+}
+
+TIMEZONES = {
+    'America/Chicago': 0.35,
+    'America/New_York': 0.25,
+    'America/Los_Angeles': 0.2,
+    'America/Denver': 0.1,
+    'America/Boise': 0.05,
+    'Asia/Kolkata': 0.03,
+    'Europe/London': 0.02,
+}
+
+# Share of stores without a timezones.csv row (they default to America/Chicago)
+MISSING_TIMEZONE_RATE = 0.1
+
+# Per-store probability of an observation being active, drawn uniformly
+RELIABILITY_LEVELS = [0.0, 0.3, 0.8, 0.95, 1.0]
+
+# Stores generated at a time, bounding memory for large datasets
+STORE_CHUNK = 5000
+
+def generate_dataset(out_dir, stores, seed=42, poll_minutes=60.0, days=8, drop_rate=0.05,
+                     hours_shapes=None, timezones=None):
+    """
+    Write a synthetic dataset to out_dir.
+
+    Every store is polled roughly every poll_minutes (with +-15% jitter and
+    drop_rate of polls missing) over the days before END_TIME, with an
+    activity rate drawn from RELIABILITY_LEVELS. Business hour shapes and
+    timezones are drawn from the given weights.
+
+    Args:
+        out_dir: Directory to write the CSV files to
+        stores: Number of stores
+        seed: Random seed
+        poll_minutes: Mean minutes between observations of a store
+        days: Days of observations before END_TIME
+        drop_rate: Share of polls without an observation
+        hours_shapes: Weights by business hour shape (defaults to HOURS_SHAPES)
+        timezones: Weights by timezone (defaults to TIMEZONES)
+
+    Returns:
+        dict: Row counts of the three files
+    """
+    rng = np.random.default_rng(seed)
+    hours_shapes = hours_shapes or HOURS_SHAPES
+    timezones = timezones or TIMEZONES
+    os.makedirs(out_dir, exist_ok=True)
+
+    store_ids = [str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(stores)]
+    shapes = _draw(rng, hours_shapes, stores)
+    zones = _draw(rng, timezones, stores)
+    has_zone = rng.random(stores) >= MISSING_TIMEZONE_RATE
+
+    counts = {
+        'store_status': _write_status(
+            os.path.join(out_dir, 'store_status.csv'), rng, store_ids, poll_minutes, days, drop_rate
+        ),
+        'menu_hours': 0,
+        'timezones': 0,
+    }
+
+    with open(os.path.join(out_dir, 'menu_hours.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['store_id', 'dayOfWeek', 'start_time_local', 'end_time_local'])
+        for store_id, shape in zip(store_ids, shapes):
+            rows = list(_hours_rows(rng, shape))
+            writer.writerows([store_id, day, start, end] for day, start, end in rows)
+            counts['menu_hours'] += len(rows)
+
+    with open(os.path.join(out_dir, 'timezones.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['store_id', 'timezone_str'])
+        for store_id, zone, present in zip(store_ids, zones, has_zone):
+            if present:
+                writer.writerow([store_id, zone])
+                counts['timezones'] += 1
+
+    return counts
+
+def _draw(rng, weights, size):
+    names = list(weights)
+    p = np.array([weights[name] for name in names], dtype=float)
+    return [names[i] for i in rng.choice(len(names), size=size, p=p / p.sum())]
+
+def _write_status(path, rng, store_ids, poll_minutes, days, drop_rate):
+    end_us = int((END_TIME - datetime(1970, 1, 1)).total_seconds() * 1e6)
+    start_us = end_us - days * 86400 * 10 ** 6
+    poll_us = poll_minutes * 60e6
+    polls = int(days * 1440 / poll_minutes) + 2
+
+    rows = 0
+    with open(path, 'w', newline='') as f:
+        f.write('store_id,status,timestamp_utc\n')
+        for first in range(0, len(store_ids), STORE_CHUNK):
+            chunk = store_ids[first:first + STORE_CHUNK]
+            n = len(chunk)
+
+            # Poll times: a random phase, then jittered intervals
+            intervals = rng.uniform(0.85, 1.15, size=(n, polls)) * poll_us
+            intervals[:, 0] = rng.uniform(0, 1, size=n) * poll_us
+            times = start_us + np.cumsum(intervals, axis=1).astype(np.int64)
+            reliability = rng.choice(RELIABILITY_LEVELS, size=n)
+            active = rng.random((n, polls)) < reliability[:, None]
+            keep = (times < end_us) & (rng.random((n, polls)) >= drop_rate)
+
+            store_index, poll_index = np.nonzero(keep)
+            stamps = np.datetime_as_string(times[store_index, poll_index].astype('datetime64[us]'), unit='us')
+            statuses = np.where(active[store_index, poll_index], 'active', 'inactive')
+            f.writelines(
+                f"{chunk[s]},{status},{stamp[:10]} {stamp[11:]} UTC\n"
+                for s, status, stamp in zip(store_index.tolist(), statuses.tolist(), stamps.tolist())
+            )
+            rows += len(store_index)
+    return rows
+
+def _hours_rows(rng, shape):
+    """Yield (day_of_week, start, end) rows for a business hour shape."""
+    if shape == 'missing':
+        return
+    open_hour = int(rng.integers(6, 12))
+    for day in range(7):
+        if shape == 'day':
+            yield day, f'{open_hour:02d}:00:00', f'{open_hour + 12:02d}:30:00'
+        elif shape == 'overnight':
+            yield day, '18:00:00', f'{open_hour - 4:02d}:00:00'
+        elif shape == 'split':
+            yield day, f'{open_hour:02d}:00:00', '14:00:00'
+            yield day, '17:00:00', '23:00:00'
+        elif shape == 'partial_week' and day < 5:
+            yield day, f'{open_hour:02d}:00:00', '20:00:00'
+        elif shape == 'all_day':
+            yield day, '00:00:00', '23:59:59'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stores", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--poll-minutes", type=float, default=60.0, help="mean minutes between observations")
+    parser.add_argument("--days", type=int, default=8, help="days of observations")
+    parser.add_argument("--drop-rate", type=float, default=0.05, help="share of polls without an observation")
+    parser.add_argument("--out", default=".", help="directory to write the CSV files to")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = generate_dataset(args.out, args.stores, args.seed, args.poll_minutes, args.days, args.drop_rate)
+    print(f"Generated {counts} in {time.perf_counter() - started:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Check that the store uptime index answers like the CSV report.
+
+Generates a synthetic dataset (benchmarks.synthetic) in a scratch directory,
+loads it, and compares every store's /stores/{id}/uptime answer from the
+in-memory index with its row in a bulk report. It then moves every store to
+another timezone in timezones.csv, ingests the change with ingest_incremental
+as /ingest_csv does, and compares again: the index must pick up timezones
+updated in place. Exits with status 1 on any difference.
+
+Usage:
+    python -m benchmarks.uptime_index_check [--stores 400] [--seed 42] [--keep]
+"""
+import argparse
+import csv
+import os
+import shutil
+import sys
+import tempfile
+
+def compare(db, label):
+    """Mismatched stores between a fresh bulk report and the index."""
+    from app.models.models import Report
+    from app.services.report_service import generate_report
+    from app.services.report_windows import STANDARD_WINDOWS, window_fields
+    from app.services.store_uptime_index import store_uptime_index
+
+    report_id = f"uptime-index-{label}"
+    generate_report(report_id, db, mode="bulk")
+    with open(db.query(Report).filter(Report.id == report_id).first().file_path, newline="") as f:
+        rows = list(csv.DictReader(f))
+
+    mismatched = []
+    for row in rows:
+        answer = store_uptime_index.uptime(row['store_id'], STANDARD_WINDOWS, db)
+        for window in STANDARD_WINDOWS:
+            values = answer['windows'][window.name] if answer else {'uptime': None, 'downtime': None}
+            uptime_field, downtime_field = window_fields(window)
+            if (str(values['uptime']), str(values['downtime'])) != (row[uptime_field], row[downtime_field]):
+                mismatched.append(row['store_id'])
+                break
+    print(f"[{label}] {len(rows) - len(mismatched)} of {len(rows)} stores match the report")
+    for store_id in mismatched[:5]:
+        print(f"  {store_id}: index {store_uptime_index.uptime(store_id, STANDARD_WINDOWS, db)}")
+    return mismatched
+
+def move_timezones(path):
+    """Give every store in timezones.csv a different timezone."""
+    from benchmarks.synthetic import TIMEZONES
+
+    zones = list(TIMEZONES)
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        row['timezone_str'] = zones[(zones.index(row['timezone_str']) + 1) % len(zones)]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=['store_id', 'timezone_str'])
+        writer.writeheader()
+        writer.writerows(rows)
+    return len(rows)
+
+def run(args):
+    from benchmarks.synthetic import generate_dataset
+
+    work_dir = tempfile.mkdtemp(prefix="uptime-index-", dir=args.work_dir)
+    try:
+        generate_dataset(work_dir, args.stores, args.seed)
+        # The database path is relative to the working directory
+        os.chdir(work_dir)
+        os.makedirs("app", exist_ok=True)
+        os.makedirs("reports", exist_ok=True)
+        from app.models.models import Base, engine, SessionLocal, add_missing_columns, add_missing_indexes
+        from app.services.ingest_service import TIMEZONE_FILE, ingest_incremental
+        from app.utils.helpers import load_csv_data
+
+        Base.metadata.create_all(bind=engine)
+        add_missing_columns()
+        add_missing_indexes()
+        load_csv_data()
+
+        db = SessionLocal()
+        try:
+            mismatched = compare(db, "loaded")
+            print(f"Moved {move_timezones(TIMEZONE_FILE)} stores to another timezone")
+            summary = ingest_incremental()
+            if not summary['timezone_stores']:
+                print("The timezone change was not ingested")
+                return False
+            db.expire_all()
+            mismatched += compare(db, "timezones-updated")
+        finally:
+            db.close()
+        return not mismatched
+    finally:
+        os.chdir(args.start_dir)
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stores", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--work-dir", help="Directory for the scratch dataset (defaults to the system temp dir)")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch dataset")
+    args = parser.parse_args()
+    args.start_dir = os.getcwd()
+    sys.exit(0 if run(args) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+import argparse
+from app.models.models import Base, engine, add_missing_columns, add_missing_indexes
+from app.services.ingest_service import ingest_incremental
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ingest rows added to the CSV files since the last load.")
+    parser.add_argument("--data-dir", default=".", help="directory containing the CSV files")
+    args = parser.parse_args()
+    
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    add_missing_indexes()
+    ingest_incremental(args.data_dir)
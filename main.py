@@ -1,11 +1,16 @@
-from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException
+from fastapi import FastAPI, HTTPException
 from fastapi.responses import FileResponse
-import uuid
 import os
-from sqlalchemy.orm import Session
-from app.models.models import Base, engine, SessionLocal, Report
-from app.services.report_service import generate_report
-from app.api.routes import router as api_router
+from datetime import datetime
+from app.core.config import STATUS_RETENTION_DAYS
+from app.models.models import Base, engine, SessionLocal, add_missing_columns, add_missing_indexes, run_db
+from app.services.report_cache import create_or_reuse_report, create_report_batch
+from app.services.report_formats import FORMATS, get_format
+from app.services.historical_report import backfill_anchors
+from app.services.report_windows import parse_windows, format_windows
+from app.services.status_retention import check_retained_windows
+from app.services.report_scheduler import report_scheduler, QueueFull
+from app.api.routes import router as api_router, find_report
 
 # Create reports directory if it doesn't exist
 os.makedirs("reports", exist_ok=True)
@@ -33,34 +38,126 @@ def get_db():
 async def startup_event():
     # Create database tables
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    add_missing_indexes()
+    
+    # Reports can't survive a restart; drop those past retention
+    from app.services.report_cache import fail_interrupted_reports, evict_reports
+    from app.services.query_plans import check_query_plans
+    db = SessionLocal()
+    try:
+        fail_interrupted_reports(db)
+        evict_reports(db)
+        
+        # Warn if the report queries would scan store_status
+        check_query_plans(db)
+    finally:
+        db.close()
     
     # Load data from CSV files
     from app.utils.helpers import load_csv_data
     load_csv_data()
+    
+    # Compact or drop observations past the retention period in the background
+    if STATUS_RETENTION_DAYS:
+        from app.services.status_retention import retention_job
+        retention_job.start()
+
+# Stop retention and write observations still buffered by /ingest_status before exiting
+@app.on_event("shutdown")
+def shutdown_event():
+    from app.services.status_buffer import status_buffer
+    from app.services.status_retention import retention_job
+    retention_job.stop()
+    status_buffer.close()
 
 @app.get("/trigger_report")
-async def trigger_report(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def trigger_report(
+    priority: int = 0,
+    profile: bool = False,
+    windows: str = None,
+    as_of: datetime = None,
+    as_of_end: datetime = None,
+    every: str = "1d",
+    format: str = "csv"
+):
     """
     Trigger the generation of a new report.
     
+    If the data hasn't changed since a report that is queued, running or
+    complete, that report's ID is returned instead of starting a new one.
+    New reports wait in the job queue; when it is full the request is
+    rejected with 503 and a Retry-After header.
+    
+    With as_of the windows end at that time instead of the newest
+    observation. Adding as_of_end backfills a report every `every` from
+    as_of to as_of_end; the reports are computed together by one job and
+    each has its own ID.
+    
+    Args:
+        priority (int): Priority of the report job, higher runs first
+        profile (bool): Always start a new report and record a stack
+            sampling profile of it (see /report_timings)
+        windows (str): Extra trailing windows to report besides the hour,
+            day and week, e.g. "15m,30d" (m, h, d or w units)
+        as_of (datetime): Time the windows end at, UTC unless it has an offset
+        as_of_end (datetime): Last as_of time of a backfill, inclusive
+        every (str): Interval between the as_of times of a backfill
+        format (str): File format: csv, csv.gz, csv.zst, ndjson, parquet or
+            arrow (the last three need optional packages)
+    
     Returns:
-        dict: A dictionary containing the report ID
+        dict: A dictionary containing the report ID and whether it was
+            reused; backfills also list every report's ID and as_of time
     """
-    # Generate a unique report ID
-    report_id = str(uuid.uuid4())
+    try:
+        windows = format_windows(parse_windows(windows))
+        report_format = get_format(format).name
+        # Live reports only see the observations retention keeps
+        if as_of is None:
+            check_retained_windows(parse_windows(windows))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if as_of_end is not None and as_of is None:
+        raise HTTPException(status_code=400, detail="as_of_end requires as_of")
+    try:
+        anchors = backfill_anchors(as_of, as_of_end, every)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Create a new report record
-    new_report = Report(id=report_id)
-    db.add(new_report)
-    db.commit()
+    # CSV reports are recorded without a format, like those from before formats existed
+    report_format = None if report_format == "csv" else report_format
     
-    # Start report generation in a background task
-    background_tasks.add_task(generate_report, report_id, db)
+    def submit(report_id, priority):
+        report_scheduler.submit(report_id, priority, profile=profile)
+    
+    if as_of_end is not None:
+        try:
+            report_ids = await run_db(
+                create_report_batch, submit, anchors, priority, windows=windows, report_format=report_format
+            )
+        except QueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+        return {
+            "report_id": report_ids[0],
+            "report_ids": report_ids,
+            "as_of": [anchor.isoformat() for anchor in anchors],
+            "cached": False,
+        }
+    
+    # Reuse a report for unchanged data, otherwise queue a new one
+    try:
+        report_id, is_new = await run_db(
+            create_or_reuse_report, submit, priority, reuse=not profile, windows=windows, as_of=anchors[0],
+            report_format=report_format
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
     
-    return {"report_id": report_id}
+    return {"report_id": report_id, "cached": not is_new}
 
 @app.get("/get_report")
-async def get_report(report_id: str, db: Session = Depends(get_db)):
+async def get_report(report_id: str):
     """
     Get the status of a report or download the report if it's ready.
     
@@ -73,7 +170,7 @@ async def get_report(report_id: str, db: Session = Depends(get_db)):
     if not report_id:
         raise HTTPException(status_code=400, detail="report_id is required")
     
-    report = db.query(Report).filter(Report.id == report_id).first()
+    report = await run_db(find_report, report_id)
     if not report:
         raise HTTPException(status_code=404, detail="Report not found")
     
@@ -85,10 +182,11 @@ async def get_report(report_id: str, db: Session = Depends(get_db)):
     if report.status == "Complete":
         # Check if file exists
         if report.file_path and os.path.exists(report.file_path):
+            report_format = FORMATS[report.format or "csv"]
             return FileResponse(
                 path=report.file_path, 
-                filename="report.csv", 
-                media_type="text/csv"
+                filename=f"report{report_format.extension}", 
+                media_type=report_format.media_type
             )
         else:
             raise HTTPException(status_code=500, detail=f"Report file not found at {report.file_path}")
@@ -104,5 +202,11 @@ async def root():
         "endpoints": [
             {"name": "Trigger Report", "path": "/trigger_report", "method": "GET"},
             {"name": "Get Report", "path": "/get_report?report_id={report_id}", "method": "GET"},
+            {"name": "Cancel Report", "path": "/cancel_report?report_id={report_id}", "method": "POST"},
+            {"name": "Report Timings", "path": "/report_timings?report_id={report_id}", "method": "GET"},
+            {"name": "Store Uptime", "path": "/stores/{store_id}/uptime?windows=hour,day,week", "method": "GET"},
+            {"name": "Metrics", "path": "/metrics", "method": "GET"},
+            {"name": "Ingest CSV", "path": "/ingest_csv", "method": "POST"},
+            {"name": "Ingest Status", "path": "/ingest_status[?wait=true]", "method": "POST"},
         ]
     } 
\ No newline at end of file
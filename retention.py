@@ -0,0 +1,19 @@
+import argparse
+from app.core.config import STATUS_RETENTION_DAYS, STATUS_RETENTION_MODE
+from app.models.models import Base, engine, add_missing_columns, add_missing_indexes
+from app.services.status_retention import RETENTION_MODES, compact_status, maintain_database
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compact or drop store_status polls older than the retention period.")
+    parser.add_argument("--days", type=float, default=STATUS_RETENTION_DAYS,
+                        help="days kept before the newest observation (default STATUS_RETENTION_DAYS)")
+    parser.add_argument("--mode", choices=RETENTION_MODES, default=STATUS_RETENTION_MODE)
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the database afterwards")
+    args = parser.parse_args()
+    
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    add_missing_indexes()
+    summary = compact_status(args.days, args.mode)
+    if summary['polls_deleted'] or summary['buckets_deleted'] or args.vacuum:
+        maintain_database(args.vacuum)
@@ -1,11 +1,22 @@
-from app import create_app
+from app.models.models import Base, engine, SessionLocal, Report, add_missing_columns, add_missing_indexes
 from app.services.report_service import generate_report
+from app.utils.helpers import load_csv_data
 import uuid
 
 if __name__ == '__main__':
-    app = create_app()
-    with app.app_context():
+    # Same setup as the application's startup event
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    add_missing_indexes()
+    load_csv_data()
+
+    db = SessionLocal()
+    try:
         test_report_id = str(uuid.uuid4())
         print(f"Generated test report ID: {test_report_id}")
-        generate_report(test_report_id, app)
-        print("Report generation complete!") 
\ No newline at end of file
+        generate_report(test_report_id, db)
+
+        report = db.query(Report).filter(Report.id == test_report_id).first()
+        print(f"Report generation finished with status {report.status}: {report.file_path}")
+    finally:
+        db.close()
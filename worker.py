@@ -0,0 +1,29 @@
+"""
+Run a shard worker for the distributed report engine.
+
+Claims shards of running reports from the report_shard table of DATABASE_URL,
+computes them and uploads their rows until interrupted. Start any number of
+workers, on this host or others sharing the database; a worker that dies
+loses its shard's lease and another one takes it over.
+
+Usage:
+    python worker.py [--worker-id ID] [--report-id REPORT_ID] [--exit-when-idle]
+"""
+import argparse
+from app.services.shard_queue import work
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--worker-id", help="ID recorded on claimed shards (default: host, process and a suffix)")
+    parser.add_argument("--report-id", help="only work on shards of this report")
+    parser.add_argument("--exit-when-idle", action="store_true", help="exit once no shard can be claimed")
+    args = parser.parse_args()
+
+    try:
+        done = work(args.worker_id, args.report_id, exit_when_idle=args.exit_when_idle)
+        print(f"Uploaded {done} shards")
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()